@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Multi-format export benchmark
+
+Compares exporting one sale to TXT + PDF + PNG + printer the old way
+(every exporter calls generate_text() and re-splits the string) with
+building one ReceiptDocument and handing it to every backend.
+
+Usage: python benchmarks/bench_export.py [--lines N] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import receipt_app
+import receipt_tool
+from receipt_core import EscPosBackend
+
+
+def make_receipt(lines: int) -> receipt_tool.Receipt:
+    receipt = receipt_tool.Receipt(config=dict(receipt_tool.DEFAULT_CONFIG))
+    for i in range(lines):
+        receipt.add_product(f"Vuokrakone {i:04d}", 1 + i % 3, 10.0 + i)
+    return receipt
+
+
+def export_legacy(receipt: receipt_tool.Receipt, out_dir: str):
+    """One render per format, as before the shared document"""
+    with open(os.path.join(out_dir, "r.txt"), "w", encoding="utf-8") as f:
+        f.write(receipt.generate_text())
+    if receipt_tool.REPORTLAB_AVAILABLE:
+        receipt_tool.ReceiptExporter.export_pdf(receipt, os.path.join(out_dir, "r.pdf"))
+    else:
+        receipt.generate_text().split("\n")
+    text = receipt.generate_text()
+    if receipt_app.PILLOW_AVAILABLE:
+        receipt_app.ReceiptPrinter.save_as_png(text, os.path.join(out_dir, "r.png"))
+    else:
+        text.split("\n")
+    receipt.generate_text().encode("cp858", errors="replace")
+
+
+def export_document(receipt: receipt_tool.Receipt, out_dir: str):
+    """One render shared by all backends"""
+    document = receipt.build_document()
+    receipt_tool.ReceiptExporter.export_txt(document, os.path.join(out_dir, "r.txt"))
+    if receipt_tool.REPORTLAB_AVAILABLE:
+        receipt_tool.ReceiptExporter.export_pdf(document, os.path.join(out_dir, "r.pdf"))
+    else:
+        document.lines()
+    if receipt_app.PILLOW_AVAILABLE:
+        receipt_app.ReceiptPrinter.save_as_png(document, os.path.join(out_dir, "r.png"))
+    else:
+        document.lines()
+    EscPosBackend.render(document)
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=200, help="products per receipt")
+    parser.add_argument("--repeat", type=int, default=20, help="repetitions, best time is reported")
+    args = parser.parse_args()
+
+    receipt = make_receipt(args.lines)
+    with tempfile.TemporaryDirectory() as out_dir:
+        legacy = best_of(lambda: export_legacy(receipt, out_dir), args.repeat)
+        shared = best_of(lambda: export_document(receipt, out_dir), args.repeat)
+
+    print(f"Receipt lines:      {args.lines}")
+    print(f"PDF backend:        {'reportlab' if receipt_tool.REPORTLAB_AVAILABLE else 'not installed (render only)'}")
+    print(f"PNG backend:        {'Pillow' if receipt_app.PILLOW_AVAILABLE else 'not installed (render only)'}")
+    print(f"Render per format:  {legacy * 1000:.2f} ms")
+    print(f"Shared document:    {shared * 1000:.2f} ms")
+    print(f"Speedup:            {legacy / shared:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
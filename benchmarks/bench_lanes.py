@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Checkout-lane load generator
+
+Simulates N checkout lanes making realistic sales: random carts from
+data/products.json, a card/cash mix over PaymentMethod and CardType,
+warranty registrations and occasional preset switches. Sales arrive
+open-loop: each lane has its own Poisson arrival stream, so a slow
+engine builds up a queue instead of slowing the arrivals down.
+Latency is measured from the scheduled arrival to the finished
+receipt, so it includes queueing delay.
+
+Each step reports throughput, latency percentiles and the backlog
+(sales that arrived but never started). --sweep raises the rate step
+by step until the engine saturates: throughput falls below 95% of the
+offered rate or p99 exceeds --slo-ms. The last rate before that is
+reported as the saturation point.
+
+The target is the in-process engine (KuittikoneManager lanes on a
+private copy of --config) or, with --url, a local service endpoint
+taking kuitti-api.php style POSTs ({"tuotteet": [{"nimi", "maara",
+"hinta"}]}). In-process lanes share one interpreter and its GIL; use
+--processes to spread lanes over several engine processes, each with
+its own config copy.
+
+Usage: python benchmarks/bench_lanes.py [--lanes N] [--rate R] [--duration S] [--sweep]
+                                        [--processes P] [--url URL] [--output FILE]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import kuittikone
+from bench_suite import environment
+
+CATALOG_FILE = Path(__file__).resolve().parent.parent / "data" / "products.json"
+CARD_TYPES = [card for card in kuittikone.CardType if card is not kuittikone.CardType.UNKNOWN]
+# Share of sales per payment method
+PAYMENT_MIX = (
+    (kuittikone.PaymentMethod.CARD, 0.70),
+    (kuittikone.PaymentMethod.CASH, 0.20),
+    (kuittikone.PaymentMethod.MOBILE, 0.08),
+    (kuittikone.PaymentMethod.INVOICE, 0.02),
+)
+
+
+# Sales
+
+def load_catalog(path: Path) -> List[Dict]:
+    """Sellable products as name, price and SKU"""
+    with open(path, encoding="utf-8") as f:
+        products = json.load(f)
+    catalog = [
+        {"name": p["name"], "price": float(p["price"]), "sku": p.get("sku") or p["id"]}
+        for p in products if p.get("name") and p.get("price") is not None
+    ]
+    if not catalog:
+        raise ValueError(f"No products in {path}")
+    return catalog
+
+
+@dataclass
+class Sale:
+    products: List[Dict]
+    payment_method: kuittikone.PaymentMethod
+    card_type: Optional[kuittikone.CardType]
+    serial_number: Optional[str]
+    switch_preset: Optional[str]
+
+
+class SaleMix:
+    """Random but reproducible sales for one lane"""
+
+    def __init__(
+        self,
+        catalog: List[Dict],
+        presets: List[str],
+        seed: int,
+        warranty_share: float,
+        switch_share: float,
+        max_lines: int
+    ):
+        self.catalog = catalog
+        self.presets = presets
+        self.rng = random.Random(seed)
+        self.warranty_share = warranty_share
+        self.switch_share = switch_share
+        self.max_lines = max_lines
+        self._methods = [method for method, _ in PAYMENT_MIX]
+        self._weights = [weight for _, weight in PAYMENT_MIX]
+        self._serial = 0
+        self._lane = seed
+
+    def next(self) -> Sale:
+        rng = self.rng
+        # Mostly small carts, now and then a big one
+        lines = min(self.max_lines, int(rng.expovariate(1 / 3)) + 1)
+        products = []
+        for _ in range(lines):
+            item = rng.choice(self.catalog)
+            products.append({"name": item["name"], "quantity": rng.randint(1, 3), "price": item["price"]})
+        method = rng.choices(self._methods, self._weights)[0]
+        card_type = rng.choice(CARD_TYPES) if method is kuittikone.PaymentMethod.CARD else None
+        serial_number = None
+        if rng.random() < self.warranty_share:
+            self._serial += 1
+            serial_number = f"{rng.choice(self.catalog)['sku']}-L{self._lane}-{self._serial:06d}"
+        switch_preset = None
+        if self.presets and rng.random() < self.switch_share:
+            switch_preset = rng.choice(self.presets)
+        return Sale(products, method, card_type, serial_number, switch_preset)
+
+
+# Targets
+
+class EngineTarget:
+    """Lanes on an in-process KuittikoneManager"""
+
+    def __init__(self, config_file: str):
+        self.manager = kuittikone.KuittikoneManager(config_file)
+        if not self.manager.list_presets():
+            for preset in kuittikone.create_default_presets():
+                self.manager.add_company_preset(preset)
+            self.manager.switch_preset(self.manager.list_presets()[0].preset_id)
+
+    def presets(self) -> List[str]:
+        return [preset.preset_id for preset in self.manager.list_presets()]
+
+    def open_lane(self, lane_id: str) -> kuittikone.CheckoutLane:
+        return self.manager.open_lane(lane_id)
+
+    def run(self, lane: kuittikone.CheckoutLane, sale: Sale):
+        if sale.switch_preset:
+            lane.switch_preset(sale.switch_preset)
+        for product in sale.products:
+            lane.add_product(product["name"], product["quantity"], product["price"])
+        if sale.serial_number:
+            self.manager.add_warranty(kuittikone.WarrantyInfo(
+                sale.serial_number, datetime.now().isoformat(), 24, sale.products[0]["name"]
+            ))
+            lane.add_serial_number(sale.serial_number)
+        lane.checkout(sale.payment_method, sale.card_type)
+
+
+class HttpTarget:
+    """Lanes posting sales to a kuitti-api.php style endpoint, one keep-alive connection each"""
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme or "http"
+        self.host = parts.netloc
+        self.path = parts.path or "/"
+        self.timeout = timeout
+
+    def presets(self) -> List[str]:
+        return []
+
+    def open_lane(self, lane_id: str) -> Dict[str, Any]:
+        return {"lane_id": lane_id, "connection": None}
+
+    def _connect(self) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.host, timeout=self.timeout)
+
+    def run(self, lane: Dict[str, Any], sale: Sale):
+        body = json.dumps({
+            "tuotteet": [
+                {"nimi": p["name"], "maara": p["quantity"], "hinta": p["price"]} for p in sale.products
+            ],
+            "tulosta": False,
+            "kassa": lane["lane_id"],
+            "maksutapa": sale.payment_method.value,
+            "kortti": sale.card_type.value if sale.card_type else None,
+            "sarjanumero": sale.serial_number,
+        }, ensure_ascii=False).encode("utf-8")
+        if lane["connection"] is None:
+            lane["connection"] = self._connect()
+        try:
+            lane["connection"].request("POST", self.path, body, {"Content-Type": "application/json"})
+            response = lane["connection"].getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            lane["connection"].close()
+            lane["connection"] = None
+            raise
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+        if json.loads(payload).get("success") is False:
+            raise RuntimeError("success: false")
+
+
+def make_target(spec: Tuple[str, str]):
+    kind, value = spec
+    return HttpTarget(value) if kind == "http" else EngineTarget(value)
+
+
+# Load
+
+def run_lane(target, lane_id: str, rate: float, duration: float, mix: SaleMix,
+             start: float, results: Dict[str, Any]):
+    """Serve one lane's Poisson arrivals until duration is over"""
+    lane = target.open_lane(lane_id)
+    rng = random.Random(mix.rng.random())
+    latencies = results["latencies"]
+    arrival = rng.expovariate(rate)
+    perf_counter = time.perf_counter
+    while arrival < duration:
+        now = perf_counter() - start
+        if now >= duration:
+            break
+        if now < arrival:
+            time.sleep(arrival - now)
+        sale = mix.next()
+        try:
+            target.run(lane, sale)
+        except Exception:
+            results["errors"] += 1
+        else:
+            latencies.append(perf_counter() - start - arrival)
+        arrival += rng.expovariate(rate)
+    # Sales that arrived but were never started
+    while arrival < duration:
+        results["backlog"] += 1
+        arrival += rng.expovariate(rate)
+
+
+def run_group(spec: Tuple[str, str], lane_ids: List[str], rate: float, duration: float,
+              seed: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Run some lanes on threads against one target; used per process"""
+    work_dir = None
+    if spec[0] == "engine":
+        # Private config copy: warranty registrations rewrite it
+        work_dir = tempfile.mkdtemp()
+        config_file = os.path.join(work_dir, "kuittikone_config.json")
+        if os.path.exists(spec[1]):
+            shutil.copyfile(spec[1], config_file)
+        spec = ("engine", config_file)
+    try:
+        target = make_target(spec)
+        catalog = load_catalog(Path(options["catalog"]))
+        presets = target.presets()
+        lane_results = [{"latencies": [], "errors": 0, "backlog": 0} for _ in lane_ids]
+        start = time.perf_counter() + 0.05
+        threads = [
+            threading.Thread(target=run_lane, args=(
+                target, lane_id, rate, duration,
+                SaleMix(catalog, presets, seed + int(lane_id), options["warranty_share"],
+                        options["switch_share"], options["max_lines"]),
+                start, result
+            ), daemon=True)
+            for lane_id, result in zip(lane_ids, lane_results)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return {
+            "latencies": [t for result in lane_results for t in result["latencies"]],
+            "errors": sum(result["errors"] for result in lane_results),
+            "backlog": sum(result["backlog"] for result in lane_results),
+            "elapsed": elapsed,
+        }
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(fraction * len(sorted_values) + 0.999999) - 1))
+    return sorted_values[index]
+
+
+def run_step(spec: Tuple[str, str], lanes: int, processes: int, rate: float, duration: float,
+             seed: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Offer rate sales/s over all lanes for duration seconds"""
+    lane_ids = [str(n) for n in range(1, lanes + 1)]
+    per_lane = rate / lanes
+    if processes <= 1:
+        groups = [run_group(spec, lane_ids, per_lane, duration, seed, options)]
+    else:
+        chunks = [lane_ids[n::processes] for n in range(processes) if lane_ids[n::processes]]
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [
+                executor.submit(run_group, spec, chunk, per_lane, duration, seed, options)
+                for chunk in chunks
+            ]
+            groups = [future.result() for future in futures]
+    latencies = sorted(t for group in groups for t in group["latencies"])
+    elapsed = max(group["elapsed"] for group in groups)
+    return {
+        "offered_rate": rate,
+        "throughput": len(latencies) / elapsed,
+        "completed": len(latencies),
+        "errors": sum(group["errors"] for group in groups),
+        "backlog": sum(group["backlog"] for group in groups),
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+def saturated(step: Dict[str, Any], slo_ms: float) -> bool:
+    return (
+        step["throughput"] < 0.95 * step["offered_rate"]
+        or step["p99_ms"] > slo_ms
+        or step["errors"] > 0.01 * max(1, step["completed"])
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lanes", type=int, default=8, help="checkout lanes")
+    parser.add_argument("--rate", type=float, default=50.0, help="sales per second over all lanes (sweep start)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per step")
+    parser.add_argument("--sweep", action="store_true", help="raise the rate until saturation")
+    parser.add_argument("--sweep-factor", type=float, default=1.5, help="rate multiplier per sweep step")
+    parser.add_argument("--max-steps", type=int, default=12, help="sweep steps at most")
+    parser.add_argument("--slo-ms", type=float, default=100.0, help="p99 latency target")
+    parser.add_argument("--processes", type=int, default=1, help="engine processes (in-process target)")
+    parser.add_argument("--config", default=kuittikone.KUITTIKONE_CONFIG,
+                        help="config to copy for the in-process engine (default presets if missing)")
+    parser.add_argument("--url", help="drive this service endpoint instead of the in-process engine")
+    parser.add_argument("--catalog", default=str(CATALOG_FILE), help="products JSON")
+    parser.add_argument("--warranty-share", type=float, default=0.05, help="share of sales registering a warranty")
+    parser.add_argument("--switch-share", type=float, default=0.01, help="share of sales switching preset first")
+    parser.add_argument("--max-lines", type=int, default=30, help="cart lines at most")
+    parser.add_argument("--seed", type=int, default=1, help="sales seed")
+    parser.add_argument("--output", help="write results JSON here (default stdout)")
+    args = parser.parse_args()
+
+    spec = ("http", args.url) if args.url else ("engine", os.path.abspath(args.config))
+    options = {
+        "catalog": args.catalog,
+        "warranty_share": args.warranty_share,
+        "switch_share": args.switch_share,
+        "max_lines": args.max_lines,
+    }
+    steps = []
+    saturation_point = None
+    rate = args.rate
+    for _ in range(args.max_steps if args.sweep else 1):
+        step = run_step(spec, args.lanes, args.processes, rate, args.duration, args.seed, options)
+        steps.append(step)
+        print(
+            f"offered {step['offered_rate']:8.1f}/s  throughput {step['throughput']:8.1f}/s  "
+            f"p50 {step['p50_ms']:7.1f} ms  p99 {step['p99_ms']:8.1f} ms  "
+            f"backlog {step['backlog']:6d}  errors {step['errors']}",
+            file=sys.stderr
+        )
+        if saturated(step, args.slo_ms):
+            break
+        saturation_point = rate
+        rate *= args.sweep_factor
+    if args.sweep:
+        if saturation_point is None:
+            print("Saturated at the first step, lower --rate", file=sys.stderr)
+        else:
+            print(f"Saturation point: {saturation_point:.1f} sales/s with {args.lanes} lanes", file=sys.stderr)
+
+    report = {
+        "schema": 1,
+        "suite": "checkout_lanes",
+        "environment": environment(),
+        "parameters": {
+            "target": spec[0],
+            "url": args.url,
+            "lanes": args.lanes,
+            "processes": args.processes,
+            "duration_s": args.duration,
+            "slo_ms": args.slo_ms,
+            "warranty_share": args.warranty_share,
+            "switch_share": args.switch_share,
+            "max_lines": args.max_lines,
+            "seed": args.seed,
+        },
+        "steps": steps,
+        "saturation_point": saturation_point if args.sweep else None,
+    }
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Warranty table serialization benchmark
+
+Builds a synthetic warranty table with the slotted kuittikone model and
+with plain dataclasses encoded through dataclasses.asdict (the previous
+model), and compares encode time, JSON write time with the json module
+and orjson, and the memory taken by the objects.
+
+Usage: python benchmarks/bench_model.py [--warranties N] [--repeat N]
+"""
+
+import argparse
+import dataclasses
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import kuittikone
+import receipt_core
+
+
+@dataclasses.dataclass
+class PlainWarrantyInfo:
+    """WarrantyInfo as it was before slots and field-by-field encoding"""
+    serial_number: str
+    purchase_date: str
+    warranty_months: int
+    product_name: str
+    return_days: int = 14
+    notes: str = ""
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+
+def make_warranties(cls, count: int) -> dict:
+    return {
+        f"SN-{n:07d}": cls(f"SN-{n:07d}", f"2024-{n % 12 + 1:02d}-15T10:30:00", 12 + n % 4 * 12, f"Tuote {n % 500}")
+        for n in range(count)
+    }
+
+
+def allocated_bytes(cls, count: int) -> int:
+    tracemalloc.start()
+    table = make_warranties(cls, count)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del table
+    return size
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--warranties", type=int, default=100_000, help="warranties in the table")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions, best time is reported")
+    args = parser.parse_args()
+
+    plain = make_warranties(PlainWarrantyInfo, args.warranties)
+    slotted = make_warranties(kuittikone.WarrantyInfo, args.warranties)
+    encode = lambda table: {serial: info.to_dict() for serial, info in table.items()}
+    assert encode(plain) == encode(slotted)
+
+    plain_encode = best_of(lambda: encode(plain), args.repeat)
+    slotted_encode = best_of(lambda: encode(slotted), args.repeat)
+
+    path = str(Path(tempfile.gettempdir()) / "bench_model.json")
+    payload = {"warranty_database": encode(slotted)}
+    with mock.patch.object(receipt_core, "ORJSON_AVAILABLE", False):
+        json_write = best_of(lambda: receipt_core.dump_json_file(payload, path), args.repeat)
+        json_read = best_of(lambda: receipt_core.load_json_file(path), args.repeat)
+
+    plain_bytes = allocated_bytes(PlainWarrantyInfo, args.warranties)
+    slotted_bytes = allocated_bytes(kuittikone.WarrantyInfo, args.warranties)
+
+    print(f"Warranties:             {args.warranties}")
+    print(f"Encode, asdict:         {plain_encode * 1000:.1f} ms")
+    print(f"Encode, field-by-field: {slotted_encode * 1000:.1f} ms ({plain_encode / slotted_encode:.1f}x)")
+    print(f"Write, json:            {json_write * 1000:.1f} ms")
+    print(f"Read, json:             {json_read * 1000:.1f} ms")
+    write = json_write
+    if receipt_core.ORJSON_AVAILABLE:
+        write = best_of(lambda: receipt_core.dump_json_file(payload, path), args.repeat)
+        orjson_read = best_of(lambda: receipt_core.load_json_file(path), args.repeat)
+        print(f"Write, orjson:          {write * 1000:.1f} ms ({json_write / write:.1f}x)")
+        print(f"Read, orjson:           {orjson_read * 1000:.1f} ms ({json_read / orjson_read:.1f}x)")
+    else:
+        print("orjson:                 not installed")
+    before = plain_encode + json_write
+    after = slotted_encode + write
+    print(f"Save, before / after:   {before * 1000:.1f} ms / {after * 1000:.1f} ms ({before / after:.1f}x)")
+    print(f"Objects, plain:         {plain_bytes / 2**20:.1f} MiB")
+    print(f"Objects, slotted:       {slotted_bytes / 2**20:.1f} MiB "
+          f"({(1 - slotted_bytes / plain_bytes) * 100:.0f}% less)")
+    Path(path).unlink()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Batch money totals benchmark
+
+Computes subtotal, VAT and total in cents, and the per-rate VAT report,
+for a synthetic history of receipt lines with the NumPy path and the
+pure Python fallback, and checks both give the same cents.
+
+Usage: python benchmarks/bench_money.py [--lines N] [--receipts N] [--mixed-vat] [--repeat N]
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import receipt_core
+
+
+VAT_RATES = (0.255, 0.14, 0.1, 0.0)
+
+
+def make_history(lines: int, receipts: int, mixed_vat: bool, seed: int = 1):
+    rng = random.Random(seed)
+    quantities = [rng.randint(1, 5) for _ in range(lines)]
+    prices = [round(rng.uniform(0.5, 900.0), 2) for _ in range(lines)]
+    receipt_ids = [rng.randrange(receipts) for _ in range(lines)]
+    vat_rates = [rng.choice(VAT_RATES) for _ in range(lines)] if mixed_vat else None
+    return quantities, prices, receipt_ids, vat_rates
+
+
+def best_of(func, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=1_000_000, help="receipt lines in the history")
+    parser.add_argument("--receipts", type=int, default=100_000, help="receipts the lines belong to")
+    parser.add_argument("--mixed-vat", action="store_true", help="give lines random VAT rates")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions, best time is reported")
+    args = parser.parse_args()
+
+    quantities, prices, receipt_ids, vat_rates = make_history(args.lines, args.receipts, args.mixed_vat)
+    run = lambda: receipt_core.batch_totals(quantities, prices, receipt_ids, 0.255, vat_rates)
+
+    with mock.patch.object(receipt_core, "NUMPY_AVAILABLE", False):
+        python_time, python_result = best_of(run, args.repeat)
+
+    print(f"Lines / receipts:   {args.lines} / {args.receipts}")
+    print(f"Pure Python:        {python_time * 1000:.1f} ms")
+    if not receipt_core.NUMPY_AVAILABLE:
+        print("NumPy:              not installed")
+        return 0
+
+    numpy_time, numpy_result = best_of(run, args.repeat)
+    same = numpy_result["by_rate"] == python_result["by_rate"] and \
+        list(numpy_result["vat_cents"]) == python_result["vat_cents"]
+    print(f"NumPy:              {numpy_time * 1000:.1f} ms")
+    print(f"Speedup:            {python_time / numpy_time:.1f}x")
+    print(f"Same cents:         {same}")
+    print(f"Grand total:        {receipt_core.format_cents(numpy_result['sum_total_cents'])} €")
+    for rate, (net, vat) in numpy_result["by_rate"].items():
+        print(f"  ALV {receipt_core.format_rate(rate):>4}%:  net {receipt_core.format_cents(net)} €, "
+              f"VAT {receipt_core.format_cents(vat)} €")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Promo rule evaluation benchmark
+
+Times promo evaluation for presets with a growing number of rules: the
+previous linear walk over every PromoRule (string dispatch and float()
+per amount rule on every receipt) against the compiled PromoIndex
+(bisect over sorted thresholds, card rules by CardType), and checks
+both give the same lines for random sales.
+
+product_contains rules are timed the same way: a substring scan of
+every product name per rule against one pass of the shared
+Aho-Corasick automaton over the cart.
+
+The discount stage is timed as part of generate_receipt for growing
+carts, against the same preset with its add_discount rules disabled.
+
+PromoSchedule lookups are timed with a growing number of expired and
+future campaigns next to the same live rules, for receipts following
+each other and for timestamps spread over a day.
+
+simulate_promos is timed over synthetic sales histories of growing
+size against running the same receipts one by one through
+PromoSchedule and the discount stage, extrapolated from a sample.
+
+Usage: python benchmarks/bench_promo.py [--rules N [N ...]] [--keywords N [N ...]]
+                                       [--cart-lines N [N ...]] [--campaigns N [N ...]]
+                                       [--history N [N ...]] [--sales N] [--repeat N]
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import kuittikone
+
+CARD_TYPES = list(kuittikone.CardType)
+PRODUCT_WORDS = ["kaivinkone", "nosturi", "iskuporakone", "vasara", "aggregaatti", "kuormaaja"]
+
+
+def evaluate_linear(rules, amount, card_type):
+    """_evaluate_promo_rules as it was before the compiled index"""
+    promo_lines = []
+    for rule in rules:
+        if not rule.enabled:
+            continue
+        applies = False
+        if rule.condition_type == "amount_over":
+            applies = amount > float(rule.condition_value)
+        elif rule.condition_type == "card_type" and card_type:
+            applies = card_type.value == rule.condition_value
+        if applies:
+            if rule.action_type == "add_line":
+                promo_lines.append(rule.action_value)
+            elif rule.action_type == "add_bonus_code":
+                promo_lines.append(f"Bonuskoodi: {rule.action_value}")
+    return promo_lines
+
+
+def evaluate_products_linear(rules, names):
+    """Substring scan of every product name for every product_contains rule"""
+    names = [name.casefold() for name in names]
+    return [
+        rule.action_value for rule in rules
+        if any(rule.condition_value.casefold() in name for name in names)
+    ]
+
+
+def make_product_rules(count: int, rng: random.Random):
+    """One keyword per rule; a few common ones, the rest rarely sold"""
+    rules = []
+    for n in range(count):
+        keyword = rng.choice(PRODUCT_WORDS) if n % 100 == 0 else f"malli{n:05d}x"
+        rules.append(kuittikone.PromoRule(
+            f"product_{n}", f"Product {n}", "product_contains", keyword, "add_line", f"Tuotetarjous {n}"
+        ))
+    return rules
+
+
+def make_carts(count: int, rng: random.Random):
+    return [
+        [
+            f"{rng.choice(PRODUCT_WORDS).capitalize()} malli{rng.randint(0, 99999):05d}"
+            for _ in range(rng.randint(1, 12))
+        ]
+        for _ in range(count)
+    ]
+
+
+def make_rules(count: int, rng: random.Random):
+    """Mostly amount thresholds spread far above typical sales, some card rules"""
+    rules = []
+    for n in range(count):
+        if n % 4 == 3:
+            condition = ("card_type", rng.choice(CARD_TYPES).value)
+        else:
+            condition = ("amount_over", rng.choice((50, 100, 250)) if n % 50 == 0 else rng.randint(1000, 100000))
+        rules.append(kuittikone.PromoRule(
+            f"rule_{n}", f"Rule {n}", condition[0], condition[1],
+            "add_bonus_code" if n % 5 == 0 else "add_line", f"Tarjous {n}", enabled=n % 10 != 9
+        ))
+    return rules
+
+
+def make_sales(count: int, rng: random.Random):
+    return [
+        (round(rng.uniform(5.0, 800.0), 2), rng.choice(CARD_TYPES + [None]))
+        for _ in range(count)
+    ]
+
+
+def make_discount_preset(rules: int, rng: random.Random, discounts: bool) -> kuittikone.CompanyPreset:
+    """Promo-heavy preset where every tenth rule is a discount, a third of those product discounts"""
+    preset = kuittikone.create_default_presets()[0]
+    preset.preset_id = "discounts" if discounts else "no_discounts"
+    preset.promo_rules = make_rules(rules, rng) + make_product_rules(rules // 2, rng)
+    for n, rule in enumerate(preset.promo_rules[::10]):
+        rule.action_type = "add_discount"
+        rule.action_value = "5%" if n % 2 else "2.00"
+        rule.priority = n % 3
+        rule.exclusive = n % 25 == 24
+        rule.enabled = discounts
+    return preset
+
+
+def make_campaign_rules(campaigns: int, rng: random.Random):
+    """100 live rules, some windowed, plus campaigns that ended or have not started"""
+    rules = make_rules(100, rng)
+    for n, rule in enumerate(rules[::5]):
+        rule.weekdays = [n % 7, (n + 3) % 7]
+        rule.time_from, rule.time_until = ("16:00", "18:00") if n % 2 else ("22:00", "02:00")
+    for n in range(campaigns):
+        start = datetime(2020, 1, 1) + timedelta(days=rng.randint(0, 4000))
+        if datetime(2025, 1, 1) <= start <= datetime(2025, 12, 31):
+            start += timedelta(days=800)
+        rules.append(kuittikone.PromoRule(
+            f"campaign_{n}", f"Campaign {n}", "amount_over", rng.randint(0, 500), "add_line", f"Kampanja {n}",
+            valid_from=start.date().isoformat(), valid_until=(start + timedelta(days=14)).date().isoformat()
+        ))
+    return rules
+
+
+def make_simulation_rules():
+    """Candidate rule set mixing every condition, discounts and windows"""
+    rules = []
+    for n in range(3):
+        rules += [
+            kuittikone.PromoRule(f"amount_{n}", "", "amount_over", 100 * (n + 1), "add_line", f"Kiitos {n}"),
+            kuittikone.PromoRule(f"over_{n}", f"Yli {500 * (n + 1)} -5%", "amount_over", 500 * (n + 1),
+                                 "add_discount", "5%", priority=1),
+            kuittikone.PromoRule(f"card_{n}", "", "card_type", CARD_TYPES[n].value, "add_bonus_code", f"KORTTI{n}"),
+            kuittikone.PromoRule(f"product_{n}", f"{PRODUCT_WORDS[n]} -20%", "product_contains",
+                                 [PRODUCT_WORDS[n], PRODUCT_WORDS[n + 3]], "add_discount", "20%", priority=5),
+            kuittikone.PromoRule(f"friday_{n}", f"Perjantai {n}", "product_contains", PRODUCT_WORDS[n + 1],
+                                 "add_discount", "5.00", weekdays=[4, 5], time_from="16:00", time_until="18:00"),
+            kuittikone.PromoRule(f"summer_{n}", f"Kesä {n}", "amount_over", 0, "add_discount", "10%",
+                                 valid_from=f"2025-0{n + 6}-01", valid_until=f"2025-0{n + 6}-20", exclusive=True),
+            kuittikone.PromoRule(f"amex_{n}", f"Amex {n}", "card_type", "amex", "add_discount", "2%"),
+        ]
+    return rules
+
+
+def make_history(count: int, seed: int) -> kuittikone.SalesHistory:
+    """Receipts of 1-7 lines over a year, built directly as columns"""
+    import numpy
+    rng = numpy.random.default_rng(seed)
+    lines = rng.integers(1, 8, count)
+    line_receipt = numpy.repeat(numpy.arange(count), lines)
+    line_cents = rng.integers(100, 50000, len(line_receipt))
+    names = [f"{word.capitalize()} malli{n:04d}" for n in range(500) for word in PRODUCT_WORDS]
+    start = (datetime(2025, 1, 1) - datetime(1970, 1, 1)) // timedelta(seconds=1)
+    return kuittikone.SalesHistory(
+        numpy.bincount(line_receipt, weights=line_cents, minlength=count).astype(numpy.int64),
+        rng.integers(-1, len(CARD_TYPES), count),
+        start + rng.integers(0, 365 * 24 * 3600, count),
+        line_receipt, line_cents, rng.integers(0, len(names), len(line_receipt)), names
+    )
+
+
+def simulate_one_by_one(history: kuittikone.SalesHistory, rules) -> int:
+    """Discount cents of every receipt run through PromoSchedule and apply_discounts"""
+    import numpy
+    schedule = kuittikone.PromoSchedule(rules)
+    ends = numpy.searchsorted(history.line_receipt, numpy.arange(len(history) + 1))
+    total = 0
+    for receipt in range(len(history)):
+        lines = slice(ends[receipt], ends[receipt + 1])
+        code = history.card_codes[receipt]
+        result = schedule.at(datetime(1970, 1, 1) + timedelta(seconds=int(history.seconds[receipt]))).apply_discounts(
+            history.amount_cents[receipt] / 100, CARD_TYPES[code] if code >= 0 else None,
+            [history.names[i] for i in history.line_names[lines]], history.line_cents[lines].tolist()
+        )
+        total += result.total_cents
+    return total
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rules", type=int, nargs="+", default=[10, 100, 1000, 10000], help="rules per preset")
+    parser.add_argument("--keywords", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="product_contains rules per preset")
+    parser.add_argument("--cart-lines", type=int, nargs="+", default=[10, 100, 1000],
+                        help="products per cart in the discount stage timing")
+    parser.add_argument("--campaigns", type=int, nargs="+", default=[0, 1000, 10000, 100000],
+                        help="expired and future campaigns in the schedule timing")
+    parser.add_argument("--history", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="receipts in the simulation timing")
+    parser.add_argument("--sales", type=int, default=1000, help="sales evaluated per timing")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions, best time is reported")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    sales = make_sales(args.sales, rng)
+    print(f"{'rules':>7} {'linear':>12} {'indexed':>12} {'compile':>12} {'speedup':>8}")
+    for count in args.rules:
+        rules = make_rules(count, rng)
+        index = kuittikone.PromoIndex(rules)
+        for amount, card_type in sales:
+            assert index.evaluate(amount, card_type) == evaluate_linear(rules, amount, card_type)
+        linear = best_of(lambda: [evaluate_linear(rules, a, c) for a, c in sales], args.repeat) / len(sales)
+        indexed = best_of(lambda: [index.evaluate(a, c) for a, c in sales], args.repeat) / len(sales)
+        compile_time = best_of(lambda: kuittikone.PromoIndex(rules), args.repeat)
+        print(f"{count:>7} {linear * 1e6:10.2f}us {indexed * 1e6:10.2f}us "
+              f"{compile_time * 1e6:10.1f}us {linear / indexed:7.1f}x")
+
+    carts = make_carts(args.sales, rng)
+    print(f"\n{'keywords':>8} {'scan':>12} {'automaton':>12} {'compile':>12} {'speedup':>8}")
+    for count in args.keywords:
+        rules = make_product_rules(count, rng)
+        index = kuittikone.PromoIndex(rules)
+        for names in carts:
+            assert index.evaluate(0.0, None, names) == evaluate_products_linear(rules, names)
+        scan = best_of(lambda: [evaluate_products_linear(rules, names) for names in carts], args.repeat) / len(carts)
+        matched = best_of(lambda: [index.evaluate(0.0, None, names) for names in carts], args.repeat) / len(carts)
+        compile_time = best_of(lambda: kuittikone.PromoIndex(rules), args.repeat)
+        print(f"{count:>8} {scan * 1e6:10.2f}us {matched * 1e6:10.2f}us "
+              f"{compile_time * 1e6:10.1f}us {scan / matched:7.1f}x")
+
+    with tempfile.TemporaryDirectory() as directory:
+        manager = kuittikone.KuittikoneManager(f"{directory}/config.json", warm_start=False)
+        manager.add_company_preset(make_discount_preset(1000, random.Random(2), discounts=True))
+        manager.add_company_preset(make_discount_preset(1000, random.Random(2), discounts=False))
+        print(f"\n{'lines':>7} {'discounts':>12} {'without':>12} {'overhead':>9}")
+        for count in args.cart_lines:
+            products = [
+                {
+                    "name": f"{rng.choice(PRODUCT_WORDS).capitalize()} malli{rng.randint(0, 99999):05d}",
+                    "quantity": rng.randint(1, 3),
+                    "price": round(rng.uniform(1.0, 500.0), 2)
+                }
+                for _ in range(count)
+            ]
+            receipts = max(1, args.sales // count)
+
+            def render(preset_id):
+                for _ in range(receipts):
+                    manager.generate_receipt(
+                        products, kuittikone.PaymentMethod.CARD, kuittikone.CardType.VISA, preset_id=preset_id
+                    )
+
+            with_discounts = best_of(lambda: render("discounts"), args.repeat) / receipts
+            without = best_of(lambda: render("no_discounts"), args.repeat) / receipts
+            print(f"{count:>7} {with_discounts * 1e3:10.3f}ms {without * 1e3:10.3f}ms "
+                  f"{(with_discounts / without - 1) * 100:8.1f}%")
+
+    print(f"\n{'campaigns':>9} {'next receipt':>13} {'any time':>12} {'compile':>12}")
+    day = datetime(2025, 6, 6)
+    sequential = [day + timedelta(seconds=30 * n) for n in range(args.sales)]
+    spread = [day + timedelta(minutes=rng.randint(0, 24 * 60 - 1)) for _ in range(args.sales)]
+    for count in args.campaigns:
+        rules = make_campaign_rules(count, rng)
+        compile_time = best_of(lambda: kuittikone.PromoSchedule(rules), 1)
+        schedule = kuittikone.PromoSchedule(rules)
+        for when in spread:
+            schedule.at(when)  # Compile the indexes of the day once
+        following = best_of(lambda: [schedule.at(when) for when in sequential], args.repeat) / len(sequential)
+        any_time = best_of(lambda: [schedule.at(when) for when in spread], args.repeat) / len(spread)
+        print(f"{count:>9} {following * 1e6:11.2f}us {any_time * 1e6:10.2f}us {compile_time * 1e3:10.1f}ms")
+
+    if not kuittikone.NUMPY_AVAILABLE:
+        print("\nSimulation skipped: NumPy not installed")
+        return 0
+    rules = make_simulation_rules()
+    print(f"\n{'receipts':>9} {'simulate':>10} {'one by one':>11} {'speedup':>8}  ({len(rules)} rules)")
+    for count in args.history:
+        history = make_history(count, 3)
+        sample = make_history(min(count, args.sales), 4)
+        simulated = kuittikone.simulate_promos(sample, rules)
+        assert simulated["discount_cents"] == simulate_one_by_one(sample, rules)
+        vectorised = best_of(lambda: kuittikone.simulate_promos(history, rules), 1)
+        one_by_one = best_of(lambda: simulate_one_by_one(sample, rules), 1) / len(sample) * count
+        print(f"{count:>9} {vectorised:9.2f}s {one_by_one:10.2f}s {one_by_one / vectorised:7.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Kuittikone start-up benchmark
+
+Writes a config with the default presets and a synthetic warranty
+database, then times KuittikoneManager start-up from the JSON file
+(json module and orjson) and from the warm-start snapshot, plus the cost
+the snapshot adds to saves.
+
+Usage: python benchmarks/bench_startup.py [--warranties N] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import kuittikone
+import receipt_core
+
+
+def make_config(path: str, warranties: int):
+    manager = kuittikone.KuittikoneManager(path, warm_start=False)
+    for preset in kuittikone.create_default_presets():
+        manager.add_company_preset(preset)
+    for n in range(warranties):
+        manager.warranty_db[f"SN-{n:07d}"] = kuittikone.WarrantyInfo(
+            f"SN-{n:07d}", f"2024-{n % 12 + 1:02d}-15T10:30:00", 12 + n % 4 * 12, f"Tuote {n % 500}",
+            notes="Vuokrakone" if n % 7 == 0 else ""
+        )
+    manager._save_config()
+
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--warranties", type=int, default=50_000, help="warranties in the config")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions, best time is reported")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "kuittikone_config.json")
+    make_config(path, args.warranties)
+
+    def start(warm_start: bool):
+        manager = kuittikone.KuittikoneManager(path, warm_start=warm_start)
+        manager.get_warranty("SN-0000001")
+        return manager
+
+    with mock.patch.object(receipt_core, "ORJSON_AVAILABLE", False):
+        cold_json = best_of(lambda: start(False), args.repeat)
+    cold = best_of(lambda: start(False), args.repeat)
+    start(True)
+    warm = best_of(lambda: start(True), args.repeat)
+
+    # The first save after a warm start unpacks the warranty rows once
+    first_save = best_of(lambda: start(True)._save_config(), args.repeat) - warm
+    manager = start(True)
+    save_cold = best_of(lambda: (setattr(manager, "warm_start", False), manager._save_config()), args.repeat)
+    save_warm = best_of(lambda: (setattr(manager, "warm_start", True), manager._save_config()), args.repeat)
+    warm_manager = start(True)
+    warm_manager._flush_warranty_db()
+    assert warm_manager.config == start(False).config
+
+    print(f"Warranties:          {args.warranties}")
+    print(f"Config / snapshot:   {os.path.getsize(path) / 2**20:.1f} MiB / "
+          f"{os.path.getsize(receipt_core.snapshot_path(path)) / 2**20:.1f} MiB")
+    print(f"Start, json:         {cold_json * 1000:.1f} ms")
+    if receipt_core.ORJSON_AVAILABLE:
+        print(f"Start, orjson:       {cold * 1000:.1f} ms")
+    print(f"Start, snapshot:     {warm * 1000:.1f} ms ({cold_json / warm:.1f}x json, {cold / warm:.1f}x best parser)")
+    print(f"Save, without / with snapshot: {save_cold * 1000:.1f} ms / {save_warm * 1000:.1f} ms")
+    print(f"First save after snapshot start: {first_save * 1000:.1f} ms")
+
+    for name in (path, receipt_core.snapshot_path(path)):
+        os.unlink(name)
+    os.rmdir(directory)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
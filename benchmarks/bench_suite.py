@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Receipt engine benchmark suite
+
+Generates synthetic datasets (default presets plus one with a large
+promo rule set, 10/100/1000-line carts, a 100k-warranty config) from a
+fixed seed and times the receipt engines: KuittikoneManager receipts
+and promo evaluation, receipt_tool text, TXT/PDF export and PNG save,
+config load/save, USB backup/restore, event loop tick delay during an
+AsyncKuittikoneManager backup and receipt number allocation.
+Results are written as JSON with environment metadata (Python,
+platform, optional backends, git commit), so runs on different commits
+can be compared with --compare.
+Benchmarks whose optional backend is missing are recorded as skipped.
+
+Usage: python benchmarks/bench_suite.py [--output FILE] [--quick] [--filter TEXT]
+                                        [--repeat N] [--min-time S] [--compare BASELINE]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import kuittikone
+import receipt_app
+import receipt_core
+import receipt_tool
+
+SCHEMA_VERSION = 1
+CART_SIZES = (10, 100, 1000)
+VAT_RATES = (0.255, 0.14, 0.1)
+TIMESTAMP = datetime(2025, 6, 2, 9, 30)
+
+
+# Datasets
+
+def make_cart(lines: int, seed: int) -> List[Dict]:
+    rng = random.Random(seed)
+    return [
+        {"name": f"Vuokrakone {rng.randrange(10000):04d} {'raskas' if i % 5 == 0 else 'kevyt'}",
+         "quantity": rng.randint(1, 5), "price": round(rng.uniform(1.0, 900.0), 2)}
+        for i in range(lines)
+    ]
+
+
+def make_promo_preset(rules: int, seed: int) -> kuittikone.CompanyPreset:
+    """hrk_default with a large rule set mixing every condition type"""
+    rng = random.Random(seed)
+    preset = kuittikone.create_default_presets()[0]
+    preset.preset_id = "promo_heavy"
+    preset.promo_rules = []
+    cards = [card.value for card in kuittikone.CardType]
+    for n in range(rules):
+        kind = n % 3
+        if kind == 0:
+            condition = ("amount_over", rng.choice((50, 100, 250, 500, 1000, 5000)))
+        elif kind == 1:
+            condition = ("card_type", rng.choice(cards))
+        else:
+            condition = ("product_contains", rng.choice(("raskas", "kevyt", "nosturi", "pora")))
+        preset.promo_rules.append(kuittikone.PromoRule(
+            rule_id=f"rule_{n:05d}",
+            description=f"Synthetic rule {n}",
+            condition_type=condition[0],
+            condition_value=condition[1],
+            action_type="add_bonus_code" if n % 4 == 0 else "add_line",
+            action_value=f"Tarjous {n}",
+            enabled=n % 10 != 0
+        ))
+    return preset
+
+
+def make_config(path: str, warranties: int, promo_rules: int, seed: int):
+    manager = kuittikone.KuittikoneManager(path, warm_start=False)
+    for preset in kuittikone.create_default_presets():
+        manager.add_company_preset(preset)
+    manager.add_company_preset(make_promo_preset(promo_rules, seed))
+    rng = random.Random(seed)
+    for n in range(warranties):
+        serial = f"SN-{n:07d}"
+        manager.warranty_db[serial] = kuittikone.WarrantyInfo(
+            serial, f"2024-{rng.randint(1, 12):02d}-15T10:30:00", rng.choice((12, 24, 36)), f"Tuote {n % 500}"
+        )
+    manager._save_config()
+
+
+def make_tool_receipt(cart: List[Dict]) -> receipt_tool.Receipt:
+    receipt = receipt_tool.Receipt(config=dict(receipt_tool.DEFAULT_CONFIG), clock=lambda: TIMESTAMP)
+    for i, item in enumerate(cart):
+        receipt.add_product(item["name"], item["quantity"], item["price"], VAT_RATES[i % 3])
+    return receipt
+
+
+# Measurement
+
+def measure(func: Callable[[], Any], repeat: int, min_time: float) -> Dict[str, Any]:
+    """
+    Calibrate calls per round to take min_time, then time repeat rounds
+
+    Like timeit, the garbage collector is off while timing, so results do
+    not depend on how many objects earlier benchmarks left alive.
+    """
+    gc.collect()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _measure(func, repeat, min_time)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _measure(func: Callable[[], Any], repeat: int, min_time: float) -> Dict[str, Any]:
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min_s": min(rounds),
+        "median_s": statistics.median(rounds),
+        "mean_s": statistics.fmean(rounds),
+        "stdev_s": statistics.stdev(rounds) if len(rounds) > 1 else 0.0,
+    }
+
+
+class Suite:
+    """Collects benchmarks and runs those matching a filter"""
+
+    def __init__(self, repeat: int, min_time: float, name_filter: Optional[str]):
+        self.repeat = repeat
+        self.min_time = min_time
+        self.name_filter = name_filter
+        self.results: List[Dict[str, Any]] = []
+
+    def wanted(self, name: str) -> bool:
+        return self.name_filter is None or self.name_filter in name
+
+    def run(self, name: str, func: Callable[[], Any], skip: Optional[str] = None, **params):
+        if not self.wanted(name):
+            return
+        result: Dict[str, Any] = {"name": name, "params": params}
+        if skip:
+            result["skipped"] = skip
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result.update(measure(func, self.repeat, self.min_time))
+        self.results.append(result)
+        if skip:
+            print(f"{name:<52} skipped: {skip}", file=sys.stderr)
+        else:
+            print(f"{name:<52} {result['min_s'] * 1e6:12.1f} us", file=sys.stderr)
+
+    def record(self, name: str, values: Dict[str, Any], **params):
+        """Add a result measured by the benchmark itself rather than timed calls"""
+        self.results.append({"name": name, "params": params, **values})
+        print(f"{name:<52} {', '.join(f'{k}={v:.6g}' for k, v in values.items())}", file=sys.stderr)
+
+
+def environment() -> Dict[str, Any]:
+    def git(*args: str) -> Optional[str]:
+        try:
+            return subprocess.run(
+                ["git", *args], cwd=ROOT, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": git("rev-parse", "HEAD"),
+        "git_dirty": bool(status) if status is not None else None,
+        "backends": {
+            "numpy": receipt_core.NUMPY_AVAILABLE,
+            "orjson": receipt_core.ORJSON_AVAILABLE,
+            "reportlab": receipt_tool.REPORTLAB_AVAILABLE,
+            "pillow": receipt_app.PILLOW_AVAILABLE,
+        },
+    }
+
+
+# Benchmarks
+
+def bench_kuittikone(suite: Suite, config_path: str, carts: Dict[int, List[Dict]], promo_rules: int):
+    manager = kuittikone.KuittikoneManager(config_path)
+    manager.switch_preset("hrk_default")
+    card = kuittikone.PaymentMethod.CARD, kuittikone.CardType.VISA
+    for lines, cart in carts.items():
+        suite.run(
+            f"kuittikone.generate_receipt[cart={lines}]",
+            lambda: manager.generate_receipt(cart, *card, timestamp=TIMESTAMP),
+            cart_lines=lines
+        )
+    suite.run(
+        f"kuittikone.generate_receipt[promo_rules={promo_rules}]",
+        lambda: manager.generate_receipt(carts[10], *card, preset_id="promo_heavy", timestamp=TIMESTAMP),
+        cart_lines=10, promo_rules=promo_rules
+    )
+    preset = manager.get_company_preset("promo_heavy")
+    suite.run(
+        f"kuittikone._evaluate_promo_rules[rules={promo_rules}]",
+        lambda: manager._evaluate_promo_rules(preset, 750.0, kuittikone.CardType.VISA),
+        promo_rules=promo_rules
+    )
+
+
+def bench_receipt_tool(suite: Suite, carts: Dict[int, List[Dict]], out_dir: str):
+    receipts = {lines: make_tool_receipt(cart) for lines, cart in carts.items()}
+    for lines, receipt in receipts.items():
+        suite.run(
+            f"receipt_tool.generate_text[cart={lines}]",
+            lambda: receipt.generate_text(TIMESTAMP),
+            cart_lines=lines
+        )
+    receipt = receipts[100]
+    exporter = receipt_tool.ReceiptExporter
+    suite.run(
+        "receipt_tool.export_txt[cart=100]",
+        lambda: exporter.export_txt(receipt, os.path.join(out_dir, "r.txt")),
+        cart_lines=100
+    )
+    suite.run(
+        "receipt_tool.export_pdf[cart=100]",
+        lambda: exporter.export_pdf(receipt, os.path.join(out_dir, "r.pdf")),
+        skip=None if receipt_tool.REPORTLAB_AVAILABLE else "reportlab not installed",
+        cart_lines=100
+    )
+    suite.run(
+        "receipt_app.save_as_png[cart=100]",
+        lambda: receipt_app.ReceiptPrinter.save_as_png(receipt.build_document(TIMESTAMP), os.path.join(out_dir, "r.png")),
+        skip=None if receipt_app.PILLOW_AVAILABLE else "Pillow not installed",
+        cart_lines=100
+    )
+
+
+def bench_persistence(suite: Suite, config_path: str, warranties: int, out_dir: str):
+    def start(warm_start: bool):
+        manager = kuittikone.KuittikoneManager(config_path, warm_start=warm_start)
+        manager.get_warranty("SN-0000001")
+        return manager
+
+    suite.run(f"config.load[cold,warranties={warranties}]", lambda: start(False), warranties=warranties)
+    start(True)
+    suite.run(f"config.load[snapshot,warranties={warranties}]", lambda: start(True), warranties=warranties)
+    manager = start(True)
+    manager._flush_warranty_db()
+    suite.run(f"config.save[warranties={warranties}]", manager._save_config, warranties=warranties)
+    suite.run(f"config.backup_to_usb[warranties={warranties}]", lambda: manager.backup_to_usb(out_dir), warranties=warranties)
+    backup = max(Path(out_dir).glob("kuittikone_backup_*.json"), default=None)
+    if backup is not None:
+        suite.run(f"config.restore_from_usb[warranties={warranties}]", lambda: manager.restore_from_usb(str(backup)), warranties=warranties)
+
+
+def bench_async_backup(suite: Suite, config_path: str, warranties: int, out_dir: str):
+    """Delay of 2 ms event loop ticks while AsyncKuittikoneManager runs a USB backup"""
+    name = f"kuittikone.AsyncKuittikoneManager.loop_delay[backup,warranties={warranties}]"
+    if not suite.wanted(name):
+        return
+
+    async def tick_delays() -> List[float]:
+        async with kuittikone.AsyncKuittikoneManager(kuittikone.KuittikoneManager(config_path)) as kassa:
+            backup = asyncio.ensure_future(kassa.backup_to_usb(out_dir))
+            delays = []
+            while not backup.done() or len(delays) < 20:
+                start = time.perf_counter()
+                await asyncio.sleep(0.002)
+                delays.append(time.perf_counter() - start - 0.002)
+            await backup
+            return sorted(delays)
+
+    delays = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(suite.repeat):
+            delays.extend(asyncio.run(tick_delays()))
+    delays.sort()
+    suite.record(name, {
+        "ticks": len(delays),
+        "p50_s": delays[len(delays) // 2],
+        "p99_s": delays[int(len(delays) * 0.99) - 1],
+        "max_s": delays[-1],
+    }, warranties=warranties)
+
+
+def bench_sequencer(suite: Suite, out_dir: str):
+    directory = os.path.join(out_dir, "sequence")
+    for block_size, durable in ((100, False), (1, False), (100, True)):
+        with receipt_core.ReceiptSequencer(directory, block_size=block_size, durable=durable) as sequencer:
+            suite.run(
+                f"receipt_core.ReceiptSequencer.allocate[block={block_size}{',durable' if durable else ''}]",
+                lambda: sequencer.allocate("hrk"),
+                block_size=block_size, durable=durable
+            )
+
+
+def compare(baseline_path: str, results: List[Dict[str, Any]]):
+    """Print the change of each benchmark's best time against a baseline file with the same benchmark"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"] if "min_s" in r}
+    print(f"{'benchmark':<52} {'baseline':>12} {'current':>12} {'change':>8}")
+    for result in results:
+        old = baseline.get(result["name"])
+        if old is None or "min_s" not in result:
+            continue
+        change = result["min_s"] / old["min_s"] - 1
+        print(f"{result['name']:<52} {old['min_s'] * 1e6:10.1f}us {result['min_s'] * 1e6:10.1f}us {change:+8.1%}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="write results JSON here (default stdout)")
+    parser.add_argument("--quick", action="store_true", help="small datasets and short rounds, for smoke runs")
+    parser.add_argument("--filter", help="run only benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=None, help="timed rounds per benchmark (default 7, quick 3)")
+    parser.add_argument("--min-time", type=float, default=None, help="seconds per round (default 0.2, quick 0.02)")
+    parser.add_argument("--seed", type=int, default=1, help="dataset seed")
+    parser.add_argument("--compare", metavar="BASELINE", help="print changes against an earlier results file")
+    args = parser.parse_args()
+
+    warranties = 5_000 if args.quick else 100_000
+    promo_rules = 100 if args.quick else 1_000
+    repeat = args.repeat or (3 if args.quick else 7)
+    min_time = args.min_time if args.min_time is not None else (0.02 if args.quick else 0.2)
+    suite = Suite(repeat, min_time, args.filter)
+    carts = {lines: make_cart(lines, args.seed + lines) for lines in CART_SIZES}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        config_path = os.path.join(work_dir, "kuittikone_config.json")
+        make_config(config_path, warranties, promo_rules, args.seed)
+        bench_kuittikone(suite, config_path, carts, promo_rules)
+        bench_receipt_tool(suite, carts, work_dir)
+        bench_persistence(suite, config_path, warranties, work_dir)
+        bench_async_backup(suite, config_path, warranties, work_dir)
+        bench_sequencer(suite, work_dir)
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "suite": "receipt_engines",
+        "environment": environment(),
+        "parameters": {
+            "quick": args.quick,
+            "seed": args.seed,
+            "repeat": repeat,
+            "min_time_s": min_time,
+            "warranties": warranties,
+            "promo_rules": promo_rules,
+            "cart_sizes": list(CART_SIZES),
+        },
+        "results": suite.results,
+    }
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    if args.compare:
+        with contextlib.redirect_stdout(sys.stderr):
+            compare(args.compare, suite.results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -15,17 +15,50 @@ Complete offline receipt printer with:
 - Digital stamp/guarantee blocks
 - Custom footer generator
 - Offline promo engine
+- What-if promo simulation over sales history
 - Company-specific payment presets
 - USB backup/restore functionality
+- Concurrent checkout lanes sharing one manager
+- asyncio facade for event-loop backends
 """
 
+import argparse
+import asyncio
 import json
+import math
 import os
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from collections.abc import MutableMapping
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
-from dataclasses import dataclass, asdict
+from functools import partial
+from string import Formatter
+from typing import (
+    List, Dict, Optional, Any, Callable, FrozenSet, Hashable, Iterable, Iterator, Sequence, Set, Tuple, Union
+)
+from dataclasses import dataclass, fields
 from enum import Enum
 
+from receipt_core import (
+    BlockType, KeywordMatcher, MoneyTotals, ReceiptBlock, ReceiptDocument, ReceiptRenderCache, ReceiptSequencer,
+    StageTimer, TextLayout,
+    allocate_cents, display_width, dump_json_file, format_cents, format_rate, format_vat_breakdown, load_json_file,
+    load_json_snapshot, render_cache_key, to_cents, write_json_snapshot
+)
+
+# NumPy for promo simulation over sales history
+NUMPY_AVAILABLE = False
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    pass
+
 # Configuration file
 KUITTIKONE_CONFIG = "kuittikone_config.json"
 
@@ -69,6 +102,23 @@ class PaymentMethod(Enum):
     BANK_TRANSFER = "bank_transfer"
 
 
+def _slotted(cls):
+    """
+    Rebuild a dataclass with __slots__ for its fields
+    
+    Same as dataclass(slots=True), which needs Python 3.10. Instances have
+    no __dict__, which saves memory with large warranty tables.
+    """
+    names = tuple(field.name for field in fields(cls))
+    namespace = {
+        key: value for key, value in cls.__dict__.items()
+        if key not in names and key not in ("__dict__", "__weakref__")
+    }
+    namespace["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@_slotted
 @dataclass
 class PaymentCardPreset:
     """Payment card preset configuration"""
@@ -101,6 +151,7 @@ class PaymentCardPreset:
         )
 
 
+@_slotted
 @dataclass
 class WarrantyInfo:
     """Warranty tracking information"""
@@ -111,9 +162,9 @@ class WarrantyInfo:
     return_days: int = 14
     notes: str = ""
     
-    def is_warranty_valid(self) -> bool:
+    def is_warranty_valid(self, now: Optional[datetime] = None) -> bool:
         """
-        Check if warranty is still valid
+        Check if warranty is still valid (at now, default current time)
         
         Note: Uses approximation of 30 days per month for simplicity.
         A 12-month warranty is calculated as 360 days.
@@ -121,33 +172,33 @@ class WarrantyInfo:
         try:
             purchase = datetime.fromisoformat(self.purchase_date)
             expiry = purchase + timedelta(days=30 * self.warranty_months)
-            return datetime.now() < expiry
+            return (now or datetime.now()) < expiry
         except (ValueError, TypeError):
             return False
     
-    def is_return_valid(self) -> bool:
-        """Check if return period is still valid"""
+    def is_return_valid(self, now: Optional[datetime] = None) -> bool:
+        """Check if return period is still valid (at now, default current time)"""
         try:
             purchase = datetime.fromisoformat(self.purchase_date)
             expiry = purchase + timedelta(days=self.return_days)
-            return datetime.now() < expiry
+            return (now or datetime.now()) < expiry
         except (ValueError, TypeError):
             return False
     
-    def warranty_text(self) -> str:
-        """Generate warranty text for receipt"""
+    def warranty_text(self, now: Optional[datetime] = None) -> str:
+        """Generate warranty text for receipt, validity evaluated at now"""
         lines = []
         lines.append(f"Sarjanumero: {self.serial_number}")
         lines.append(f"Tuote: {self.product_name}")
         lines.append(f"Ostopvm: {self.purchase_date}")
         lines.append(f"Takuu: {self.warranty_months} kk")
         
-        if self.is_warranty_valid():
+        if self.is_warranty_valid(now):
             lines.append("✓ Takuu voimassa")
         else:
             lines.append("✗ Takuu päättynyt")
         
-        if self.is_return_valid():
+        if self.is_return_valid(now):
             lines.append(f"✓ Palautusoikeus voimassa ({self.return_days} pv)")
         else:
             lines.append("✗ Palautusoikeus päättynyt")
@@ -158,13 +209,137 @@ class WarrantyInfo:
         return "\n".join(lines)
     
     def to_dict(self) -> Dict:
-        return asdict(self)
+        return {
+            "serial_number": self.serial_number,
+            "purchase_date": self.purchase_date,
+            "warranty_months": self.warranty_months,
+            "product_name": self.product_name,
+            "return_days": self.return_days,
+            "notes": self.notes
+        }
     
     @classmethod
     def from_dict(cls, data: Dict):
         return cls(**data)
 
 
+WARRANTY_FIELDS = tuple(field.name for field in fields(WarrantyInfo))
+
+
+class WarrantyTable(MutableMapping):
+    """
+    Warranty database materialised on demand
+    
+    Records stay as the raw dicts of the configuration's
+    warranty_database and become WarrantyInfo objects only when a serial
+    is looked up or iterated over. Changed entries are tracked and
+    encoded back into the raw records by flush(), so saving never
+    re-encodes untouched warranties. Store changes through assignment (or
+    KuittikoneManager.add_warranty); editing a returned WarrantyInfo in
+    place is not tracked.
+    
+    Warm-start snapshots store the records as packed rows: field tuples
+    in WARRANTY_FIELDS order, or the raw dict for records with other keys.
+    A table started from a snapshot serves lookups from those rows and
+    unpacks them into records only when flush() needs the full
+    warranty_database. Once built, the rows are kept up to date so the
+    next snapshot does not repack the whole table.
+    """
+    
+    def __init__(self, records: Dict[str, Dict], packed: Optional[Dict[str, Any]] = None):
+        self.records = records
+        self._packed: Dict[str, Any] = packed if packed is not None else {}
+        self._rows: Optional[Dict[str, Any]] = packed
+        self._hydrated: Dict[str, WarrantyInfo] = {}
+        self._dirty: set = set()
+    
+    def __getitem__(self, serial_number: str) -> WarrantyInfo:
+        warranty = self._hydrated.get(serial_number)
+        if warranty is None:
+            record = self.records.get(serial_number)
+            if record is None:
+                record = self._packed[serial_number]
+                if type(record) is tuple:
+                    record = dict(zip(WARRANTY_FIELDS, record))
+            warranty = WarrantyInfo.from_dict(record)
+            self._hydrated[serial_number] = warranty
+        return warranty
+    
+    def __setitem__(self, serial_number: str, warranty: WarrantyInfo):
+        self._hydrated[serial_number] = warranty
+        self._dirty.add(serial_number)
+    
+    def __delitem__(self, serial_number: str):
+        if serial_number not in self:
+            raise KeyError(serial_number)
+        self.records.pop(serial_number, None)
+        self._packed.pop(serial_number, None)
+        if self._rows is not None:
+            self._rows.pop(serial_number, None)
+        self._hydrated.pop(serial_number, None)
+        self._dirty.discard(serial_number)
+    
+    def __contains__(self, serial_number) -> bool:
+        return serial_number in self.records or serial_number in self._packed or serial_number in self._dirty
+    
+    def __iter__(self) -> Iterator[str]:
+        yield from list(self.records)
+        yield from [serial for serial in self._packed if serial not in self.records]
+        yield from [serial for serial in self._dirty if serial not in self.records and serial not in self._packed]
+    
+    def __len__(self) -> int:
+        return len(self.records) + len(self._packed) + sum(
+            1 for serial in self._dirty if serial not in self.records and serial not in self._packed
+        )
+    
+    def hydrated_count(self) -> int:
+        """Number of warranties materialised as WarrantyInfo objects"""
+        return len(self._hydrated)
+    
+    def dirty_count(self) -> int:
+        """Number of changed warranties waiting for flush()"""
+        return len(self._dirty)
+    
+    def needs_flush(self) -> bool:
+        """True if records is missing changed or still packed warranties"""
+        return bool(self._dirty or self._packed)
+    
+    def flush(self) -> int:
+        """Bring records up to date; returns how many changed warranties were encoded"""
+        if self._packed:
+            fields = WARRANTY_FIELDS
+            for serial_number, record in self._packed.items():
+                self.records[serial_number] = dict(zip(fields, record)) if type(record) is tuple else record
+            self._packed = {}
+        dirty = self._dirty
+        rows = self._rows
+        for serial_number in dirty:
+            record = self._hydrated[serial_number].to_dict()
+            self.records[serial_number] = record
+            if rows is not None:
+                rows[serial_number] = tuple(record.values())
+        count = len(dirty)
+        self._dirty = set()
+        return count
+    
+    def pack(self) -> Dict[str, Any]:
+        """
+        Records as packed rows for a snapshot; call after flush()
+        
+        The returned dict is the table's own and must not be modified.
+        """
+        if self._rows is None:
+            fields = WARRANTY_FIELDS
+            width = len(fields)
+            self._rows = {
+                serial_number: tuple(record.values())
+                if len(record) == width and tuple(record) == fields else record
+                for serial_number, record in self.records.items()
+            }
+        return self._rows
+
+
+@_slotted
 @dataclass
 class PromoRule:
     """Promotional rule configuration"""
@@ -173,17 +348,46 @@ class PromoRule:
     condition_type: str  # "amount_over", "card_type", "product_contains"
     condition_value: Any
     action_type: str  # "add_line", "add_discount", "add_bonus_code"
-    action_value: str
+    action_value: str  # add_discount: "10%" or a fixed amount such as "5.00"
     enabled: bool = True
+    priority: int = 0  # Higher priority rules are applied first
+    exclusive: bool = False  # add_discount: never combined with other discounts
+    # Validity window, unset parts always match
+    valid_from: Optional[str] = None  # ISO date or date and time
+    valid_until: Optional[str] = None  # A date alone includes the whole day
+    weekdays: Optional[List[int]] = None  # 0 = Monday ... 6 = Sunday
+    time_from: Optional[str] = None  # "HH:MM", a window may cross midnight
+    time_until: Optional[str] = None
     
     def to_dict(self) -> Dict:
-        return asdict(self)
+        return {
+            "rule_id": self.rule_id,
+            "description": self.description,
+            "condition_type": self.condition_type,
+            "condition_value": self.condition_value,
+            "action_type": self.action_type,
+            "action_value": self.action_value,
+            "enabled": self.enabled,
+            "priority": self.priority,
+            "exclusive": self.exclusive,
+            "valid_from": self.valid_from,
+            "valid_until": self.valid_until,
+            "weekdays": self.weekdays,
+            "time_from": self.time_from,
+            "time_until": self.time_until
+        }
     
     @classmethod
     def from_dict(cls, data: Dict):
         return cls(**data)
+    
+    def has_window(self) -> bool:
+        return any(value is not None for value in (
+            self.valid_from, self.valid_until, self.weekdays, self.time_from, self.time_until
+        ))
 
 
+@_slotted
 @dataclass
 class ReceiptLayout:
     """Configurable receipt layout blocks"""
@@ -202,11 +406,21 @@ class ReceiptLayout:
     footer_font: FontStyle = FontStyle.NORMAL
     
     def to_dict(self) -> Dict:
-        data = asdict(self)
-        data["header_font"] = self.header_font.value
-        data["product_font"] = self.product_font.value
-        data["footer_font"] = self.footer_font.value
-        return data
+        return {
+            "show_logo": self.show_logo,
+            "show_header": self.show_header,
+            "show_products": self.show_products,
+            "show_totals": self.show_totals,
+            "show_vat_breakdown": self.show_vat_breakdown,
+            "show_footer": self.show_footer,
+            "show_warranty": self.show_warranty,
+            "show_promo": self.show_promo,
+            "extra_lines_before_products": self.extra_lines_before_products,
+            "extra_lines_after_totals": self.extra_lines_after_totals,
+            "header_font": self.header_font.value,
+            "product_font": self.product_font.value,
+            "footer_font": self.footer_font.value
+        }
     
     @classmethod
     def from_dict(cls, data: Dict):
@@ -217,6 +431,7 @@ class ReceiptLayout:
         return cls(**data)
 
 
+@_slotted
 @dataclass
 class CompanyPreset:
     """Complete company preset configuration"""
@@ -300,13 +515,13 @@ class ASCIILogoEncoder:
     @staticmethod
     def _simple_style(text: str) -> str:
         """Simple bordered style"""
-        border = "=" * (len(text) + 4)
+        border = "=" * (display_width(text) + 4)
         return f"{border}\n  {text}  \n{border}"
     
     @staticmethod
     def _block_style(text: str) -> str:
         """Block/box style with borders"""
-        width = len(text) + 4
+        width = display_width(text) + 4
         top = "╔" + "═" * (width - 2) + "╗"
         mid = "║ " + text + " ║"
         bot = "╚" + "═" * (width - 2) + "╝"
@@ -315,7 +530,7 @@ class ASCIILogoEncoder:
     @staticmethod
     def _banner_style(text: str) -> str:
         """Banner style with stars"""
-        stars = "*" * (len(text) + 4)
+        stars = "*" * (display_width(text) + 4)
         return f"{stars}\n* {text} *\n{stars}"
     
     @staticmethod
@@ -393,14 +608,1378 @@ class FontEngine:
         return FontEngine.FONTS.get(font_style, FontEngine.FONTS[FontStyle.NORMAL])
 
 
+@dataclass
+class ReceiptTemplate:
+    """
+    Receipt template definition
+    
+    Fields left as None are inherited from the parent template. Text
+    fields are format strings filled once per preset with company_name,
+    business_id, address, phone, email, slogan and footer_text.
+    item_format is filled per product with index, name, quantity, price
+    and total; text after a tab on a line goes to the right-aligned
+    price column and the rest of the line is wrapped to the width.
+    """
+    template_id: str
+    parent: Optional[str] = None
+    sections: Optional[Tuple[str, ...]] = None
+    logo_style: Optional[str] = None  # ASCIILogoEncoder style, "" for no logo
+    header_lines: Optional[Tuple[str, ...]] = None
+    products_heading: Optional[str] = None
+    item_format: Optional[str] = None
+    warranty_heading: Optional[str] = None
+    promo_heading: Optional[str] = None
+    legal_lines: Optional[Tuple[str, ...]] = None
+    force_vat_breakdown: Optional[bool] = None
+    vat_table: Optional[bool] = None  # Grouped per-rate VAT block after totals
+    
+    def resolve(self) -> Dict[str, Any]:
+        """Merge this template with its ancestors"""
+        chain = []
+        template = self
+        while template is not None:
+            if template in chain:
+                raise ValueError(f"Template inheritance loop at '{template.template_id}'")
+            chain.append(template)
+            template = RECEIPT_TEMPLATES[template.parent] if template.parent else None
+        
+        resolved = {}
+        for template in reversed(chain):
+            for name in TEMPLATE_FIELDS:
+                value = getattr(template, name)
+                if value is not None:
+                    resolved[name] = value
+        return resolved
+
+
+TEMPLATE_FIELDS = (
+    "sections", "logo_style", "header_lines", "products_heading", "item_format",
+    "warranty_heading", "promo_heading", "legal_lines", "force_vat_breakdown", "vat_table"
+)
+
+# Render order of receipt sections; items must come before totals and promo
+CORPORATE_SECTIONS = (
+    "logo", "header", "date", "items", "totals", "vat", "payment",
+    "spacer", "warranty", "promo", "legal", "footer"
+)
+
+RECEIPT_TEMPLATES: Dict[str, ReceiptTemplate] = {}
+
+# Compiled plans keyed by (template id, preset content hash, width)
+COMPILED_TEMPLATE_CACHE_SIZE = 256
+_compiled_templates: Dict[tuple, "ReceiptRenderPlan"] = {}
+
+
+ITEM_FORMAT_FIELDS = ("index", "name", "quantity", "price", "total")
+_template_generation = 0  # Bumped by register_template, see ReceiptRenderPlan.generation
+
+
+def _compile_format_text(text: str) -> Callable[..., str]:
+    """
+    Compile one str.format text over ITEM_FORMAT_FIELDS into a function
+    
+    The text is checked once and rebuilt with positional fields, so a
+    row is one str.format call on the item values. Fields other than
+    the item fields, attribute or index lookups and nested specs raise
+    ValueError, so a template can never run code.
+    """
+    parts = []
+    for literal, field, spec, conversion in Formatter().parse(text):
+        parts.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field is None:
+            continue
+        if field not in ITEM_FORMAT_FIELDS:
+            raise ValueError(f"Unknown item format field {{{field}}} in {text!r}")
+        if "{" in spec:
+            raise ValueError(f"Nested format spec in {text!r}")
+        conversion = f"!{conversion}" if conversion else ""
+        parts.append(f"{{{ITEM_FORMAT_FIELDS.index(field)}{conversion}:{spec}}}")
+    return "".join(parts).format
+
+
+def _compile_item_format(item_format: str, layout: TextLayout) -> Callable[..., str]:
+    """
+    Compile a product row format string into a row function
+    
+    Each line is parsed once (see _compile_format_text) and becomes one
+    layout call: a price column row if it has a tab, wrapped text if not.
+    Raises ValueError for a format using anything but the item fields.
+    """
+    lines = []
+    for line in item_format.split("\n"):
+        # Wrapped lines continue under the text, not under the row number
+        indent = line[:len(line) - len(line.lstrip(" "))] or "   "
+        if "\t" in line:
+            left, right = line.split("\t", 1)
+            lines.append((_compile_format_text(left), _compile_format_text(right), indent))
+        else:
+            lines.append((_compile_format_text(line), None, indent))
+    row, wrap = layout.row, layout.wrap
+    
+    def format_item(*values) -> str:
+        return "\n".join([
+            row(left(*values), right(*values), indent) if right is not None else wrap(left(*values), indent)
+            for left, right, indent in lines
+        ])
+    return format_item
+
+
+def register_template(template: ReceiptTemplate):
+    """
+    Add or replace a receipt template and drop compiled plans
+    
+    Managers recompile their render plans on next use, so a template
+    re-registered under the same id takes effect on the next receipt.
+    """
+    global _template_generation
+    if template.item_format is not None:
+        _compile_item_format(template.item_format, TextLayout(42))  # ValueError before it is stored
+    RECEIPT_TEMPLATES[template.template_id] = template
+    _compiled_templates.clear()
+    _template_generation += 1
+
+
+register_template(ReceiptTemplate(
+    template_id=TemplateType.CORPORATE.value,
+    sections=CORPORATE_SECTIONS,
+    logo_style="block",
+    header_lines=("", "{company_name}", "Y-tunnus: {business_id}", "{address}", "Puh: {phone}", "Email: {email}"),
+    products_heading="\nTUOTTEET:",
+    item_format="{index}. {name}\n   {quantity} kpl x {price:.2f} €\t{total:.2f} €",
+    warranty_heading="TAKUUTIEDOT:",
+    promo_heading="TARJOUKSET:",
+    legal_lines=(),
+    force_vat_breakdown=False,
+    vat_table=False
+))
+register_template(ReceiptTemplate(
+    template_id=TemplateType.MINIMAL.value,
+    parent=TemplateType.CORPORATE.value,
+    logo_style="",
+    header_lines=("", "{company_name} | Y-tunnus: {business_id}")
+))
+register_template(ReceiptTemplate(
+    template_id=TemplateType.COMPACT.value,
+    parent=TemplateType.MINIMAL.value,
+    products_heading="TUOTTEET:",
+    item_format="{index}. {name} {quantity} x {price:.2f}\t{total:.2f} €"
+))
+register_template(ReceiptTemplate(
+    template_id=TemplateType.PROMO.value,
+    parent=TemplateType.CORPORATE.value,
+    sections=(
+        "logo", "header", "date", "items", "totals", "vat", "promo", "payment",
+        "spacer", "warranty", "legal", "footer"
+    ),
+    promo_heading="★ TARJOUKSET ★"
+))
+register_template(ReceiptTemplate(
+    template_id=TemplateType.LEGAL_HEAVY.value,
+    parent=TemplateType.CORPORATE.value,
+    legal_lines=(
+        "Myyjä: {company_name} ({business_id})",
+        "{address}",
+        "Takuu ei rajoita kuluttajansuojalain",
+        "mukaisia oikeuksia virhetilanteissa.",
+        "Säilytä kuitti takuuta ja palautusta varten."
+    ),
+    force_vat_breakdown=True,
+    vat_table=True
+))
+register_template(ReceiptTemplate(
+    template_id=TemplateType.VAT_BREAKDOWN.value,
+    parent=TemplateType.CORPORATE.value,
+    force_vat_breakdown=True,
+    vat_table=True
+))
+
+
+class Discount:
+    """
+    Compiled add_discount action
+    
+    A percentage discount takes basis_points / 100 % off what is left of
+    the eligible lines after higher priority discounts; a fixed discount
+    takes cents off, at most what is left. Discounts of product_contains
+    rules apply only to the lines matching one of the rule's keywords.
+    """
+    __slots__ = ("label", "basis_points", "cents", "exclusive", "keywords")
+    
+    def __init__(
+        self,
+        label: str,
+        basis_points: int,
+        cents: int,
+        exclusive: bool,
+        keywords: Optional[FrozenSet[int]] = None
+    ):
+        self.label = label
+        self.basis_points = basis_points
+        self.cents = cents
+        self.exclusive = exclusive
+        self.keywords = keywords
+    
+    @classmethod
+    def parse(cls, rule: PromoRule) -> Optional["Discount"]:
+        """Discount of an add_discount rule, None if its value is not a valid discount"""
+        value = str(rule.action_value).strip().replace(",", ".")
+        try:
+            if value.endswith("%"):
+                basis_points = int(round(float(value[:-1]) * 100))
+                if not 0 < basis_points <= 10000:
+                    return None
+                discount = cls(rule.description or "Alennus", basis_points, 0, bool(rule.exclusive))
+            else:
+                cents = to_cents(float(value.rstrip("€ ")))
+                if cents <= 0:
+                    return None
+                discount = cls(rule.description or "Alennus", 0, cents, bool(rule.exclusive))
+        except ValueError:
+            return None
+        return discount
+    
+    def amount(self, base_cents: int) -> int:
+        """Cents taken off a base, rounded half up"""
+        if self.basis_points:
+            return (base_cents * self.basis_points + 5000) // 10000
+        return min(self.cents, base_cents)
+
+
+def _amount_threshold(rule: PromoRule) -> Optional[float]:
+    """Threshold of an amount_over rule, None if its value is not a number"""
+    try:
+        threshold = float(rule.condition_value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(threshold) else threshold
+
+
+class DiscountResult:
+    """Discounts of one sale and how they were allocated over its lines"""
+    __slots__ = ("applied", "line_discounts", "matches")
+    
+    def __init__(self, applied: List[Tuple[str, int]], line_discounts: List[int], matches: List[int]):
+        self.applied = applied  # (label, cents) in the order applied
+        self.line_discounts = line_discounts  # Cents taken off each line
+        self.matches = matches  # Positions of all rules the sale matched
+    
+    @property
+    def total_cents(self) -> int:
+        return sum(cents for _, cents in self.applied)
+
+
+def _product_keywords(value: Any) -> Set[str]:
+    """Casefolded keywords of a product_contains condition, a string or a list"""
+    keywords = [value] if isinstance(value, str) else value or []
+    return {str(keyword).strip().casefold() for keyword in keywords} - {""}
+
+
+class PromoIndex:
+    """
+    Promo rules of a preset compiled for fast evaluation
+    
+    Rules are ordered by priority, highest first, then by their order in
+    the preset. Disabled rules and rules whose action does nothing are
+    dropped. amount_over thresholds are sorted, so the rules an amount
+    passes are a prefix found by bisect; card_type rules are grouped by
+    CardType. The keywords of all product_contains rules (a string or a
+    list of strings each) go into one KeywordMatcher, so a cart is
+    matched in a single pass over its product names. Matching rules come
+    out in rule order.
+    
+    Enabled rules that cannot run are listed in skipped as (rule_id,
+    status) pairs, with the statuses simulate_promos reports for them:
+    "invalid action" or "invalid condition".
+    """
+    __slots__ = (
+        "actions", "line_count", "discount_count", "discount_keywords", "keyword_discounts", "thresholds",
+        "amount_positions", "all_amount_positions", "card_positions", "matcher", "keyword_positions", "skipped"
+    )
+    
+    def __init__(self, rules: Iterable[PromoRule]):
+        actions: List[Union[str, Discount]] = []
+        amount_rules: List[Tuple[float, int]] = []
+        card_positions: Dict[CardType, List[int]] = {}
+        keyword_ids: Dict[str, int] = {}
+        keyword_positions: List[List[int]] = []
+        skipped: List[Tuple[str, str]] = []
+        ordered = sorted(enumerate(rules), key=lambda item: (-int(item[1].priority), item[0]))
+        for _, rule in ordered:
+            if not rule.enabled:
+                continue
+            if rule.action_type == "add_line":
+                action = rule.action_value
+            elif rule.action_type == "add_bonus_code":
+                action = f"Bonuskoodi: {rule.action_value}"
+            elif rule.action_type == "add_discount":
+                action = Discount.parse(rule)
+                if action is None:
+                    skipped.append((rule.rule_id, "invalid action"))
+                    continue
+            else:
+                skipped.append((rule.rule_id, "invalid action"))
+                continue
+            
+            position = len(actions)
+            if rule.condition_type == "amount_over":
+                threshold = _amount_threshold(rule)
+                if threshold is None:
+                    skipped.append((rule.rule_id, "invalid condition"))
+                    continue
+                amount_rules.append((threshold, position))
+            elif rule.condition_type == "card_type":
+                try:
+                    card_type = CardType(rule.condition_value)
+                except ValueError:
+                    continue  # Matches no card
+                card_positions.setdefault(card_type, []).append(position)
+            elif rule.condition_type == "product_contains":
+                keywords = _product_keywords(rule.condition_value)
+                if not keywords:
+                    continue  # Matches no product
+                ids = []
+                for keyword in keywords:
+                    keyword_id = keyword_ids.setdefault(keyword, len(keyword_ids))
+                    if keyword_id == len(keyword_positions):
+                        keyword_positions.append([])
+                    keyword_positions[keyword_id].append(position)
+                    ids.append(keyword_id)
+                if isinstance(action, Discount):
+                    action.keywords = frozenset(ids)
+            else:
+                skipped.append((rule.rule_id, "invalid condition"))
+                continue
+            actions.append(action)
+        
+        amount_rules.sort()
+        self.actions = actions
+        self.discount_count = sum(1 for action in actions if isinstance(action, Discount))
+        self.line_count = len(actions) - self.discount_count
+        self.discount_keywords = frozenset().union(*(
+            action.keywords for action in actions if isinstance(action, Discount) and action.keywords is not None
+        ))
+        self.keyword_discounts = bool(self.discount_keywords)
+        self.thresholds = [threshold for threshold, _ in amount_rules]
+        self.amount_positions = [position for _, position in amount_rules]
+        self.all_amount_positions = sorted(self.amount_positions)
+        self.card_positions = card_positions
+        self.matcher = KeywordMatcher(keyword_ids) if keyword_ids else None
+        self.keyword_positions = keyword_positions
+        self.skipped = skipped
+    
+    def __len__(self) -> int:
+        """Number of rules printing a promo line"""
+        return self.line_count
+    
+    def search(self, product_names: Iterable[str]) -> Set[int]:
+        """Ids of the product_contains keywords occurring in the product names"""
+        if self.matcher is None:
+            return set()
+        return self.matcher.search(product_names)
+    
+    def match(self, amount: float, card_type: Optional[CardType], keywords: Set[int]) -> List[int]:
+        """Positions of the rules matching a sale, in rule order"""
+        passed = bisect_left(self.thresholds, amount)  # Thresholds below amount
+        if passed == len(self.thresholds):
+            matches = self.all_amount_positions
+        elif passed > 1:
+            matches = sorted(self.amount_positions[:passed])
+        else:
+            matches = self.amount_positions[:passed]
+        card_matches = self.card_positions.get(card_type) if card_type else None
+        if card_matches:
+            matches = sorted(matches + card_matches) if matches else card_matches
+        if keywords:
+            keyword_positions = self.keyword_positions
+            product_matches = {position for keyword_id in keywords for position in keyword_positions[keyword_id]}
+            matches = sorted(product_matches.union(matches))
+        return matches
+    
+    def lines(self, matches: Iterable[int]) -> List[str]:
+        """Promo lines of matched rules"""
+        actions = self.actions
+        if not self.discount_count:
+            return [actions[position] for position in matches]
+        return [actions[position] for position in matches if not isinstance(actions[position], Discount)]
+    
+    def evaluate(
+        self,
+        amount: float,
+        card_type: Optional[CardType],
+        product_names: Iterable[str] = ()
+    ) -> List[str]:
+        """Lines of the rules matching a sale, in rule order"""
+        return self.lines(self.match(amount, card_type, self.search(product_names)))
+    
+    def apply_discounts(
+        self,
+        amount: float,
+        card_type: Optional[CardType],
+        product_names: Sequence[str],
+        line_cents: Sequence[int]
+    ) -> DiscountResult:
+        """
+        Run the discount stage of a sale, between its subtotal and VAT
+        
+        Conditions see the sale before discounts. Matching discounts are
+        applied in rule order: an exclusive discount is skipped once
+        another discount applied, and ends the stage when it applies.
+        Each discount is allocated over its eligible lines in proportion
+        to what is left of them, so VAT stays correct per rate. The cart
+        is walked once, whatever the number of discounts. Returns cents
+        only, the caller updates its totals.
+        """
+        if self.keyword_discounts:
+            # Per-line matches decide which lines a product discount covers
+            line_keywords = self.matcher.search_each(product_names)
+            keywords = set().union(*line_keywords)
+        else:
+            line_keywords = None
+            keywords = self.search(product_names)
+        matches = self.match(amount, card_type, keywords)
+        actions = self.actions
+        discounts = [actions[position] for position in matches if isinstance(actions[position], Discount)]
+        line_discounts = [0] * len(line_cents)
+        if not discounts:
+            return DiscountResult([], line_discounts, matches)
+        
+        # Lines covered by the same product discounts form a group, and
+        # every discount treats the lines of a group alike, so discounts
+        # are worked out per group and split over lines once at the end
+        weights = [max(cents, 0) for cents in line_cents]  # Returned lines get no discount
+        if line_keywords is None:
+            keys = [frozenset()]
+            members = [range(len(weights))]
+        else:
+            scoped = self.discount_keywords
+            groups: Dict[FrozenSet[int], List[int]] = {}
+            for i, found in enumerate(line_keywords):
+                groups.setdefault(scoped.intersection(found), []).append(i)
+            keys = list(groups)
+            members = list(groups.values())
+        group_cents = [sum(weights[i] for i in indices) for indices in members]
+        remaining = list(group_cents)
+        
+        applied: List[Tuple[str, int]] = []
+        for discount in discounts:
+            if discount.exclusive and applied:
+                continue
+            if discount.keywords is None:
+                eligible = range(len(keys))
+            else:
+                eligible = [group for group, key in enumerate(keys) if not discount.keywords.isdisjoint(key)]
+            base = sum(remaining[group] for group in eligible)
+            cents = discount.amount(base) if base > 0 else 0
+            if cents <= 0:
+                continue
+            for group, share in zip(eligible, allocate_cents(cents, [remaining[group] for group in eligible])):
+                remaining[group] -= share
+            applied.append((discount.label, cents))
+            if discount.exclusive:
+                break
+        
+        for indices, total, left in zip(members, group_cents, remaining):
+            if total > left:
+                for i, share in zip(indices, allocate_cents(total - left, [weights[i] for i in indices])):
+                    line_discounts[i] = share
+        return DiscountResult(applied, line_discounts, matches)
+
+
+_WEEK_MINUTES = 7 * 24 * 60
+
+
+def _parse_clock(value: str) -> int:
+    """Minutes after midnight of an "HH:MM" time of day"""
+    hours, minutes = str(value).split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > 24 * 60:
+        raise ValueError(f"Invalid time of day: {value!r}")
+    return hours * 60 + minutes
+
+
+def _local_time(value: Any) -> datetime:
+    """A datetime or ISO text as naive local time, like printed receipts"""
+    if isinstance(value, datetime):
+        when = value
+    else:
+        text = str(value)
+        if text.endswith("Z"):
+            text = text[:-1] + "+00:00"  # fromisoformat takes Z only from Python 3.11
+        when = datetime.fromisoformat(text)
+    if when.tzinfo is not None:
+        when = when.astimezone().replace(tzinfo=None)
+    return when
+
+
+def _rule_window(rule: PromoRule) -> Tuple[Optional[Tuple[datetime, datetime]], Optional[List[Tuple[int, int]]]]:
+    """
+    Validity window of a rule: a date range and minute-of-week intervals
+    
+    Either part is None when the rule does not restrict it. Raises
+    ValueError for a window that cannot be understood.
+    """
+    dates = None
+    if rule.valid_from is not None or rule.valid_until is not None:
+        # Bounds with an offset are compared in local time, like receipt timestamps
+        start = _local_time(rule.valid_from) if rule.valid_from is not None else datetime.min
+        end = datetime.max
+        if rule.valid_until is not None:
+            until = str(rule.valid_until)
+            end = _local_time(until)
+            if len(until) == 10:
+                end += timedelta(days=1)  # A date alone runs through the end of that day
+        dates = (start, end)
+    
+    week = None
+    if rule.weekdays is not None or rule.time_from is not None or rule.time_until is not None:
+        days = sorted({int(day) for day in rule.weekdays}) if rule.weekdays is not None else range(7)
+        if any(not 0 <= day <= 6 for day in days):
+            raise ValueError(f"Invalid weekdays: {rule.weekdays!r}")
+        start = _parse_clock(rule.time_from) if rule.time_from is not None else 0
+        end = _parse_clock(rule.time_until) if rule.time_until is not None else 24 * 60
+        if end <= start:
+            end += 24 * 60  # Crosses midnight into the next day
+        week = []
+        for day in days:
+            first, last = day * 24 * 60 + start, day * 24 * 60 + end
+            if last > _WEEK_MINUTES:
+                week.append((0, last - _WEEK_MINUTES))  # Sunday night into Monday
+                last = _WEEK_MINUTES
+            week.append((first, last))
+    return dates, week
+
+
+def _interval_timeline(intervals: Iterable[Tuple[Any, Any, int]], low: Any, high: Any):
+    """
+    Boundaries and the set of items active from each one to the next
+    
+    Intervals are (start, end, item), half open. low and high are the
+    first and last boundaries, so every point in [low, high) falls
+    into a segment.
+    """
+    events: Dict[Any, List[Tuple[int, int]]] = {low: [], high: []}
+    for start, end, item in intervals:
+        if start < end:
+            events.setdefault(start, []).append((1, item))
+            events.setdefault(end, []).append((-1, item))
+    boundaries = sorted(events)
+    active: Dict[int, int] = {}
+    segments = []
+    for point in boundaries:
+        for change, item in events[point]:
+            count = active.get(item, 0) + change
+            if count:
+                active[item] = count
+            else:
+                del active[item]
+        segments.append(frozenset(active))
+    return boundaries, segments
+
+
+class PromoSchedule:
+    """
+    Promo rules of a preset indexed by when they are valid
+    
+    Rules without a validity window are always active. Windowed rules
+    go into two interval indexes: one over their date ranges and one
+    over the minutes of the week covered by their weekdays and times of
+    day. Between two boundaries of an index its set of active rules is
+    constant, so the rules of a receipt come from two bisects, and a
+    PromoIndex is compiled once per distinct set of active rules.
+    Expired and future campaigns only add boundaries; the window of the
+    last lookup is remembered, so consecutive receipts do not even
+    bisect. Rules with a window that cannot be parsed never apply.
+    """
+    
+    def __init__(self, rules: Iterable[PromoRule]):
+        self.rules = list(rules)
+        self.line_count = sum(
+            1 for rule in self.rules if rule.enabled and rule.action_type in ("add_line", "add_bonus_code")
+        )
+        self.always: List[int] = []
+        date_intervals = []
+        week_intervals = []
+        windowed = []
+        undated: Set[int] = set()
+        unweekly: Set[int] = set()
+        for i, rule in enumerate(self.rules):
+            if not rule.has_window():
+                self.always.append(i)
+                continue
+            try:
+                dates, week = _rule_window(rule)
+            except (TypeError, ValueError, OverflowError):
+                continue  # Never active
+            windowed.append(i)
+            if dates is None:
+                undated.add(i)
+            else:
+                date_intervals.append((dates[0], dates[1], i))
+            if week is None:
+                unweekly.add(i)
+            else:
+                week_intervals.extend((start, end, i) for start, end in week)
+        
+        # Rules with a broken window are in neither list, so they stay out of the static index too
+        self.static = PromoIndex([self.rules[i] for i in self.always]) if not windowed else None
+        self._undated = frozenset(undated)
+        self._unweekly = frozenset(unweekly)
+        self._dates = _interval_timeline(date_intervals, datetime.min, datetime.max) if date_intervals else None
+        self._week = _interval_timeline(week_intervals, 0, _WEEK_MINUTES) if week_intervals else None
+        self._indexes: Dict[frozenset, PromoIndex] = {}
+        self._current: Tuple[datetime, datetime, Optional[PromoIndex]] = (datetime.max, datetime.min, None)
+    
+    def __len__(self) -> int:
+        """Number of rules that may print a promo line"""
+        return self.line_count
+    
+    def at(self, timestamp: datetime) -> PromoIndex:
+        """Compiled index of the rules active at timestamp, local time if it is aware"""
+        if self.static is not None:
+            return self.static
+        if timestamp.tzinfo is not None:
+            timestamp = _local_time(timestamp)
+        start, end, index = self._current
+        if start <= timestamp < end:
+            return index
+        
+        start, end = datetime.min, datetime.max
+        active = self._undated
+        if self._dates is not None:
+            boundaries, segments = self._dates
+            segment = bisect_right(boundaries, timestamp) - 1
+            active = active | segments[segment]
+            start = boundaries[segment]
+            if segment + 1 < len(boundaries):
+                end = boundaries[segment + 1]
+        if self._week is not None:
+            boundaries, segments = self._week
+            minute = (timestamp.weekday() * 24 + timestamp.hour) * 60 + timestamp.minute
+            slot = bisect_right(boundaries, minute) - 1
+            # Filter the rules live by date, never the whole set of campaigns
+            unweekly, in_slot = self._unweekly, segments[slot]
+            active = frozenset(i for i in active if i in unweekly or i in in_slot)
+            week_start = datetime(timestamp.year, timestamp.month, timestamp.day) - timedelta(days=timestamp.weekday())
+            start = max(start, week_start + timedelta(minutes=boundaries[slot]))
+            end = min(end, week_start + timedelta(minutes=boundaries[slot + 1]))
+        
+        index = self._indexes.get(active)
+        if index is None:
+            keep = set(self.always).union(active)
+            index = PromoIndex([rule for i, rule in enumerate(self.rules) if i in keep])
+            self._indexes[active] = index
+        self._current = (start, end, index)
+        return index
+
+
+_EPOCH = datetime(1970, 1, 1)
+_CARD_CODES = {card_type.value: code for code, card_type in enumerate(CardType)}
+
+
+class SalesHistory:
+    """
+    Past sales as NumPy columns, for promo simulation
+    
+    Per receipt: amount_cents (the subtotal promo conditions see, before
+    discounts), card_codes (position in CardType, -1 without a card) and
+    seconds (local time since 1970-01-01). Per product line, in receipt
+    order: line_receipt, line_cents and line_names, an index into names.
+    Each distinct product name is stored once, so keywords are matched
+    per product rather than per line.
+    """
+    __slots__ = ("amount_cents", "card_codes", "seconds", "line_receipt", "line_cents", "line_names", "names")
+    
+    def __init__(self, amount_cents, card_codes, seconds, line_receipt, line_cents, line_names, names: List[str]):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy is required for promo simulation")
+        self.amount_cents = np.asarray(amount_cents, dtype=np.int64)
+        self.card_codes = np.asarray(card_codes, dtype=np.int8)
+        self.seconds = np.asarray(seconds, dtype=np.int64)
+        self.line_receipt = np.asarray(line_receipt, dtype=np.int64)
+        self.line_cents = np.asarray(line_cents, dtype=np.int64)
+        self.line_names = np.asarray(line_names, dtype=np.int64)
+        self.names = list(names)
+    
+    def __len__(self) -> int:
+        return len(self.amount_cents)
+    
+    @classmethod
+    def from_sales(cls, sales: Iterable[Dict], product_names: Optional[Dict[str, str]] = None) -> "SalesHistory":
+        """
+        Columns of sale records
+        
+        A record has a timestamp and products (name, quantity, price),
+        optionally card_type, as in receipt_tool history or a sales log.
+        Admin orders work too: created_at and items (product_id,
+        quantity, unit_price), named through product_names.
+        """
+        product_names = product_names or {}
+        amounts: List[int] = []
+        cards: List[int] = []
+        seconds: List[int] = []
+        line_receipt: List[int] = []
+        line_cents: List[int] = []
+        line_names: List[int] = []
+        name_ids: Dict[str, int] = {}
+        second = timedelta(seconds=1)
+        for receipt, sale in enumerate(sales):
+            timestamp = sale.get("timestamp", sale.get("created_at"))
+            try:
+                seconds.append((_local_time(timestamp) - _EPOCH) // second)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Sale {receipt}: invalid timestamp {timestamp!r}") from e
+            card_type = sale.get("card_type")
+            if isinstance(card_type, CardType):
+                card_type = card_type.value
+            cards.append(_CARD_CODES.get(card_type, -1))
+            subtotal = 0
+            products = sale.get("products")
+            for product in products if products is not None else sale.get("items", ()):
+                name = product.get("name")
+                if name is None:
+                    product_id = product.get("product_id")
+                    name = product_names.get(product_id, product_id) if product_id is not None else "Unknown"
+                cents = product.get("quantity", 1) * to_cents(product.get("price", product.get("unit_price", 0.0)))
+                subtotal += cents
+                line_receipt.append(receipt)
+                line_cents.append(cents)
+                line_names.append(name_ids.setdefault(name, len(name_ids)))
+            amounts.append(subtotal)
+        return cls(amounts, cards, seconds, line_receipt, line_cents, line_names, list(name_ids))
+    
+    @classmethod
+    def load(cls, path: str, product_names: Optional[Dict[str, str]] = None) -> "SalesHistory":
+        """
+        Read sales from .npz (see save), JSON Lines (.jsonl) or JSON
+        
+        JSON is a list of sale records, or an object with them under
+        "history" (a receipt_tool config), "sales" or "orders".
+        """
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy is required for promo simulation")
+        if path.endswith(".npz"):
+            with np.load(path) as data:
+                return cls(*(data[name] for name in cls.__slots__[:-1]), data["names"].tolist())
+        if path.endswith(".jsonl"):
+            with open(path, "r", encoding="utf-8") as f:
+                sales = [json.loads(line) for line in f if line.strip()]
+        else:
+            sales = load_json_file(path)
+            if isinstance(sales, dict):
+                sales = next((sales[key] for key in ("history", "sales", "orders") if key in sales), [])
+        return cls.from_sales(sales, product_names)
+    
+    def save(self, path: str):
+        """Write the columns as .npz, which loads without parsing any JSON"""
+        columns = {name: getattr(self, name) for name in self.__slots__[:-1]}
+        np.savez(path, names=np.array(self.names, dtype=str), **columns)
+    
+    def week_minutes(self):
+        """Minute of the week of each receipt, 0 = Monday 00:00"""
+        days, rest = np.divmod(self.seconds, 24 * 60 * 60)
+        return ((days + 3) % 7) * (24 * 60) + rest // 60  # 1970-01-01 was a Thursday
+
+
+def _window_mask(history: SalesHistory, rule: PromoRule, week_minutes):
+    """Receipts inside the validity window of a rule; raises ValueError for a broken window"""
+    dates, week = _rule_window(rule)
+    mask = np.ones(len(history), dtype=bool)
+    if dates is not None:
+        second = timedelta(seconds=1)
+        start, end = ((when - _EPOCH) // second for when in dates)
+        mask &= (history.seconds >= start) & (history.seconds < end)
+    if week is not None:
+        in_window = np.zeros(_WEEK_MINUTES, dtype=bool)
+        for start, end in week:
+            in_window[start:end] = True
+        mask &= in_window[week_minutes]
+    return mask
+
+
+def _dense_ids(codes):
+    """Sorted distinct values of non-negative integer codes, and each code's position among them"""
+    top = int(codes.max()) + 1 if len(codes) else 0
+    if top <= 4 * len(codes) + 1024:
+        present = np.bincount(codes, minlength=top) > 0  # No sort for a compact range
+        return np.flatnonzero(present), (np.cumsum(present) - 1)[codes]
+    values, ids = np.unique(codes, return_inverse=True)
+    return values, ids.reshape(-1)
+
+
+def _discount_groups(history: SalesHistory, scoped: List[Tuple[FrozenSet[int], Any]], found: List[Set[int]]):
+    """
+    Lines grouped as PromoIndex.apply_discounts groups them
+    
+    scoped holds the keyword ids and window mask (None: always valid)
+    of each product discount. A line's group key is the keywords of the
+    product discounts valid at its receipt that it contains; found has
+    the keyword ids in each product name. Returns the receipt and key
+    of each group, receipt by receipt in order of first appearance, the
+    group of each line and the keys as frozensets.
+    """
+    receipts = len(history)
+    if not scoped:
+        return np.arange(receipts), np.zeros(receipts, dtype=np.int64), history.line_receipt, [frozenset()]
+    
+    # Receipts with the same product discounts in force share a pattern
+    windowed = [window for _, window in scoped if window is not None]
+    if len(windowed) <= 62:
+        codes = np.zeros(receipts, dtype=np.int64)
+        for bit, window in enumerate(windowed):
+            codes |= window.astype(np.int64) << bit
+        values, pattern_ids = _dense_ids(codes)
+        patterns = [[bool(value >> bit & 1) for bit in range(len(windowed))] for value in values.tolist()]
+    else:
+        patterns, pattern_ids = np.unique(np.stack(windowed), axis=1, return_inverse=True)
+        patterns, pattern_ids = patterns.T.tolist(), pattern_ids.reshape(-1)
+    pattern_keywords = []
+    for pattern in patterns:
+        in_force = iter(pattern)
+        pattern_keywords.append(set().union(*(
+            keywords for keywords, window in scoped if window is None or next(in_force)
+        )))
+    
+    # Key of every distinct (product name, pattern) pair
+    pairs, pair_ids = _dense_ids(history.line_names * len(patterns) + pattern_ids[history.line_receipt])
+    keys: Dict[FrozenSet[int], int] = {frozenset(): 0}
+    pair_keys = np.empty(len(pairs), dtype=np.int64)
+    for n, (name_id, pattern_id) in enumerate(zip(*np.divmod(pairs.tolist(), len(patterns)))):
+        key = frozenset(found[name_id].intersection(pattern_keywords[pattern_id]))
+        pair_keys[n] = keys.setdefault(key, len(keys))
+    line_keys = pair_keys[pair_ids]
+    
+    # Lines are in receipt order, so listing groups by their first line
+    # orders them by receipt and then by first appearance
+    codes, line_groups = _dense_ids(history.line_receipt * len(keys) + line_keys)
+    lines = np.arange(len(line_groups))
+    first_lines = np.full(len(codes), len(line_groups))
+    np.minimum.at(first_lines, line_groups, lines)
+    order = line_groups[first_lines[line_groups] == lines]
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    group_receipt, group_key = np.divmod(codes[order], len(keys))
+    return group_receipt, group_key, rank[line_groups], list(keys)
+
+
+def simulate_promos(history: SalesHistory, rules: Iterable[PromoRule]) -> Dict[str, Any]:
+    """
+    What-if run of a promo rule set over past sales
+    
+    Each rule is evaluated for all receipts at once as a NumPy mask:
+    amount and card conditions compare columns, product keywords are
+    matched once per distinct product name, and validity windows are a
+    date range plus a lookup table over the minutes of the week.
+    Discounts then run in rule order, one vectorised step each, with the
+    stacking, exclusivity, line groups and rounding of the discount
+    stage, so the cents match what the receipts would have printed.
+    
+    Returns the number of receipts, their sales before discounts and,
+    per rule in the given order, its status, the receipts it matched
+    (hits), the receipts it discounted and the cents taken off.
+    """
+    rules = list(rules)
+    receipts = len(history)
+    amounts = history.amount_cents / 100  # Same float the promo engine compares
+    line_receipt = history.line_receipt
+    week_minutes = history.week_minutes() if any(rule.has_window() for rule in rules) else None
+    
+    # Keywords of all product rules are matched in one automaton pass
+    # over the distinct product names
+    keyword_ids: Dict[str, int] = {}
+    for rule in rules:
+        if rule.condition_type == "product_contains":
+            for keyword in _product_keywords(rule.condition_value):
+                keyword_ids.setdefault(keyword, len(keyword_ids))
+    found = KeywordMatcher(keyword_ids).search_each(history.names) if keyword_ids else []
+    keyword_names: List[List[int]] = [[] for _ in keyword_ids]
+    for name_id, name_keywords in enumerate(found):
+        for keyword_id in name_keywords:
+            keyword_names[keyword_id].append(name_id)
+    
+    rows = []
+    masks: List[Any] = []
+    windows: List[Any] = []
+    discounts: List[Optional[Discount]] = []
+    for rule in rules:
+        row = {
+            "rule_id": rule.rule_id, "description": rule.description, "action_type": rule.action_type,
+            "action_value": rule.action_value, "status": "ok", "hits": 0, "discounted": 0, "discount_cents": 0
+        }
+        rows.append(row)
+        mask = window = discount = keywords = None
+        if not rule.enabled:
+            row["status"] = "disabled"
+        elif rule.action_type not in ("add_line", "add_bonus_code", "add_discount") or (
+            rule.action_type == "add_discount" and Discount.parse(rule) is None
+        ):
+            row["status"] = "invalid action"
+        elif rule.condition_type == "amount_over":
+            threshold = _amount_threshold(rule)
+            if threshold is None:
+                row["status"] = "invalid condition"
+            else:
+                mask = amounts > threshold
+        elif rule.condition_type == "card_type":
+            code = _CARD_CODES.get(rule.condition_value)
+            mask = history.card_codes == code if code is not None else np.zeros(receipts, dtype=bool)
+        elif rule.condition_type == "product_contains":
+            keywords = frozenset(keyword_ids[keyword] for keyword in _product_keywords(rule.condition_value))
+            name_mask = np.zeros(len(history.names), dtype=bool)
+            for keyword_id in keywords:
+                name_mask[keyword_names[keyword_id]] = True
+            mask = np.zeros(receipts, dtype=bool)
+            mask[line_receipt[name_mask[history.line_names]]] = True
+        else:
+            row["status"] = "invalid condition"
+        
+        if mask is not None and rule.has_window():
+            try:
+                window = _window_mask(history, rule, week_minutes)
+            except (TypeError, ValueError, OverflowError):
+                row["status"] = "invalid window"
+                mask = None
+            else:
+                mask &= window
+        if mask is not None:
+            row["hits"] = int(np.count_nonzero(mask))
+            if rule.action_type == "add_discount":
+                discount = Discount.parse(rule)
+                discount.keywords = keywords
+        masks.append(mask)
+        windows.append(window)
+        discounts.append(discount)
+    
+    order = sorted((i for i, discount in enumerate(discounts) if discount is not None),
+                   key=lambda i: (-int(rules[i].priority), i))
+    if order:
+        _simulate_discounts(history, rows, masks, discounts, order, windows, found)
+    
+    return {
+        "receipts": receipts,
+        "sales_cents": int(history.amount_cents.sum()),
+        "discount_cents": sum(row["discount_cents"] for row in rows),
+        "rules": rows
+    }
+
+
+def _simulate_discounts(history: SalesHistory, rows, masks, discounts, order, windows, found):
+    """Discount stage of simulate_promos, filling in discounted and discount_cents of each row"""
+    receipts = len(history)
+    scoped = [(discounts[i].keywords, windows[i]) for i in order if discounts[i].keywords]
+    group_receipt, group_key, line_groups, keys = _discount_groups(history, scoped, found)
+    # What is left of each group; returned lines get no discount
+    remaining = np.bincount(
+        line_groups, weights=np.maximum(history.line_cents, 0), minlength=len(group_receipt)
+    ).astype(np.int64)
+    discounted = np.zeros(receipts, dtype=bool)
+    stopped = np.zeros(receipts, dtype=bool)  # An exclusive discount applied
+    
+    for i in order:
+        discount = discounts[i]
+        applies = masks[i] & ~stopped
+        if discount.exclusive:
+            applies &= ~discounted
+        eligible = applies[group_receipt]
+        if discount.keywords is not None:
+            eligible &= np.array([not discount.keywords.isdisjoint(key) for key in keys], dtype=bool)[group_key]
+        # Work on the eligible groups only, still receipt by receipt
+        eligible = np.flatnonzero(eligible)
+        weights = remaining[eligible]
+        receipt = group_receipt[eligible]
+        base = np.bincount(receipt, weights=weights, minlength=receipts).astype(np.int64)
+        if discount.basis_points:
+            cents = (base * discount.basis_points + 5000) // 10000
+        else:
+            cents = np.minimum(base, discount.cents)
+        applied = cents > 0
+        
+        # Split over the groups as allocate_cents does, each share
+        # rounded from the running total within the receipt
+        starts = np.ones(len(receipt), dtype=bool)
+        starts[1:] = receipt[1:] != receipt[:-1]
+        cumulative = np.cumsum(weights)
+        cumulative -= np.maximum.accumulate(np.where(starts, cumulative - weights, 0))
+        total = np.maximum(base, 1)[receipt]
+        target = (2 * cents[receipt] * cumulative + total) // (2 * total)
+        previous = np.zeros(len(target), dtype=np.int64)
+        previous[1:] = target[:-1]
+        previous[starts] = 0
+        remaining[eligible] -= target - previous
+        
+        discounted |= applied
+        if discount.exclusive:
+            stopped |= applied
+        rows[i]["discounted"] = int(np.count_nonzero(applied))
+        rows[i]["discount_cents"] = int(cents.sum())
+
+
+def format_simulation(result: Dict[str, Any]) -> str:
+    """Table of a simulate_promos result"""
+    receipts = result["receipts"]
+    lines = [
+        f"Receipts: {receipts}, sales before discounts: {format_cents(result['sales_cents'])} €",
+        "",
+        f"{'rule':<24} {'action':<15} {'hits':>10} {'hit %':>7} {'discounted':>10} {'discounts €':>14}"
+    ]
+    for row in result["rules"]:
+        rate = row["hits"] / receipts * 100 if receipts else 0.0
+        status = "" if row["status"] == "ok" else f"  ({row['status']})"
+        lines.append(
+            f"{row['rule_id'][:24]:<24} {row['action_type'][:15]:<15} {row['hits']:>10} {rate:>6.1f}% "
+            f"{row['discounted']:>10} {format_cents(row['discount_cents']):>14}{status}"
+        )
+    lines.append(f"{'Total':<24} {'':<15} {'':>10} {'':>7} {'':>10} {format_cents(result['discount_cents']):>14}")
+    return "\n".join(lines)
+
+
+@dataclass
+class ReceiptRenderPlan:
+    """
+    Compiled receipt template for one company preset
+    
+    Logo, header, separators, section headings, legal text and footer
+    never change between receipts of the same preset, so they are
+    rendered once here. KuittikoneManager walks sections in order and
+    only fills in products, totals, payment, warranty and promos.
+    """
+    template_id: str
+    width: int
+    layout: TextLayout
+    sections: Tuple[str, ...]
+    logo: str
+    header: str
+    after_date: str
+    format_item: Callable[..., str]
+    show_products: bool
+    show_totals: bool
+    show_vat_breakdown: bool
+    show_warranty: bool
+    show_promo: bool
+    rule: str
+    thin_rule: str
+    vat_label: str
+    card_lines: Dict[CardType, tuple]
+    after_totals: List[str]
+    warranty_open: str
+    promo_open: str
+    promos: PromoSchedule
+    legal: str
+    footer: str
+    generation: int = 0  # _template_generation the plan was compiled at
+    
+    @classmethod
+    def compile(cls, preset: CompanyPreset, width: int) -> "ReceiptRenderPlan":
+        """
+        Compile the preset's template, reusing an identical compiled plan
+        
+        Plans are cached by (template id, hash of the preset's contents,
+        width), so several presets or stores sharing a layout compile once.
+        """
+        key = (preset.template_type.value, render_cache_key(preset.to_dict()), width)
+        plan = _compiled_templates.get(key)
+        if plan is None:
+            plan = cls._compile(preset, width)
+            if len(_compiled_templates) >= COMPILED_TEMPLATE_CACHE_SIZE:
+                _compiled_templates.clear()
+            _compiled_templates[key] = plan
+        return plan
+    
+    @classmethod
+    def _compile(cls, preset: CompanyPreset, width: int) -> "ReceiptRenderPlan":
+        """Render all static blocks of a preset with its template"""
+        template = RECEIPT_TEMPLATES[preset.template_type.value].resolve()
+        layout = preset.layout
+        text_layout = TextLayout(width)
+        wrap = text_layout.wrap
+        rule = "=" * width
+        thin_rule = "-" * width
+        fields = {
+            "company_name": preset.company_name,
+            "business_id": preset.business_id,
+            "address": preset.address,
+            "phone": preset.phone,
+            "email": preset.email,
+            "slogan": preset.slogan,
+            "footer_text": preset.footer_text
+        }
+        
+        logo = ""
+        if layout.show_logo and preset.logo_base64 and template["logo_style"]:
+            logo = text_layout.clip(
+                ASCIILogoEncoder.text_to_ascii_art(preset.company_name, template["logo_style"])
+            )
+        
+        header = ""
+        if layout.show_header:
+            header = "\n".join(wrap(line.format(**fields)) for line in template["header_lines"])
+        
+        after_date = [rule]
+        after_date.extend([""] * layout.extra_lines_before_products)
+        if layout.show_products:
+            after_date.append(template["products_heading"])
+            after_date.append(thin_rule)
+        
+        # Only the first preset per card type counts, disabled ones print nothing
+        card_lines: Dict[CardType, tuple] = {}
+        for card_preset in preset.payment_presets:
+            if card_preset.card_type in card_lines:
+                continue
+            if card_preset.enabled:
+                card_lines[card_preset.card_type] = (
+                    wrap(f"Korttityyppi: {card_preset.name} {card_preset.icon}"),
+                    card_preset.fee_percentage
+                )
+            else:
+                card_lines[card_preset.card_type] = None
+        
+        promos = PromoSchedule(preset.promo_rules)
+        
+        legal = ""
+        if template["legal_lines"]:
+            legal = "\n".join(["\n" + thin_rule] + [wrap(line.format(**fields)) for line in template["legal_lines"]])
+        
+        footer = ["\n" + rule]
+        if preset.slogan:
+            footer.append(wrap(preset.slogan))
+        footer.append(wrap(preset.footer_text))
+        footer.append("")
+        
+        # Sections that can never print anything for this preset are dropped
+        skipped = set()
+        if not logo:
+            skipped.add("logo")
+        if not header:
+            skipped.add("header")
+        if not layout.show_totals:
+            skipped.update(("totals", "vat", "payment"))
+        if not template["vat_table"]:
+            skipped.add("vat")
+        if not layout.extra_lines_after_totals:
+            skipped.add("spacer")
+        if not layout.show_warranty:
+            skipped.add("warranty")
+        if not layout.show_promo or not promos:
+            skipped.add("promo")
+        if not legal:
+            skipped.add("legal")
+        if not layout.show_footer:
+            skipped.add("footer")
+        
+        return cls(
+            template_id=preset.template_type.value,
+            width=width,
+            layout=text_layout,
+            sections=tuple(section for section in template["sections"] if section not in skipped),
+            logo=logo,
+            header=header,
+            after_date="\n".join(after_date),
+            format_item=_compile_item_format(template["item_format"], text_layout),
+            show_products=layout.show_products,
+            show_totals=layout.show_totals,
+            show_vat_breakdown=layout.show_vat_breakdown or template["force_vat_breakdown"],
+            show_warranty=layout.show_warranty,
+            show_promo=layout.show_promo,
+            rule=rule,
+            thin_rule=thin_rule,
+            vat_label=f"ALV {format_rate(preset.vat_rate)}%:",
+            card_lines=card_lines,
+            after_totals=[""] * layout.extra_lines_after_totals,
+            warranty_open="\n".join(["\n" + rule, template["warranty_heading"], thin_rule]),
+            promo_open="\n".join(["\n" + rule, template["promo_heading"]]),
+            promos=promos,
+            legal=legal,
+            footer="\n".join(footer) if layout.show_footer else "",
+            generation=_template_generation
+        )
+
+
+class _SaleState:
+    """Per-receipt values shared between section renderers"""
+    __slots__ = (
+        "products", "payment_method", "card_type", "serial_numbers", "timestamp",
+        "receipt_number", "totals", "vat_cents", "subtotal", "total", "promos", "product_names", "discounts",
+        "promo_matches"
+    )
+    
+    def __init__(self, products, payment_method, card_type, serial_numbers, timestamp, receipt_number=None):
+        self.products = products
+        self.payment_method = payment_method
+        self.card_type = card_type
+        self.serial_numbers = serial_numbers
+        self.timestamp = timestamp
+        self.receipt_number = receipt_number
+        self.totals = MoneyTotals()
+        self.vat_cents = 0
+        self.subtotal = 0.0
+        self.total = 0.0
+        self.promos: Optional[PromoIndex] = None  # Rules active at the timestamp
+        self.product_names: List[str] = []
+        self.discounts: List[Tuple[str, int]] = []
+        self.promo_matches: Optional[List[int]] = None  # Set by the discount stage
+
+
+class ReadWriteLock:
+    """
+    Readers-writer lock preferring writers
+    
+    Any number of threads may hold the read side; the write side is
+    exclusive. Waiting writers block new readers, so a steady stream of
+    receipt rendering cannot starve add_warranty. Both sides are
+    reentrant, and the writing thread may also take the read side.
+    """
+    
+    def __init__(self):
+        # Uncontended readers only touch the plain mutex, not the condition
+        self._mutex = threading.Lock()
+        self._cond = threading.Condition(self._mutex)
+        self._readers = 0
+        self._writer: Optional[int] = None
+        self._write_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+        self._read_section = _LockSection(self.acquire_read, self.release_read)
+        self._write_section = _LockSection(self.acquire_write, self.release_write)
+    
+    def acquire_read(self):
+        local = self._local
+        depth = getattr(local, "read_depth", 0)
+        if depth:
+            local.read_depth = depth + 1
+            return
+        if self._writer == threading.get_ident():
+            # Reading inside our own write section
+            local.read_depth = 1
+            local.read_counted = False
+            return
+        with self._mutex:
+            if self._writer is None and not self._writers_waiting:
+                self._readers += 1
+            else:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+                self._readers += 1
+        local.read_depth = 1
+        local.read_counted = True
+    
+    def release_read(self):
+        local = self._local
+        local.read_depth -= 1
+        if local.read_depth or not local.read_counted:
+            return
+        with self._mutex:
+            self._readers -= 1
+            if not self._readers and self._writers_waiting:
+                self._cond.notify_all()
+    
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            if getattr(self._local, "read_depth", 0):
+                raise RuntimeError("Cannot upgrade a read lock to a write lock")
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+    
+    def release_write(self):
+        with self._cond:
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._cond.notify_all()
+    
+    def read(self) -> "_LockSection":
+        """Context manager holding the read side"""
+        return self._read_section
+    
+    def write(self) -> "_LockSection":
+        """Context manager holding the write side"""
+        return self._write_section
+
+
+class _LockSection:
+    """Reusable with-statement wrapper around an acquire/release pair"""
+    
+    __slots__ = ("_acquire", "_release")
+    
+    def __init__(self, acquire: Callable[[], None], release: Callable[[], None]):
+        self._acquire = acquire
+        self._release = release
+    
+    def __enter__(self):
+        self._acquire()
+    
+    def __exit__(self, *exc_info):
+        self._release()
+
+
+# Batch job: (products, payment_method, card_type, serial_numbers, preset_id)
+BatchJob = Tuple[List[Dict], PaymentMethod, Optional[CardType], Optional[List[str]], Optional[str]]
+
+
+# Stand-in for StageTimer.time() when timing is off
+_NO_TIMING = nullcontext()
+
+
 class KuittikoneManager:
-    """Main manager for kuittikone system"""
+    """
+    Main manager for kuittikone system
+    
+    With warm_start, every save also writes a binary snapshot next to the
+    config file (config_file + ".snapshot") and start-up loads it instead
+    of parsing the JSON while the JSON is unchanged. The JSON file stays
+    the one to edit and back up.
     
-    def __init__(self, config_file: str = KUITTIKONE_CONFIG):
+    With a sequencer, generate_receipt numbers every receipt from the
+    preset's own sequence, shared with other processes using the same
+    sequencer directory.
+    
+    With a timer, every receipt records its total time ("receipt"),
+    the preset lookup ("preset") and each template section (by section
+    name), and config I/O records "load_config", "save_config",
+    "snapshot", "backup" and "restore". Without one nothing is timed.
+    """
+    
+    def __init__(
+        self,
+        config_file: str = KUITTIKONE_CONFIG,
+        config: Optional[Dict] = None,
+        clock: Callable[[], datetime] = datetime.now,
+        render_cache: Optional[ReceiptRenderCache] = None,
+        warm_start: bool = True,
+        sequencer: Optional[ReceiptSequencer] = None,
+        timer: Optional[StageTimer] = None
+    ):
         self.config_file = config_file
-        self.config = self._load_config()
+        self.warm_start = warm_start
+        self.timer = timer
+        # Packed warranty rows from the warm-start snapshot, see WarrantyTable
+        self._packed_warranties: Optional[Dict[str, Any]] = None
+        self.config = config if config is not None else self._load_config()
+        self.clock = clock
+        self.render_cache = render_cache
+        self.sequencer = sequencer
         self.current_preset_id: Optional[str] = None
-        self.warranty_db: Dict[str, WarrantyInfo] = {}
+        self.warranty_db = WarrantyTable({})
+        self._render_plans: Dict[str, ReceiptRenderPlan] = {}
+        self._preset_cache: Dict[str, CompanyPreset] = {}
+        self.preset_cache_hits = 0
+        self.preset_cache_misses = 0
+        # Bumped on every change that can alter rendered receipts
+        self._preset_versions: Dict[str, int] = {}
+        self._config_generation = 0
+        self._warranty_version = 0
+        # Shared state is read under the read side; writes are serialised
+        self._lock = ReadWriteLock()
+        self._cache_lock = threading.Lock()
+        self._lanes: Dict[str, "CheckoutLane"] = {}
         
         # Load warranty database
         self._load_warranty_db()
@@ -409,12 +1988,28 @@ class KuittikoneManager:
         if self.config.get("presets"):
             self.current_preset_id = list(self.config["presets"].keys())[0]
     
+    def _timing(self, stage: str):
+        """Context manager timing stage when a timer is set"""
+        return self.timer.time(stage) if self.timer is not None else _NO_TIMING
+    
     def _load_config(self) -> Dict:
         """Load configuration from file"""
+        with self._timing("load_config"):
+            return self._read_config()
+    
+    def _read_config(self) -> Dict:
+        """Configuration from the snapshot or the JSON file, else the defaults"""
         if os.path.exists(self.config_file):
+            if self.warm_start:
+                state = load_json_snapshot(self.config_file)
+                if isinstance(state, dict) and "config" in state:
+                    self._packed_warranties = state["warranties"]
+                    return state["config"]
             try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                config = load_json_file(self.config_file)
+                if self.warm_start:
+                    self._write_snapshot(config, WarrantyTable(config.get("warranty_database", {})))
+                return config
             except Exception as e:
                 print(f"Warning: Could not load config: {e}")
         
@@ -433,64 +2028,110 @@ class KuittikoneManager:
     def _save_config(self) -> bool:
         """Save configuration to file"""
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, indent=2, ensure_ascii=False)
+            with self._timing("save_config"):
+                self.warranty_db.flush()
+                payload = dump_json_file(self.config, self.config_file)
+            if self.warm_start:
+                self._write_snapshot(self.config, self.warranty_db, payload)
             return True
         except Exception as e:
             print(f"Error saving config: {e}")
             return False
     
+    def _write_snapshot(self, config: Dict, warranties: WarrantyTable, payload: Optional[bytes] = None):
+        """Write the warm-start snapshot with warranty records packed into rows"""
+        with self._timing("snapshot"):
+            state = {
+                "config": {key: value for key, value in config.items() if key != "warranty_database"},
+                "warranties": warranties.pack()
+            }
+            write_json_snapshot(self.config_file, state, payload)
+    
     def _load_warranty_db(self):
-        """Load warranty database from config"""
-        warranty_data = self.config.get("warranty_database", {})
-        self.warranty_db = {
-            serial: WarrantyInfo.from_dict(data)
-            for serial, data in warranty_data.items()
-        }
+        """Attach the warranty table to the config's raw records, hydrated lazily"""
+        self.warranty_db = WarrantyTable(self.config.setdefault("warranty_database", {}), self._packed_warranties)
+        self._packed_warranties = None
     
     def _save_warranty_db(self):
-        """Save warranty database to config"""
-        self.config["warranty_database"] = {
-            serial: info.to_dict()
-            for serial, info in self.warranty_db.items()
-        }
+        """Save changed warranties to config"""
         self._save_config()
     
+    def _flush_warranty_db(self):
+        """Bring the config's warranty_database up to date before it is shipped"""
+        if self.warranty_db.needs_flush():
+            with self._lock.write():
+                self.warranty_db.flush()
+    
     def add_company_preset(self, preset: CompanyPreset) -> bool:
         """Add or update company preset"""
-        if "presets" not in self.config:
-            self.config["presets"] = {}
-        
-        self.config["presets"][preset.preset_id] = preset.to_dict()
-        return self._save_config()
+        with self._lock.write():
+            if "presets" not in self.config:
+                self.config["presets"] = {}
+            
+            self.config["presets"][preset.preset_id] = preset.to_dict()
+            self._invalidate_preset(preset.preset_id)
+            return self._save_config()
     
     def get_company_preset(self, preset_id: str) -> Optional[CompanyPreset]:
-        """Get company preset by ID"""
-        preset_data = self.config.get("presets", {}).get(preset_id)
-        if preset_data:
-            return CompanyPreset.from_dict(preset_data)
-        return None
+        """
+        Get company preset by ID
+        
+        Presets are hydrated once and the same object is returned on every
+        lookup, so treat it as read-only and persist changes through
+        add_company_preset.
+        """
+        preset = self._preset_cache.get(preset_id)
+        if preset is not None:
+            self.preset_cache_hits += 1
+            return preset
+        
+        with self._lock.read():
+            preset_data = self.config.get("presets", {}).get(preset_id)
+            if not preset_data:
+                return None
+            # One thread hydrates, concurrent lookups get the same object
+            with self._cache_lock:
+                preset = self._preset_cache.get(preset_id)
+                if preset is None:
+                    self.preset_cache_misses += 1
+                    preset = CompanyPreset.from_dict(preset_data)
+                    self._preset_cache[preset_id] = preset
+            return preset
     
     def list_presets(self) -> List[CompanyPreset]:
         """List all company presets"""
-        presets = []
-        for preset_data in self.config.get("presets", {}).values():
-            presets.append(CompanyPreset.from_dict(preset_data))
-        return presets
+        with self._lock.read():
+            return [self.get_company_preset(preset_id) for preset_id in list(self.config.get("presets", {}))]
+    
+    def preset_cache_info(self) -> Dict[str, int]:
+        """Get hydrated preset cache statistics"""
+        return {
+            "hits": self.preset_cache_hits,
+            "misses": self.preset_cache_misses,
+            "size": len(self._preset_cache)
+        }
     
     def delete_preset(self, preset_id: str) -> bool:
         """Delete a company preset"""
-        if preset_id in self.config.get("presets", {}):
-            del self.config["presets"][preset_id]
-            return self._save_config()
-        return False
+        with self._lock.write():
+            if preset_id in self.config.get("presets", {}):
+                del self.config["presets"][preset_id]
+                self._invalidate_preset(preset_id)
+                return self._save_config()
+            return False
     
     def switch_preset(self, preset_id: str) -> bool:
-        """Switch to a different company preset"""
-        if preset_id in self.config.get("presets", {}):
-            self.current_preset_id = preset_id
-            return True
-        return False
+        """
+        Switch the manager's default preset
+        
+        This is the preset of every caller that does not pass preset_id;
+        checkout lanes keep their own selection (see open_lane).
+        """
+        with self._lock.read():
+            if preset_id in self.config.get("presets", {}):
+                self.current_preset_id = preset_id
+                return True
+            return False
     
     def get_current_preset(self) -> Optional[CompanyPreset]:
         """Get current active preset"""
@@ -500,160 +2141,522 @@ class KuittikoneManager:
     
     def add_warranty(self, warranty: WarrantyInfo) -> bool:
         """Add warranty information"""
-        self.warranty_db[warranty.serial_number] = warranty
-        self._save_warranty_db()
-        return True
+        with self._lock.write():
+            self.warranty_db[warranty.serial_number] = warranty
+            self._warranty_version += 1
+            self._save_warranty_db()
+            return True
     
     def get_warranty(self, serial_number: str) -> Optional[WarrantyInfo]:
         """Get warranty information by serial number"""
-        return self.warranty_db.get(serial_number)
+        with self._lock.read():
+            return self.warranty_db.get(serial_number)
+    
+    def open_lane(self, lane_id: str, preset_id: Optional[str] = None) -> "CheckoutLane":
+        """
+        Open a checkout lane, or return the lane already open with lane_id
+        
+        Lanes start on preset_id, or on the manager's current preset.
+        """
+        with self._cache_lock:
+            lane = self._lanes.get(lane_id)
+            if lane is None:
+                lane = CheckoutLane(self, lane_id, preset_id)
+                self._lanes[lane_id] = lane
+            return lane
+    
+    def close_lane(self, lane_id: str) -> bool:
+        """Close a checkout lane"""
+        with self._cache_lock:
+            return self._lanes.pop(lane_id, None) is not None
+    
+    def list_lanes(self) -> List["CheckoutLane"]:
+        """List open checkout lanes"""
+        with self._cache_lock:
+            return list(self._lanes.values())
     
     def generate_receipt(
         self,
         products: List[Dict],
         payment_method: PaymentMethod,
         card_type: Optional[CardType] = None,
-        serial_numbers: Optional[List[str]] = None
+        serial_numbers: Optional[List[str]] = None,
+        preset_id: Optional[str] = None,
+        timestamp: Optional[datetime] = None,
+        receipt_number: Optional[int] = None
     ) -> str:
-        """Generate receipt with current preset"""
-        preset = self.get_current_preset()
+        """
+        Generate receipt with current preset, or with preset_id if given
+        
+        timestamp defaults to the manager's clock. Identical inputs with the
+        same timestamp give identical receipts, which makes them cacheable.
+        With a sequencer, receipt_number defaults to the next number of the
+        preset, so every call takes a new number.
+        """
+        timer = self.timer
+        if timer is not None:
+            start = time.perf_counter()
+        if receipt_number is None and self.sequencer is not None:
+            receipt = self._generate_numbered_receipt(
+                products, payment_method, card_type, serial_numbers, preset_id, timestamp
+            )
+        elif self.render_cache is None:
+            receipt = "\n".join([block.text for block in self.iter_receipt_blocks(
+                products, payment_method, card_type, serial_numbers, preset_id, timestamp, receipt_number
+            )])
+        else:
+            receipt = self.build_receipt_document(
+                products, payment_method, card_type, serial_numbers, preset_id, timestamp, receipt_number
+            ).text()
+        if timer is not None:
+            timer.record("receipt", time.perf_counter() - start)
+        return receipt
+    
+    def _generate_numbered_receipt(
+        self,
+        products: List[Dict],
+        payment_method: PaymentMethod,
+        card_type: Optional[CardType],
+        serial_numbers: Optional[List[str]],
+        preset_id: Optional[str],
+        timestamp: Optional[datetime]
+    ) -> str:
+        """
+        Render a receipt under the next number of its preset
+        
+        The number is taken only once the preset and its render plan are
+        found, and given back to the sequencer if rendering fails, so an
+        unprinted receipt leaves no gap. Every number is a new receipt, so
+        the render cache is not used.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        preset, plan = self._lookup_render_plan(preset_id)
         if not preset:
             return "Error: No preset selected"
+        number = self.sequencer.allocate(preset.preset_id)
+        try:
+            return "\n".join([block.text for block in self._iter_sale_blocks(
+                preset, plan, products, payment_method, card_type, serial_numbers, timestamp, number
+            )])
+        except BaseException:
+            self.sequencer.give_back(preset.preset_id, number)
+            raise
+    
+    def next_receipt_number(self, preset_id: Optional[str] = None) -> Optional[int]:
+        """Take the next receipt number of preset_id (default current), None without a sequencer"""
+        if self.sequencer is None:
+            return None
+        if preset_id is None:
+            preset_id = self.current_preset_id
+        if preset_id is None:
+            return None
+        return self.sequencer.allocate(preset_id)
+    
+    def build_receipt_document(
+        self,
+        products: List[Dict],
+        payment_method: PaymentMethod,
+        card_type: Optional[CardType] = None,
+        serial_numbers: Optional[List[str]] = None,
+        preset_id: Optional[str] = None,
+        timestamp: Optional[datetime] = None,
+        receipt_number: Optional[int] = None
+    ) -> ReceiptDocument:
+        """
+        Render receipt once into typed blocks for TXT/PDF/PNG/ESC/POS backends
         
-        lines = []
-        width = self.config["settings"].get("default_receipt_width", 50)
+        With a render_cache, reprints and re-exports of the same sale
+        (same inputs and timestamp) are served from the cache.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        if self.render_cache is None:
+            return ReceiptDocument(self.iter_receipt_blocks(
+                products, payment_method, card_type, serial_numbers, preset_id, timestamp, receipt_number
+            ))
         
-        # Logo
-        if preset.layout.show_logo and preset.logo_base64:
-            logo_ascii = ASCIILogoEncoder.text_to_ascii_art(preset.company_name, "block")
-            lines.append(logo_ascii)
-        
-        # Header
-        if preset.layout.show_header:
-            lines.append("")
-            lines.append(preset.company_name)
-            lines.append(f"Y-tunnus: {preset.business_id}")
-            lines.append(preset.address)
-            lines.append(f"Puh: {preset.phone}")
-            lines.append(f"Email: {preset.email}")
-        
-        # Date
-        lines.append(f"\nPäivämäärä: {datetime.now().strftime('%d.%m.%Y %H:%M')}")
-        lines.append("=" * width)
-        
-        # Extra spacing
-        for _ in range(preset.layout.extra_lines_before_products):
-            lines.append("")
-        
-        # Products
-        if preset.layout.show_products:
-            lines.append("\nTUOTTEET:")
-            lines.append("-" * width)
-            
-            subtotal = 0.0
-            for i, product in enumerate(products, 1):
-                name = product.get("name", "Unknown")
-                qty = product.get("quantity", 1)
-                price = product.get("price", 0.0)
-                total = qty * price
-                subtotal += total
-                
-                lines.append(f"{i}. {name}")
-                lines.append(f"   {qty} kpl x {price:.2f} € = {total:.2f} €")
-        
-        # Totals
-        if preset.layout.show_totals:
-            lines.append("-" * width)
-            
-            vat_amount = subtotal * preset.vat_rate
-            total = subtotal + vat_amount
-            
-            if preset.layout.show_vat_breakdown:
-                lines.append(f"Välisumma (ilman ALV): {subtotal:.2f} €")
-                lines.append(f"ALV {int(preset.vat_rate * 100)}%: {vat_amount:.2f} €")
-            
-            lines.append("=" * width)
-            lines.append(f"YHTEENSÄ: {total:.2f} €")
-            lines.append("=" * width)
+        products = list(products)
+        serial_numbers = list(serial_numbers) if serial_numbers else None
+        key = self._render_cache_key(
+            products, payment_method, card_type, serial_numbers, preset_id, timestamp, receipt_number
+        )
+        document = self.render_cache.get(key)
+        if document is None:
+            document = ReceiptDocument(self.iter_receipt_blocks(
+                products, payment_method, card_type, serial_numbers, preset_id, timestamp, receipt_number
+            ))
+            self.render_cache.put(key, document, document.nbytes())
+        return document
+    
+    def _render_cache_key(
+        self,
+        products: List[Dict],
+        payment_method: PaymentMethod,
+        card_type: Optional[CardType],
+        serial_numbers: Optional[List[str]],
+        preset_id: Optional[str],
+        timestamp: datetime,
+        receipt_number: Optional[int] = None
+    ) -> str:
+        """Hash every input that can change the rendered receipt"""
+        if preset_id is None:
+            preset_id = self.current_preset_id
+        with self._lock.read():
+            return render_cache_key(
+                preset_id,
+                self._preset_versions.get(preset_id, 0),
+                self._config_generation,
+                _template_generation,
+                self.config["settings"].get("default_receipt_width", 50),
+                products,
+                payment_method.value,
+                card_type.value if card_type else None,
+                serial_numbers,
+                self._warranty_version if serial_numbers else None,
+                timestamp.isoformat(),
+                receipt_number
+            )
+    
+    def iter_receipt_chunks(
+        self,
+        products: Iterable[Dict],
+        payment_method: PaymentMethod,
+        card_type: Optional[CardType] = None,
+        serial_numbers: Optional[Iterable[str]] = None,
+        preset_id: Optional[str] = None,
+        timestamp: Optional[datetime] = None,
+        receipt_number: Optional[int] = None
+    ) -> Iterator[str]:
+        """
+        Render receipt section by section
+        
+        Joining the chunks with newlines gives exactly the text of
+        generate_receipt, so a printer can start feeding paper before the
+        whole receipt is rendered.
+        """
+        for block in self.iter_receipt_blocks(
+            products, payment_method, card_type, serial_numbers, preset_id, timestamp, receipt_number
+        ):
+            yield block.text
+    
+    def iter_receipt_blocks(
+        self,
+        products: Iterable[Dict],
+        payment_method: PaymentMethod,
+        card_type: Optional[CardType] = None,
+        serial_numbers: Optional[Iterable[str]] = None,
+        preset_id: Optional[str] = None,
+        timestamp: Optional[datetime] = None,
+        receipt_number: Optional[int] = None
+    ) -> Iterator[ReceiptBlock]:
+        """
+        Render receipt into typed blocks as they are produced
+        
+        Sections are rendered in the order given by the preset's template:
+        by default logo and header, one block per product, totals, payment
+        info, one block per warranty, promos, legal text and footer.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        preset, plan = self._lookup_render_plan(preset_id)
+        if not preset:
+            yield ReceiptBlock(BlockType.TEXT, "Error: No preset selected")
+            return
+        yield from self._iter_sale_blocks(
+            preset, plan, products, payment_method, card_type, serial_numbers, timestamp, receipt_number
+        )
+    
+    def _lookup_render_plan(
+        self, preset_id: Optional[str]
+    ) -> Tuple[Optional[CompanyPreset], Optional[ReceiptRenderPlan]]:
+        """Preset preset_id (default current) and its render plan, (None, None) if there is none"""
+        timer = self.timer
+        if timer is not None:
+            start = time.perf_counter()
+        # Preset and plan are immutable snapshots, rendering needs no lock
+        with self._lock.read():
+            if preset_id is not None:
+                preset = self.get_company_preset(preset_id)
+            else:
+                preset = self.get_current_preset()
+            plan = self._get_render_plan(preset) if preset else None
+        if timer is not None:
+            timer.record("preset", time.perf_counter() - start)
+        return preset, plan
+    
+    def _iter_sale_blocks(
+        self,
+        preset: CompanyPreset,
+        plan: ReceiptRenderPlan,
+        products: Iterable[Dict],
+        payment_method: PaymentMethod,
+        card_type: Optional[CardType],
+        serial_numbers: Optional[Iterable[str]],
+        timestamp: datetime,
+        receipt_number: Optional[int]
+    ) -> Iterator[ReceiptBlock]:
+        """Blocks of one sale with a looked-up preset and plan"""
+        timer = self.timer
+        sale = _SaleState(products, payment_method, card_type, serial_numbers, timestamp, receipt_number)
+        sale.promos = plan.promos.at(timestamp)
+        if timer is None:
+            for section in plan.sections:
+                yield from self._SECTION_RENDERERS[section](self, preset, plan, sale)
+        else:
+            for section in plan.sections:
+                yield from timer.timed(section, self._SECTION_RENDERERS[section](self, preset, plan, sale))
+    
+    def _render_logo(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        if plan.logo:
+            yield ReceiptBlock(BlockType.LOGO, plan.logo)
+    
+    def _render_header(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        if plan.header:
+            yield ReceiptBlock(BlockType.HEADER, plan.header)
+    
+    def _render_date(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        # Date, receipt number, extra spacing and products heading
+        number = f"\nKuitti nro: {sale.receipt_number}" if sale.receipt_number is not None else ""
+        yield ReceiptBlock(
+            BlockType.DATE,
+            f"\nPäivämäärä: {sale.timestamp.strftime('%d.%m.%Y %H:%M')}{number}\n{plan.after_date}"
+        )
+    
+    def _render_items(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        format_item = plan.format_item
+        promos = sale.promos
+        totals = sale.totals
+        add = totals.add
+        # Names are kept only when product_contains promos need them, line
+        # amounts only when the preset has discounts
+        names = sale.product_names if promos.matcher is not None else None
+        amounts = [] if promos.discount_count else None
+        # One pass: rows are rendered while nets are summed per VAT rate
+        for i, product in enumerate(sale.products, 1):
+            name = product.get("name", "Unknown")
+            if names is not None:
+                names.append(name)
+            qty = product.get("quantity", 1)
+            price = product.get("price", 0.0)
+            vat_rate = product.get("vat_rate")
+            line_cents = qty * to_cents(price)
+            add(line_cents, vat_rate)
+            if amounts is not None:
+                amounts.append((line_cents, vat_rate))
             
-            # Payment method info
-            lines.append(f"\nMaksutapa: {payment_method.value.upper()}")
-            if card_type:
-                card_preset = next((p for p in preset.payment_presets if p.card_type == card_type), None)
-                if card_preset and card_preset.enabled:
-                    lines.append(f"Korttityyppi: {card_preset.name} {card_preset.icon}")
-                    if card_preset.fee_percentage > 0:
-                        fee = total * (card_preset.fee_percentage / 100)
-                        lines.append(f"Korttimaksu: {fee:.2f} €")
-        
-        # Extra spacing
-        for _ in range(preset.layout.extra_lines_after_totals):
-            lines.append("")
-        
-        # Warranty info
-        if preset.layout.show_warranty and serial_numbers:
-            lines.append("\n" + "=" * width)
-            lines.append("TAKUUTIEDOT:")
-            lines.append("-" * width)
-            for serial in serial_numbers:
+            if plan.show_products:
+                yield ReceiptBlock(
+                    BlockType.ITEM,
+                    format_item(i, name, qty, price, line_cents / 100)
+                )
+        # Promo conditions see the subtotal before discounts
+        sale.subtotal = totals.subtotal_cents / 100
+        if amounts:
+            # Discount stage between subtotal and VAT
+            result = promos.apply_discounts(
+                sale.subtotal, sale.card_type, names or (), [line_cents for line_cents, _ in amounts]
+            )
+            for (_, vat_rate), cents in zip(amounts, result.line_discounts):
+                if cents:
+                    totals.discount(cents, vat_rate)
+            sale.discounts = result.applied
+            sale.promo_matches = result.matches
+        subtotal_cents = totals.subtotal_cents
+        sale.vat_cents = totals.vat_cents(preset.vat_rate)
+        sale.total = (subtotal_cents + sale.vat_cents) / 100
+    
+    def _render_totals(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        if not plan.show_totals:
+            return
+        row = plan.layout.row
+        totals = sale.totals
+        lines = [plan.thin_rule]
+        
+        if sale.discounts:
+            discount_cents = sum(cents for _, cents in sale.discounts)
+            lines.append(row("Tuotteet yhteensä:", f"{format_cents(totals.subtotal_cents + discount_cents)} €"))
+            for label, cents in sale.discounts:
+                lines.append(row(label, f"-{format_cents(cents)} €"))
+        
+        if plan.show_vat_breakdown:
+            lines.append(row("Välisumma (ilman ALV):", f"{format_cents(totals.subtotal_cents)} €"))
+            rates = totals.net_by_rate
+            if len(rates) > 1 or (rates and None not in rates):
+                for rate, _, vat in totals.breakdown(preset.vat_rate):
+                    lines.append(row(f"ALV {format_rate(rate)}%:", f"{format_cents(vat)} €"))
+            else:
+                lines.append(row(plan.vat_label, f"{format_cents(sale.vat_cents)} €"))
+        
+        lines.append(plan.rule)
+        lines.append(row("YHTEENSÄ:", f"{format_cents(totals.subtotal_cents + sale.vat_cents)} €"))
+        lines.append(plan.rule)
+        yield ReceiptBlock(BlockType.TOTALS, "\n".join(lines))
+    
+    def _render_payment(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        if not plan.show_totals:
+            return
+        lines = [f"\nMaksutapa: {sale.payment_method.value.upper()}"]
+        card_line = plan.card_lines.get(sale.card_type) if sale.card_type else None
+        if card_line:
+            label, fee_percentage = card_line
+            lines.append(label)
+            if fee_percentage > 0:
+                fee = sale.total * (fee_percentage / 100)
+                lines.append(plan.layout.row("Korttimaksu:", f"{fee:.2f} €"))
+        yield ReceiptBlock(BlockType.PAYMENT, "\n".join(lines))
+    
+    def _render_vat(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        breakdown = sale.totals.breakdown(preset.vat_rate) or [(preset.vat_rate, 0, 0)]
+        yield ReceiptBlock(BlockType.VAT, "\n" + format_vat_breakdown(breakdown, plan.layout))
+    
+    def _render_spacer(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        for line in plan.after_totals:
+            yield ReceiptBlock(BlockType.SPACER, line)
+    
+    def _render_warranty(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        if plan.show_warranty and sale.serial_numbers:
+            yield ReceiptBlock(BlockType.WARRANTY, plan.warranty_open)
+            for serial in sale.serial_numbers:
                 warranty = self.get_warranty(serial)
                 if warranty:
-                    lines.append(warranty.warranty_text())
-                    lines.append("-" * width)
-        
-        # Promo messages
-        if preset.layout.show_promo:
-            promo_lines = self._evaluate_promo_rules(preset, subtotal, card_type)
+                    yield ReceiptBlock(
+                        BlockType.WARRANTY,
+                        f"{warranty.warranty_text(sale.timestamp)}\n{plan.thin_rule}"
+                    )
+    
+    def _render_promo(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        if plan.show_promo:
+            if sale.promo_matches is not None:
+                promo_lines = sale.promos.lines(sale.promo_matches)
+            else:
+                promo_lines = sale.promos.evaluate(sale.subtotal, sale.card_type, sale.product_names)
             if promo_lines:
-                lines.append("\n" + "=" * width)
-                lines.append("TARJOUKSET:")
-                lines.extend(promo_lines)
-        
-        # Footer
-        if preset.layout.show_footer:
-            lines.append("\n" + "=" * width)
-            if preset.slogan:
-                lines.append(preset.slogan)
-            lines.append(preset.footer_text)
-            lines.append("")
+                wrap = plan.layout.wrap
+                yield ReceiptBlock(BlockType.PROMO, "\n".join([plan.promo_open] + [wrap(line) for line in promo_lines]))
+    
+    def _render_legal(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        if plan.legal:
+            yield ReceiptBlock(BlockType.TEXT, plan.legal)
+    
+    def _render_footer(self, preset: CompanyPreset, plan: ReceiptRenderPlan, sale: "_SaleState"):
+        if plan.footer:
+            yield ReceiptBlock(BlockType.FOOTER, plan.footer)
+    
+    _SECTION_RENDERERS = {
+        "logo": _render_logo,
+        "header": _render_header,
+        "date": _render_date,
+        "items": _render_items,
+        "totals": _render_totals,
+        "vat": _render_vat,
+        "payment": _render_payment,
+        "spacer": _render_spacer,
+        "warranty": _render_warranty,
+        "promo": _render_promo,
+        "legal": _render_legal,
+        "footer": _render_footer
+    }
+    
+    def generate_receipts_batch(
+        self,
+        orders: Iterable[BatchJob],
+        workers: Optional[int] = None,
+        chunksize: int = 64
+    ) -> Iterator[str]:
+        """
+        Generate many receipts on a process pool
         
-        return "\n".join(lines)
+        Each order is a (products, payment_method, card_type, serial_numbers,
+        preset_id) tuple; preset_id None means the current preset. The
+        configuration is shipped to each worker once at start-up and orders
+        are sent in chunks. Receipts are yielded in input order as soon as
+        they are ready, with only a few chunks in flight at a time.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        
+        if workers <= 1:
+            for job in orders:
+                yield self.generate_receipt(*job)
+            return
+        
+        max_in_flight = workers * 2
+        self._flush_warranty_db()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_batch_worker,
+            initargs=(self.config, self.current_preset_id, self._sequencer_settings())
+        ) as executor:
+            pending = deque()
+            chunk = []
+            for job in orders:
+                chunk.append(job)
+                if len(chunk) >= chunksize:
+                    pending.append(executor.submit(_run_batch_chunk, chunk))
+                    chunk = []
+                    if len(pending) >= max_in_flight:
+                        yield from pending.popleft().result()
+            if chunk:
+                pending.append(executor.submit(_run_batch_chunk, chunk))
+            while pending:
+                yield from pending.popleft().result()
+    
+    def _sequencer_settings(self) -> Optional[Tuple[str, int, bool]]:
+        """Arguments for opening the same sequencer in a worker process"""
+        if self.sequencer is None:
+            return None
+        return (self.sequencer.directory, self.sequencer.block_size, self.sequencer.durable)
+    
+    def _get_render_plan(self, preset: CompanyPreset) -> ReceiptRenderPlan:
+        """Get compiled render plan for preset, compiling it on first use"""
+        width = self.config["settings"].get("default_receipt_width", 50)
+        plan = self._render_plans.get(preset.preset_id)
+        if plan is None or plan.width != width or plan.generation != _template_generation:
+            plan = ReceiptRenderPlan.compile(preset, width)
+            self._render_plans[preset.preset_id] = plan
+        return plan
+    
+    def _invalidate_preset(self, preset_id: Optional[str] = None):
+        """Drop hydrated presets and render plans for one preset or all presets"""
+        if preset_id is None:
+            self._preset_cache.clear()
+            self._render_plans.clear()
+            self._config_generation += 1
+            self._warranty_version += 1
+        else:
+            self._preset_cache.pop(preset_id, None)
+            self._render_plans.pop(preset_id, None)
+            self._preset_versions[preset_id] = self._preset_versions.get(preset_id, 0) + 1
     
     def _evaluate_promo_rules(
         self,
         preset: CompanyPreset,
         amount: float,
-        card_type: Optional[CardType]
+        card_type: Optional[CardType],
+        products: Iterable[Dict] = (),
+        timestamp: Optional[datetime] = None
     ) -> List[str]:
-        """Evaluate promotional rules and return applicable messages"""
-        promo_lines = []
-        
-        for rule in preset.promo_rules:
-            if not rule.enabled:
-                continue
-            
-            applies = False
-            
-            if rule.condition_type == "amount_over":
-                applies = amount > float(rule.condition_value)
-            elif rule.condition_type == "card_type" and card_type:
-                applies = card_type.value == rule.condition_value
-            
-            if applies:
-                if rule.action_type == "add_line":
-                    promo_lines.append(rule.action_value)
-                elif rule.action_type == "add_bonus_code":
-                    promo_lines.append(f"Bonuskoodi: {rule.action_value}")
+        """
+        Evaluate promotional rules and return applicable messages
         
-        return promo_lines
+        Uses the preset's compiled PromoSchedule from its render plan,
+        which is rebuilt only when the preset changes. Only rules valid
+        at timestamp (default now) are considered.
+        """
+        names = [product.get("name", "Unknown") for product in products]
+        promos = self._get_render_plan(preset).promos.at(timestamp or self.clock())
+        return promos.evaluate(amount, card_type, names)
     
     def backup_to_usb(self, usb_path: str) -> bool:
         """Backup all configuration to USB drive"""
         try:
             backup_file = os.path.join(usb_path, f"kuittikone_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
             
-            with open(backup_file, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, indent=2, ensure_ascii=False)
+            with self._timing("backup"):
+                self._flush_warranty_db()
+                with self._lock.read():
+                    dump_json_file(self.config, backup_file)
             
             print(f"Backup saved to: {backup_file}")
             return True
@@ -664,12 +2667,16 @@ class KuittikoneManager:
     def restore_from_usb(self, backup_file: str) -> bool:
         """Restore configuration from USB backup"""
         try:
-            with open(backup_file, 'r', encoding='utf-8') as f:
-                restored_config = json.load(f)
+            with self._timing("restore"):
+                restored_config = load_json_file(backup_file)
             
-            self.config = restored_config
-            self._save_config()
-            self._load_warranty_db()
+            with self._lock.write():
+                self.config = restored_config
+                self._invalidate_preset()
+                # Table first, so the snapshot written by the save packs the restored warranties
+                self._packed_warranties = None
+                self._load_warranty_db()
+                self._save_config()
             
             print(f"Configuration restored from: {backup_file}")
             return True
@@ -678,6 +2685,240 @@ class KuittikoneManager:
             return False
 
 
+class CheckoutLane:
+    """
+    Checkout lane or session on a shared KuittikoneManager
+    
+    Each lane keeps its own preset selection and pending sale, so several
+    lanes or company brands can run from one process. Presets, warranties
+    and render plans are shared by all lanes. A lane is driven by one
+    thread at a time; different lanes may run concurrently.
+    """
+    
+    def __init__(self, manager: KuittikoneManager, lane_id: str, preset_id: Optional[str] = None):
+        self.manager = manager
+        self.lane_id = lane_id
+        self.preset_id = preset_id if preset_id is not None else manager.current_preset_id
+        self.products: List[Dict] = []
+        self.serial_numbers: List[str] = []
+    
+    def switch_preset(self, preset_id: str) -> bool:
+        """Switch this lane's preset; other lanes are not affected"""
+        if self.manager.get_company_preset(preset_id) is None:
+            return False
+        self.preset_id = preset_id
+        return True
+    
+    def get_current_preset(self) -> Optional[CompanyPreset]:
+        """Get this lane's preset"""
+        if self.preset_id:
+            return self.manager.get_company_preset(self.preset_id)
+        return None
+    
+    def add_product(self, name: str, quantity: int, price: float, vat_rate: Optional[float] = None) -> bool:
+        """Add product to the pending sale"""
+        if quantity <= 0 or price < 0:
+            return False
+        product = {"name": name, "quantity": quantity, "price": price}
+        if vat_rate is not None:
+            product["vat_rate"] = vat_rate
+        self.products.append(product)
+        return True
+    
+    def remove_product(self, index: int) -> bool:
+        """Remove product from the pending sale"""
+        if 0 <= index < len(self.products):
+            self.products.pop(index)
+            return True
+        return False
+    
+    def add_serial_number(self, serial_number: str):
+        """Print warranty info for serial_number on this sale's receipt"""
+        self.serial_numbers.append(serial_number)
+    
+    def clear(self):
+        """Drop the pending sale"""
+        self.products = []
+        self.serial_numbers = []
+    
+    def preview(
+        self,
+        payment_method: PaymentMethod,
+        card_type: Optional[CardType] = None,
+        timestamp: Optional[datetime] = None
+    ) -> str:
+        """Render the pending sale without completing it or taking a receipt number"""
+        return self.manager.build_receipt_document(
+            self.products, payment_method, card_type, self.serial_numbers or None,
+            self.preset_id, timestamp
+        ).text()
+    
+    def checkout(
+        self,
+        payment_method: PaymentMethod,
+        card_type: Optional[CardType] = None,
+        timestamp: Optional[datetime] = None
+    ) -> str:
+        """Render the pending sale and start a new one"""
+        receipt = self.manager.generate_receipt(
+            self.products, payment_method, card_type, self.serial_numbers or None,
+            self.preset_id, timestamp
+        )
+        self.clear()
+        return receipt
+
+
+class AsyncKuittikoneManager:
+    """
+    asyncio facade for KuittikoneManager
+    
+    Every call runs on a bounded thread pool, so rendering and config file
+    I/O never block the event loop: at most max_workers calls run at once
+    and at most max_pending are queued, later callers wait for a slot.
+    Concurrent identical reads (same receipt, warranty or preset lookup)
+    are coalesced into one call whose result every caller receives.
+    
+    Use from a single event loop:
+    
+        async with AsyncKuittikoneManager(config_file) as kassa:
+            text = await kassa.generate_receipt(products, PaymentMethod.CASH)
+    """
+    
+    def __init__(
+        self,
+        manager: Optional[KuittikoneManager] = None,
+        max_workers: int = 4,
+        max_pending: int = 64,
+        **manager_kwargs
+    ):
+        self.manager = manager if manager is not None else KuittikoneManager(**manager_kwargs)
+        self.max_pending = max_pending
+        self.coalesced = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kuittikone")
+        self._inflight: Dict[Hashable, "asyncio.Future"] = {}
+        # Created on first use so it binds to the running loop
+        self._slots: Optional[asyncio.Semaphore] = None
+    
+    async def __aenter__(self) -> "AsyncKuittikoneManager":
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+    
+    async def aclose(self):
+        """Wait for running calls and shut the thread pool down"""
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+    
+    async def _run(self, func: Callable, *args) -> Any:
+        """Run func on the thread pool once a pending slot is free"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+    
+    async def _coalesced(self, key: Hashable, func: Callable, *args) -> Any:
+        """Run a read, or join the identical one already in flight"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(func, *args))
+            self._inflight[key] = future
+            
+            def forget(done):
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+            
+            future.add_done_callback(forget)
+        else:
+            self.coalesced += 1
+        # One caller giving up must not cancel the call for the others
+        return await asyncio.shield(future)
+    
+    async def generate_receipt(
+        self,
+        products: List[Dict],
+        payment_method: PaymentMethod,
+        card_type: Optional[CardType] = None,
+        serial_numbers: Optional[List[str]] = None,
+        preset_id: Optional[str] = None,
+        timestamp: Optional[datetime] = None
+    ) -> str:
+        """Generate receipt, see KuittikoneManager.generate_receipt"""
+        if timestamp is None:
+            timestamp = self.manager.clock()
+        if self.manager.sequencer is not None:
+            # Every numbered receipt is a new sale, never coalesce them
+            return await self._run(
+                self.manager.generate_receipt,
+                products, payment_method, card_type, serial_numbers, preset_id, timestamp
+            )
+        key = ("receipt", render_cache_key(
+            preset_id, products, payment_method.value, card_type.value if card_type else None,
+            serial_numbers, timestamp.isoformat()
+        ))
+        return await self._coalesced(
+            key, self.manager.generate_receipt,
+            products, payment_method, card_type, serial_numbers, preset_id, timestamp
+        )
+    
+    async def add_warranty(self, warranty: WarrantyInfo) -> bool:
+        """Add warranty information"""
+        return await self._run(self.manager.add_warranty, warranty)
+    
+    async def get_warranty(self, serial_number: str) -> Optional[WarrantyInfo]:
+        """Get warranty information by serial number"""
+        return await self._coalesced(("warranty", serial_number), self.manager.get_warranty, serial_number)
+    
+    async def add_company_preset(self, preset: CompanyPreset) -> bool:
+        """Add or update company preset"""
+        return await self._run(self.manager.add_company_preset, preset)
+    
+    async def get_company_preset(self, preset_id: str) -> Optional[CompanyPreset]:
+        """Get company preset by ID"""
+        return await self._coalesced(("preset", preset_id), self.manager.get_company_preset, preset_id)
+    
+    async def list_presets(self) -> List[CompanyPreset]:
+        """List all company presets"""
+        return await self._coalesced(("presets",), self.manager.list_presets)
+    
+    async def delete_preset(self, preset_id: str) -> bool:
+        """Delete a company preset"""
+        return await self._run(self.manager.delete_preset, preset_id)
+    
+    async def switch_preset(self, preset_id: str) -> bool:
+        """Switch the manager's default preset"""
+        return await self._run(self.manager.switch_preset, preset_id)
+    
+    async def backup_to_usb(self, usb_path: str) -> bool:
+        """Backup all configuration to USB drive"""
+        return await self._run(self.manager.backup_to_usb, usb_path)
+    
+    async def restore_from_usb(self, backup_file: str) -> bool:
+        """Restore configuration from USB backup"""
+        return await self._run(self.manager.restore_from_usb, backup_file)
+
+
+# Per-process manager used by generate_receipts_batch workers
+_batch_manager: Optional[KuittikoneManager] = None
+
+
+def _init_batch_worker(
+    config: Dict,
+    current_preset_id: Optional[str],
+    sequencer: Optional[Tuple[str, int, bool]] = None
+):
+    """Build the worker's manager once from the shipped configuration"""
+    global _batch_manager
+    _batch_manager = KuittikoneManager(
+        config=config, sequencer=ReceiptSequencer(*sequencer) if sequencer else None
+    )
+    _batch_manager.current_preset_id = current_preset_id
+
+
+def _run_batch_chunk(jobs: List[BatchJob]) -> List[str]:
+    """Render a chunk of batch jobs in a worker process"""
+    return [_batch_manager.generate_receipt(*job) for job in jobs]
+
+
 def create_default_presets() -> List[CompanyPreset]:
     """Create some default company presets"""
     presets = []
@@ -726,6 +2967,59 @@ def create_default_presets() -> List[CompanyPreset]:
     return presets
 
 
+def simulate_main(argv: Optional[Sequence[str]] = None) -> int:
+    """Command line for simulate_promos: python kuittikone.py simulate HISTORY ..."""
+    parser = argparse.ArgumentParser(
+        prog="kuittikone.py simulate", description="What-if promo simulation over past sales"
+    )
+    parser.add_argument("history", help="sales as .json (records, receipt_tool config or admin orders), .jsonl or .npz")
+    parser.add_argument("--rules", help="JSON file of candidate promo rules, a list or a preset with promo_rules")
+    parser.add_argument("--preset", help="simulate this preset's promo rules, followed by the candidates")
+    parser.add_argument("--config", default=KUITTIKONE_CONFIG, help="configuration file holding the preset")
+    parser.add_argument("--products", help="product catalogue naming the items of admin orders (data/products.json)")
+    parser.add_argument("--save", help="also write the loaded sales as .npz for faster reruns")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args(argv)
+    
+    if not NUMPY_AVAILABLE:
+        print("Error: numpy library is required for promo simulation")
+        print("Install with: pip install numpy")
+        return 1
+    if not args.rules and not args.preset:
+        parser.error("give candidate --rules, a --preset or both")
+    
+    rules: List[PromoRule] = []
+    if args.preset:
+        preset = KuittikoneManager(args.config, warm_start=False).get_company_preset(args.preset)
+        if preset is None:
+            print(f"Error: preset not found: {args.preset}")
+            return 1
+        rules.extend(preset.promo_rules)
+    if args.rules:
+        data = load_json_file(args.rules)
+        if isinstance(data, dict):
+            data = data.get("promo_rules", [])
+        rules.extend(PromoRule.from_dict(rule) for rule in data)
+    product_names = None
+    if args.products:
+        product_names = {product.get("id"): product.get("name") for product in load_json_file(args.products)}
+    
+    start = time.perf_counter()
+    history = SalesHistory.load(args.history, product_names)
+    loaded = time.perf_counter()
+    if args.save:
+        history.save(args.save)
+    result = simulate_promos(history, rules)
+    done = time.perf_counter()
+    
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    else:
+        print(format_simulation(result))
+        print(f"\nLoaded in {loaded - start:.2f} s, {len(rules)} rules simulated in {done - loaded:.2f} s")
+    return 0
+
+
 def main():
     """Demo and testing"""
     print("=" * 60)
@@ -809,4 +3103,6 @@ def main():
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["simulate"]:
+        sys.exit(simulate_main(sys.argv[2:]))
     main()
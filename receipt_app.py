@@ -15,7 +15,12 @@ import sys
 import tempfile
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterable, Iterator, Optional, Union
+
+from receipt_core import (
+    BlockType, MoneyTotals, PrintInterrupted, ReceiptBlock, ReceiptDocument, SegmentedPrinter,
+    SocketPrinterTransport, format_cents, segment_document, to_cents, vat_cents
+)
 
 # Yritä tuoda GUI-kirjastot / Try to import GUI libraries
 GUI_AVAILABLE = False
@@ -51,9 +56,23 @@ class Product:
         self.quantity = quantity
         self.price = price
     
+    @property
+    def price(self) -> float:
+        return self._price
+    
+    @price.setter
+    def price(self, value: float):
+        # Hinta senteiksi kerran / Price rounded to cents once
+        self._price = value
+        self.price_cents = to_cents(value)
+    
+    def total_cents(self) -> int:
+        """Tuotteen kokonaishinta sentteinä / Product total in cents"""
+        return self.quantity * self.price_cents
+    
     def total(self) -> float:
         """Tuotteen kokonaishinta / Product total price"""
-        return self.quantity * self.price
+        return self.total_cents() / 100
     
     def to_dict(self) -> Dict:
         """Muunna sanakirjaksi / Convert to dictionary"""
@@ -79,6 +98,8 @@ class Receipt:
     
     def __init__(self):
         self.products: List[Product] = []
+        # Juoksevat summat sentteinä / Running totals in cents
+        self.totals = MoneyTotals()
         self.company_info = {
             "name": "Harjun Raskaskone Oy",
             "business_id": "FI12345678",
@@ -91,7 +112,9 @@ class Receipt:
         try:
             if quantity <= 0 or price < 0:
                 return False
-            self.products.append(Product(name, quantity, price))
+            product = Product(name, quantity, price)
+            self.products.append(product)
+            self.totals.add(product.total_cents())
             return True
         except Exception:
             return False
@@ -100,81 +123,148 @@ class Receipt:
         """Poista tuote / Remove product"""
         try:
             if 0 <= index < len(self.products):
-                self.products.pop(index)
+                product = self.products.pop(index)
+                self.totals.remove(product.total_cents())
                 return True
             return False
         except Exception:
             return False
     
+    def clear_products(self):
+        """Tyhjennä tuotteet / Remove all products"""
+        self.products.clear()
+        self.totals.reset()
+    
+    def get_subtotal_cents(self) -> int:
+        """Välisumma sentteinä / Subtotal in cents"""
+        if self.totals.lines != len(self.products):
+            # Listaa muutettu suoraan / List was changed directly
+            self.totals.reset((p.total_cents(), None) for p in self.products)
+        return self.totals.subtotal_cents
+    
+    def get_vat_cents(self) -> int:
+        """ALV sentteinä / VAT in cents"""
+        return vat_cents(self.get_subtotal_cents(), self.VAT_RATE)
+    
+    def get_total_cents(self) -> int:
+        """Kokonaissumma sentteinä / Total in cents"""
+        subtotal = self.get_subtotal_cents()
+        return subtotal + vat_cents(subtotal, self.VAT_RATE)
+    
     def get_subtotal(self) -> float:
         """Välisumma ilman ALV:ia / Subtotal without VAT"""
-        return sum(p.total() for p in self.products)
+        return self.get_subtotal_cents() / 100
     
     def get_vat(self) -> float:
         """ALV-summa / VAT amount"""
-        return self.get_subtotal() * self.VAT_RATE
+        return self.get_vat_cents() / 100
     
     def get_total(self) -> float:
         """Kokonaissumma sisältäen ALV:in / Total including VAT"""
-        return self.get_subtotal() + self.get_vat()
+        return self.get_total_cents() / 100
     
     def generate_text(self) -> str:
         """Luo tekstimuotoinen kuitti / Generate text receipt"""
-        lines = []
-        lines.append(self.LOGO)
-        lines.append(f"\n{self.company_info['name']}")
-        lines.append(f"Y-tunnus: {self.company_info['business_id']}")
-        lines.append(f"{self.company_info['address']}")
-        lines.append(f"Puh: {self.company_info['phone']}")
-        lines.append(f"\nPäivämäärä: {datetime.now().strftime('%d.%m.%Y %H:%M')}")
-        lines.append("\n" + "=" * 50)
-        lines.append("\nTUOTTEET / PRODUCTS:")
-        lines.append("-" * 50)
+        return "\n".join(self.iter_text_chunks())
+    
+    def iter_text_chunks(self) -> Iterator[str]:
+        """
+        Luo kuitti osa kerrallaan / Generate receipt section by section
+        
+        Osat rivinvaihdoilla yhdistettynä = generate_text().
+        Joined with newlines the chunks equal generate_text().
+        """
+        for block in self.iter_blocks():
+            yield block.text
+    
+    def build_document(self) -> ReceiptDocument:
+        """Luo kuitti kerran lohkoiksi / Render receipt once into typed blocks"""
+        return ReceiptDocument(self.iter_blocks())
+    
+    def iter_blocks(self) -> Iterator[ReceiptBlock]:
+        """Luo kuitin lohkot / Generate receipt blocks"""
+        yield ReceiptBlock(BlockType.LOGO, self.LOGO)
+        yield ReceiptBlock(BlockType.HEADER, "\n".join([
+            f"\n{self.company_info['name']}",
+            f"Y-tunnus: {self.company_info['business_id']}",
+            f"{self.company_info['address']}",
+            f"Puh: {self.company_info['phone']}"
+        ]))
+        yield ReceiptBlock(BlockType.DATE, "\n".join([
+            f"\nPäivämäärä: {datetime.now().strftime('%d.%m.%Y %H:%M')}",
+            "\n" + "=" * 50,
+            "\nTUOTTEET / PRODUCTS:",
+            "-" * 50
+        ]))
         
         for i, product in enumerate(self.products, 1):
-            lines.append(f"{i}. {product.name}")
-            lines.append(f"   {product.quantity} kpl x {product.price:.2f} € = {product.total():.2f} €")
-        
-        lines.append("-" * 50)
-        lines.append(f"Välisumma (ilman ALV): {self.get_subtotal():.2f} €")
-        lines.append(f"ALV 24%: {self.get_vat():.2f} €")
-        lines.append("=" * 50)
-        lines.append(f"YHTEENSÄ: {self.get_total():.2f} €")
-        lines.append("=" * 50)
-        lines.append("\nKiitos ostoksesta! / Thank you for your purchase!")
-        lines.append("\n")
-        
-        return "\n".join(lines)
+            yield ReceiptBlock(
+                BlockType.ITEM,
+                f"{i}. {product.name}\n   {product.quantity} kpl x {format_cents(product.price_cents)} € = "
+                f"{format_cents(product.total_cents())} €"
+            )
+        
+        subtotal = self.get_subtotal_cents()
+        vat = vat_cents(subtotal, self.VAT_RATE)
+        yield ReceiptBlock(BlockType.TOTALS, "\n".join([
+            "-" * 50,
+            f"Välisumma (ilman ALV): {format_cents(subtotal)} €",
+            f"ALV 24%: {format_cents(vat)} €",
+            "=" * 50,
+            f"YHTEENSÄ: {format_cents(subtotal + vat)} €",
+            "=" * 50
+        ]))
+        yield ReceiptBlock(BlockType.FOOTER, "\nKiitos ostoksesta! / Thank you for your purchase!\n\n")
 
 
 class ReceiptPrinter:
     """Kuitin tulostus / Receipt printing"""
     
     @staticmethod
-    def print_to_printer(text: str) -> bool:
+    def print_to_printer(text: Union[str, ReceiptDocument]) -> bool:
         """Tulosta oletustulostimeen / Print to default printer"""
+        if isinstance(text, ReceiptDocument):
+            return ReceiptPrinter.print_chunks(text.chunks())
+        return ReceiptPrinter.print_chunks([text])
+    
+    @staticmethod
+    def print_chunks(chunks: Iterable[str]) -> bool:
+        """
+        Tulosta kuitti osa kerrallaan / Print receipt chunk by chunk
+        
+        Linux/macOS: osat kirjoitetaan suoraan lpr:n syötteeseen, joten
+        koko kuittia ei koota yhdeksi merkkijonoksi. lpr lähettää työn
+        vasta syötteen loputtua, joten tulostus ei ala aiemmin; nopeampaan
+        ensimmäiseen riviin tarvitaan print_to_network_printer.
+        Linux/macOS: chunks are written into lpr's stdin as they are
+        rendered, so the receipt is never joined into one string. lpr
+        spools the job until its input ends, so printing does not start
+        any sooner; print_to_network_printer sends to a raw ESC/POS
+        socket, which prints as data arrives.
+        """
         try:
             system = platform.system()
             
-            # Luo väliaikainen tiedosto / Create temporary file
+            if system in ("Linux", "Darwin"):
+                process = subprocess.Popen(["lpr"], stdin=subprocess.PIPE)
+                try:
+                    ReceiptPrinter._write_chunks(process.stdin, chunks)
+                finally:
+                    process.stdin.close()
+                return process.wait() == 0
+            
+            if system != "Windows":
+                return False
+            
+            # Windows: käytä notepad /p komentoa väliaikaisella tiedostolla
+            # Windows: notepad /p needs a temporary file; text mode gives it \r\n
             with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as f:
-                f.write(text)
+                ReceiptPrinter._write_chunks(f, chunks, encoding=None)
                 temp_path = f.name
             
             try:
-                if system == "Windows":
-                    # Windows: käytä notepad /p komentoa
-                    subprocess.run(["notepad", "/p", temp_path], check=True)
-                    return True
-                elif system == "Linux":
-                    # Linux: yritä lpr-komentoa
-                    result = subprocess.run(["lpr", temp_path], check=True)
-                    return result.returncode == 0
-                elif system == "Darwin":  # macOS
-                    subprocess.run(["lpr", temp_path], check=True)
-                    return True
-                else:
-                    return False
+                subprocess.run(["notepad", "/p", temp_path], check=True)
+                return True
             finally:
                 # Poista väliaikainen tiedosto / Remove temporary file
                 try:
@@ -187,7 +277,60 @@ class ReceiptPrinter:
             return False
     
     @staticmethod
-    def save_as_png(text: str, filepath: str) -> bool:
+    def print_to_network_printer(
+        text: Union[str, ReceiptDocument],
+        host: str,
+        port: int = 9100,
+        max_bytes: int = 4096,
+        start_segment: int = 0,
+        start_checksum: Optional[int] = None
+    ) -> bool:
+        """
+        Tulosta verkkotulostimeen osissa / Print to a network ESC/POS printer in segments
+        
+        Pitkä kuitti lähetetään enintään max_bytes kokoisina osina, jotka
+        tulostin kuittaa. Virheen jälkeen jatketaan viimeisestä kuitatusta
+        osasta, joten koko kuittia ei tarvitse tulostaa uudelleen.
+        A long receipt is sent in segments of at most max_bytes that the
+        printer acknowledges. After an error printing resumes from the
+        last acknowledged segment instead of reprinting the whole receipt.
+        Jatkettaessa start_checksum varmistaa, että kuitti on sama /
+        When resuming, start_checksum checks the receipt is still the same.
+        """
+        if not isinstance(text, ReceiptDocument):
+            text = ReceiptDocument([ReceiptBlock(BlockType.TEXT, text)])
+        segments = segment_document(text, max_bytes)
+        try:
+            SegmentedPrinter(SocketPrinterTransport(host, port)).print_segments(
+                segments, start_segment, start_checksum
+            )
+            return True
+        except PrintInterrupted as e:
+            print(f"Tulostusvirhe / Print error: {e} (start_segment={e.acked}, start_checksum={e.checksum})")
+            return False
+        except ValueError as e:
+            print(f"Tulostusvirhe / Print error: {e}")
+            return False
+    
+    @staticmethod
+    def _write_chunks(stream, chunks: Iterable[str], encoding: Optional[str] = "utf-8"):
+        """
+        Kirjoita osat rivinvaihdoin eroteltuina / Write newline-separated chunks
+        
+        encoding=None: tekstivirta, joka muuntaa rivinvaihdot /
+        a text stream, which translates the line endings itself.
+        """
+        separator = "\n" if encoding is None else b"\n"
+        first = True
+        for chunk in chunks:
+            if not first:
+                stream.write(separator)
+            stream.write(chunk if encoding is None else chunk.encode(encoding))
+            stream.flush()
+            first = False
+    
+    @staticmethod
+    def save_as_png(text: Union[str, ReceiptDocument], filepath: str) -> bool:
         """Tallenna kuitti PNG-kuvana / Save receipt as PNG"""
         if not PILLOW_AVAILABLE:
             print("Pillow-kirjasto puuttuu! / Pillow library missing!")
@@ -199,7 +342,10 @@ class ReceiptPrinter:
             padding = 30
             font_size = 14
             
-            lines = text.split('\n')
+            if isinstance(text, ReceiptDocument):
+                lines = text.lines()
+            else:
+                lines = text.split('\n')
             
             # Käytä monospace-fonttia jos mahdollista / Use monospace font if possible
             try:
@@ -457,8 +603,7 @@ class ReceiptAppGUI:
             messagebox.showwarning("Virhe", "Lisää tuotteita ensin! / Add products first!")
             return
         
-        text = self.receipt.generate_text()
-        if ReceiptPrinter.print_to_printer(text):
+        if ReceiptPrinter.print_chunks(self.receipt.iter_text_chunks()):
             messagebox.showinfo("Onnistui", "Kuitti lähetetty tulostimeen! / Receipt sent to printer!")
         else:
             messagebox.showerror("Virhe", "Tulostus epäonnistui! / Print failed!")
@@ -490,7 +635,7 @@ class ReceiptAppGUI:
         """Tyhjennä kuitti / Clear receipt"""
         if self.receipt.products:
             if messagebox.askyesno("Vahvista", "Tyhjennetäänkö ostoskori? / Clear shopping cart?"):
-                self.receipt.products.clear()
+                self.receipt.clear_products()
                 self.update_display()
     
     def exit_app(self):
@@ -654,7 +799,7 @@ class ReceiptAppTerminal:
         try:
             choice = input("Tyhjennetäänkö ostoskori? (k/e) / Clear cart? (y/n): ").strip().lower()
             if choice in ['k', 'y', 'yes', 'kyllä']:
-                self.receipt.products.clear()
+                self.receipt.clear_products()
                 self.print_colored("✓ Ostoskori tyhjennetty! / Cart cleared!", "green")
         except KeyboardInterrupt:
             print("\n")
@@ -0,0 +1,1611 @@
+#!/usr/bin/env python3
+"""
+Receipt Core - Shared receipt building blocks
+Harjun Raskaskone Oy (HRK)
+
+Shared by kuittikone.py and receipt_tool.py:
+- Structured receipt document made of typed blocks
+- Text and EPSON ESC/POS backends, segmented printing with resume
+- Content-addressed render cache with a memory budget
+- Opt-in per-stage timing histograms
+- Fixed-width text layout with display-width tables
+- Multi-keyword matching in one pass over the text
+- Integer-cent money arithmetic with an optional NumPy batch path
+- JSON config files with an optional orjson backend and warm-start snapshots
+- Crash-safe receipt numbering shared by processes
+"""
+
+import hashlib
+import json
+import math
+import mmap
+import os
+import pickle
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+import weakref
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+# NumPy for batch money totals
+NUMPY_AVAILABLE = False
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    pass
+
+# orjson for faster config files
+ORJSON_AVAILABLE = False
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    pass
+
+# fcntl for receipt sequence file locks (msvcrt on Windows)
+FCNTL_AVAILABLE = False
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    import msvcrt
+
+
+class BlockType(Enum):
+    """Receipt block types"""
+    LOGO = "logo"
+    HEADER = "header"
+    DATE = "date"
+    ITEM = "item"
+    TOTALS = "totals"
+    PAYMENT = "payment"
+    SPACER = "spacer"
+    WARRANTY = "warranty"
+    PROMO = "promo"
+    VAT = "vat"  # Grouped VAT breakdown
+    FOOTER = "footer"
+    TEXT = "text"  # Free text, e.g. a manually edited receipt
+
+
+@dataclass
+class ReceiptBlock:
+    """One rendered section of a receipt"""
+    kind: BlockType
+    text: str
+
+    def lines(self) -> List[str]:
+        """Physical lines of the block"""
+        return self.text.split("\n")
+
+
+class ReceiptDocument:
+    """
+    Receipt rendered once into typed blocks
+
+    Built once per sale and handed to every backend (TXT, PDF, PNG,
+    ESC/POS), so a multi-format export never renders the receipt twice.
+    Blocks joined with newlines give the plain text receipt.
+    """
+
+    def __init__(self, blocks: Iterable[ReceiptBlock]):
+        self.blocks: List[ReceiptBlock] = list(blocks)
+        self._text: Optional[str] = None
+        self._lines: Optional[List[str]] = None
+
+    def chunks(self) -> Iterator[str]:
+        """Block texts in order, for streaming consumers"""
+        for block in self.blocks:
+            yield block.text
+
+    def text(self) -> str:
+        """Plain text receipt"""
+        if self._text is None:
+            self._text = "\n".join(self.chunks())
+        return self._text
+
+    def lines(self) -> List[str]:
+        """Physical lines of the whole receipt"""
+        if self._lines is None:
+            self._lines = self.text().split("\n")
+        return self._lines
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the document, including its joined text"""
+        return sys.getsizeof(self.blocks) + sys.getsizeof(self.text()) + sum(
+            sys.getsizeof(block) + sys.getsizeof(block.text) for block in self.blocks
+        )
+
+
+class TextBackend:
+    """Plain text backend"""
+
+    @staticmethod
+    def render(document: ReceiptDocument) -> str:
+        return document.text()
+
+
+class EscPosBackend:
+    """
+    EPSON ESC/POS backend
+
+    Logo, header and footer are centered, totals are printed in bold.
+    """
+
+    INIT = b"\x1B\x40"
+    ALIGN_LEFT = b"\x1B\x61\x00"
+    ALIGN_CENTER = b"\x1B\x61\x01"
+    BOLD_ON = b"\x1B\x45\x01"
+    BOLD_OFF = b"\x1B\x45\x00"
+    CUT = b"\x1D\x56\x00"
+
+    CENTERED = {BlockType.LOGO, BlockType.HEADER, BlockType.FOOTER}
+    BOLD = {BlockType.TOTALS}
+
+    @classmethod
+    def block_style(cls, kind: BlockType) -> Tuple[bytes, bytes]:
+        """Commands switching a block's style on and back off"""
+        prefix, suffix = b"", b""
+        if kind in cls.BOLD:
+            prefix, suffix = cls.BOLD_ON, cls.BOLD_OFF
+        if kind in cls.CENTERED:
+            prefix, suffix = prefix + cls.ALIGN_CENTER, cls.ALIGN_LEFT + suffix
+        return prefix, suffix
+
+    @classmethod
+    def render_block(cls, block: ReceiptBlock, encoding: str = "cp858") -> bytes:
+        """Encode one block with its styling commands"""
+        prefix, suffix = cls.block_style(block.kind)
+        return prefix + block.text.encode(encoding, errors="replace") + b"\n" + suffix
+
+    @classmethod
+    def render(cls, document: ReceiptDocument, encoding: str = "cp858", cut: bool = True) -> bytes:
+        parts = [cls.INIT]
+        parts.extend(cls.render_block(block, encoding) for block in document.blocks)
+        if cut:
+            parts.append(cls.CUT)
+        return b"".join(parts)
+
+
+# Segmented printing: a long receipt is sent as bounded segments so the
+# printer's receive buffer never overruns. Each segment ends with an
+# ESC/POS "transmission response" request (GS ( H, fn 48) carrying the
+# segment's sequence number as four digits. The printer answers
+# 37h 22h d1 d2 d3 d4 00h once everything before it has been processed,
+# which acknowledges the segment.
+_ACK_REQUEST = b"\x1D\x28\x48\x06\x00\x30\x30"
+_ACK_PREFIX = b"\x37\x22"
+_ACK_LENGTH = 7
+
+
+# Longest resume header: reset plus bold and centering
+_RESUME_HEADER_MAX = len(EscPosBackend.INIT + EscPosBackend.BOLD_ON + EscPosBackend.ALIGN_CENTER)
+
+
+@dataclass
+class PrintSegment:
+    """One bounded piece of a print job"""
+    sequence: int
+    data: bytes
+    checksum: int  # zlib.crc32 of data, checked before the segment is resent
+    header: bytes = EscPosBackend.INIT  # Reset and the style in effect where data starts
+
+    def wire(self, resume: bool = False) -> bytes:
+        """
+        Segment data followed by its acknowledgement request
+
+        With resume the header goes first, for the first segment sent on a
+        new connection: the printer may have dropped or half-run the
+        segments before it, so it is reset and the style set up again.
+        """
+        data = self.header + self.data if resume else self.data
+        return data + _ACK_REQUEST + b"%04d" % (self.sequence % 10000)
+
+
+def _split_block(block: ReceiptBlock, encoding: str, max_bytes: int) -> Iterator[bytes]:
+    """
+    Pieces of one block's ESC/POS rendering, each at most max_bytes
+
+    Pieces end at line ends; only a line longer than max_bytes is cut,
+    and then between characters. The style commands stay whole at the
+    block's start and end, so no piece ends inside a command or inside
+    a multi-byte character.
+    """
+    data = EscPosBackend.render_block(block, encoding)
+    if len(data) <= max_bytes:
+        yield data
+        return
+    prefix, suffix = EscPosBackend.block_style(block.kind)
+    piece = prefix
+    for line in block.text.split("\n"):
+        encoded = line.encode(encoding, errors="replace") + b"\n"
+        if len(piece) + len(encoded) > max_bytes:
+            if piece:
+                yield piece
+            piece = b""
+            if len(encoded) > max_bytes:
+                for char in line + "\n":
+                    encoded_char = char.encode(encoding, errors="replace")
+                    if len(piece) + len(encoded_char) > max_bytes:
+                        yield piece
+                        piece = b""
+                    piece += encoded_char
+                continue
+        piece += encoded
+    if len(piece) + len(suffix) > max_bytes:
+        yield piece
+        piece = b""
+    yield piece + suffix
+
+
+def segment_document(
+    document: ReceiptDocument,
+    max_bytes: int = 4096,
+    encoding: str = "cp858",
+    cut: bool = True
+) -> List[PrintSegment]:
+    """
+    Split the ESC/POS rendering of document into segments of at most max_bytes
+
+    Segments break at block boundaries. A block bigger than max_bytes
+    gets segments of its own, split at line ends (see _split_block).
+    Joined, the segment data is exactly EscPosBackend.render(document,
+    encoding, cut). Each segment records the reset and style commands
+    to resend before it when printing resumes there; room for them is
+    kept, so data plus header never exceeds max_bytes. The job never
+    selects a code page, so the reset restores the one it started with.
+    """
+    if max_bytes < 64:
+        raise ValueError("max_bytes must be at least 64")
+    budget = max_bytes - _RESUME_HEADER_MAX
+    # (piece, style commands in effect where the piece starts)
+    pieces = [(EscPosBackend.INIT, b"")]
+    for block in document.blocks:
+        prefix, _ = EscPosBackend.block_style(block.kind)
+        for index, piece in enumerate(_split_block(block, encoding, budget)):
+            pieces.append((piece, prefix if index else b""))
+    if cut:
+        pieces.append((EscPosBackend.CUT, b""))
+
+    segments: List[PrintSegment] = []
+    current: List[bytes] = []
+    size = 0
+    style = b""
+    for piece, piece_style in pieces:
+        if current and size + len(piece) > budget:
+            data = b"".join(current)
+            segments.append(PrintSegment(len(segments) + 1, data, zlib.crc32(data), EscPosBackend.INIT + style))
+            current, size = [], 0
+        if not current:
+            style = piece_style
+        current.append(piece)
+        size += len(piece)
+    if current:
+        data = b"".join(current)
+        segments.append(PrintSegment(len(segments) + 1, data, zlib.crc32(data), EscPosBackend.INIT + style))
+    return segments
+
+
+class PrintInterrupted(OSError):
+    """
+    Print job stopped after retries; acked segments were printed
+
+    checksum is the CRC-32 of the last acknowledged segment (None if
+    none was). Pass acked and checksum to print_segments to resume.
+    """
+
+    def __init__(self, message: str, acked: int, checksum: Optional[int] = None):
+        super().__init__(message)
+        self.acked = acked
+        self.checksum = checksum
+
+
+class SocketPrinterTransport:
+    """Raw TCP connection to a network receipt printer (port 9100)"""
+
+    def __init__(self, host: str, port: int = 9100, timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._buffer = b""
+
+    def connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = b""
+
+    def send(self, data: bytes):
+        self._sock.sendall(data)
+
+    def receive_ack(self, timeout: float) -> int:
+        """Sequence number (mod 10000) of the next acknowledgement from the printer"""
+        deadline = time.monotonic() + timeout
+        while True:
+            start = self._buffer.find(_ACK_PREFIX)
+            if start >= 0 and len(self._buffer) >= start + _ACK_LENGTH:
+                digits = self._buffer[start + 2:start + 6]
+                self._buffer = self._buffer[start + _ACK_LENGTH:]
+                if digits.isdigit():
+                    return int(digits)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout("no acknowledgement from printer")
+            self._sock.settimeout(remaining)
+            data = self._sock.recv(256)
+            if not data:
+                raise ConnectionError("printer closed the connection")
+            self._buffer += data
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+
+
+class SegmentedPrinter:
+    """
+    Send print segments back-to-back and resume after errors
+
+    Up to window segments are in flight unacknowledged, so the printer
+    is never idle waiting for the next segment while its buffer holds
+    at most window * max_bytes. After a send error or an acknowledgement
+    timeout the connection is reopened and the job resumes from the
+    segment after the last acknowledged one, sent after its header to
+    reset the printer and restore the style. Resent segments are checked
+    against their CRC-32 first. Segments that were in flight may print
+    twice, window=1 limits that to one segment. After retries attempts
+    in a row without progress PrintInterrupted is raised with the acked
+    count and the last acked segment's checksum, to pass as start and
+    checksum to a later print_segments call.
+    """
+
+    def __init__(
+        self,
+        transport,
+        window: int = 2,
+        ack_timeout: float = 5.0,
+        retries: int = 3,
+        retry_delay: float = 0.5
+    ):
+        self.transport = transport
+        self.window = max(1, window)
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.acked = 0
+        self.resends = 0
+
+    def print_segments(
+        self, segments: Sequence[PrintSegment], start: int = 0, checksum: Optional[int] = None
+    ) -> int:
+        """
+        Print segments[start:]; returns the number of acknowledged segments
+
+        checksum is PrintInterrupted.checksum of the job being resumed:
+        segment start must still have it, so a receipt that renders
+        differently now is not continued half way. ValueError if not.
+        """
+        if not 0 <= start <= len(segments):
+            raise ValueError(f"No segment {start} in a job of {len(segments)}")
+        if start and checksum is not None and segments[start - 1].checksum != checksum:
+            raise ValueError(f"Segment {start} is not the one acknowledged (CRC-32 {checksum:08x})")
+        self.acked = start
+        failures = 0
+        while self.acked < len(segments):
+            progress = self.acked
+            try:
+                self.transport.connect()
+                try:
+                    self._send_pending(segments)
+                finally:
+                    self.transport.close()
+            except OSError as e:
+                # Retries count consecutive failures without progress
+                failures = failures + 1 if self.acked == progress else 1
+                if failures > self.retries:
+                    last = segments[self.acked - 1].checksum if self.acked else None
+                    crc = f" (CRC-32 {last:08x})" if last is not None else ""
+                    raise PrintInterrupted(
+                        f"Print stopped after segment {self.acked}/{len(segments)}{crc}: {e}", self.acked, last
+                    ) from e
+                self.resends += 1
+                time.sleep(self.retry_delay)
+        return self.acked
+
+    def _send_pending(self, segments: Sequence[PrintSegment]):
+        sent = self.acked
+        # Resuming mid-job: restore the printer state before the first
+        # segment, and resend only segments that still match their checksum
+        resume = verify = sent > 0
+        while self.acked < len(segments):
+            while sent < len(segments) and sent - self.acked < self.window:
+                segment = segments[sent]
+                if verify and zlib.crc32(segment.data) != segment.checksum:
+                    raise ValueError(f"Segment {segment.sequence} does not match its CRC-32")
+                self.transport.send(segment.wire(resume))
+                resume = False
+                sent += 1
+            sequence = self.transport.receive_ack(self.ack_timeout)
+            # Printers process in order: an ack covers every segment before it
+            for index in range(self.acked, sent):
+                if segments[index].sequence % 10000 == sequence:
+                    self.acked = index + 1
+                    break
+
+
+def render_cache_key(*parts: Any) -> str:
+    """
+    Stable hash of render inputs
+
+    Parts must be JSON-serializable; enums and datetimes are converted
+    with str(), and dict keys are sorted so equal inputs give equal keys.
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReceiptRenderCache:
+    """
+    LRU cache of rendered receipts bounded by a memory budget
+
+    Entries are evicted least recently used first until the total size
+    fits max_bytes. Sizes are given by the caller, e.g.
+    ReceiptDocument.nbytes(). Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        """Store value; values larger than the whole budget are not cached"""
+        size += sys.getsizeof(key)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size_bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._size_bytes += size
+            while self._size_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def info(self) -> Dict[str, int]:
+        """Cache statistics"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "size_bytes": self._size_bytes,
+            "max_bytes": self.max_bytes
+        }
+
+
+# Stage timing histograms: log-linear buckets, 16 per power of two, so a
+# percentile overstates the true value by at most 6.25% at any scale and
+# recording a duration costs one frexp and a dict update.
+_HISTOGRAM_SUBBUCKETS = 16
+
+
+class TimingHistogram:
+    """Durations of one stage: count, max and bucketed percentiles"""
+
+    __slots__ = ("count", "total", "max", "_buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._buckets: Dict[int, int] = {}
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        mantissa, exponent = math.frexp(seconds if seconds > 1e-9 else 1e-9)
+        index = exponent * _HISTOGRAM_SUBBUCKETS + int((mantissa - 0.5) * 2 * _HISTOGRAM_SUBBUCKETS)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound in seconds of the bucket holding the given fraction of samples"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                exponent, sub = divmod(index, _HISTOGRAM_SUBBUCKETS)
+                upper = math.ldexp(0.5 + (sub + 1) / (2 * _HISTOGRAM_SUBBUCKETS), exponent)
+                return min(upper, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """count, p50, p95, p99 and max; durations in milliseconds"""
+        return {
+            "count": self.count,
+            "p50_ms": round(self.percentile(0.50) * 1000, 4),
+            "p95_ms": round(self.percentile(0.95) * 1000, 4),
+            "p99_ms": round(self.percentile(0.99) * 1000, 4),
+            "max_ms": round(self.max * 1000, 4),
+            "total_ms": round(self.total * 1000, 4)
+        }
+
+
+class _StageSection:
+    """Reusable context manager timing one stage"""
+
+    __slots__ = ("_timer", "_stage", "_start")
+
+    def __init__(self, timer: "StageTimer", stage: str):
+        self._timer = timer
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self._timer.record(self._stage, time.perf_counter() - self._start)
+
+
+class StageTimer:
+    """
+    Opt-in per-stage timing with histograms
+
+    Renderers and config I/O take an optional timer; without one they do
+    no timing at all. Durations come from time.perf_counter() and are
+    aggregated per stage, so memory stays constant however many receipts
+    are timed. dump() writes one JSON line per stage in the
+    {ts, level, message, meta} shape of install.log_event. Safe to share
+    between threads.
+    """
+
+    def __init__(self, component: str = "receipt"):
+        self.component = component
+        self._histograms: Dict[str, TimingHistogram] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = TimingHistogram()
+            histogram.add(seconds)
+
+    def time(self, stage: str) -> _StageSection:
+        """Context manager recording the duration of its body as stage"""
+        return _StageSection(self, stage)
+
+    def timed(self, stage: str, items: Iterable) -> Iterator:
+        """Yield from items, recording the time spent producing them as one stage"""
+        perf_counter = time.perf_counter
+        iterator = iter(items)
+        elapsed = 0.0
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                elapsed += perf_counter() - start
+                break
+            elapsed += perf_counter() - start
+            yield item
+        self.record(stage, elapsed)
+
+    def timed_blocks(self, blocks: Iterable["ReceiptBlock"]) -> Iterator["ReceiptBlock"]:
+        """Yield from blocks, recording each run of same-type blocks as a stage named by the type"""
+        perf_counter = time.perf_counter
+        iterator = iter(blocks)
+        stage = None
+        elapsed = 0.0
+        while True:
+            start = perf_counter()
+            try:
+                block = next(iterator)
+            except StopIteration:
+                break
+            took = perf_counter() - start
+            if block.kind.value == stage:
+                elapsed += took
+            else:
+                if stage is not None:
+                    self.record(stage, elapsed)
+                stage, elapsed = block.kind.value, took
+            yield block
+        if stage is not None:
+            self.record(stage, elapsed)
+
+    def histograms(self) -> Dict[str, Dict[str, float]]:
+        """Summary of every stage, see TimingHistogram.summary"""
+        with self._lock:
+            return {stage: histogram.summary() for stage, histogram in self._histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def dump(self, stream=None, level: str = "info"):
+        """Write one JSON line per stage to stream (default stdout)"""
+        stream = stream if stream is not None else sys.stdout
+        ts = datetime.now(timezone.utc).isoformat()
+        for stage, summary in sorted(self.histograms().items()):
+            meta = {"component": self.component, "stage": stage}
+            meta.update(summary)
+            payload = {"ts": ts, "level": level, "message": "stage_timing", "meta": meta}
+            stream.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        stream.flush()
+
+
+def load_json_file(path: str) -> Any:
+    """Read a UTF-8 JSON file, with orjson when it is installed"""
+    if ORJSON_AVAILABLE:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def dump_json_file(data: Any, path: str) -> bytes:
+    """
+    Write data as UTF-8 JSON indented by two spaces, returning the bytes
+
+    Uses orjson when it is installed and falls back to the json module for
+    data orjson does not take, e.g. non-string keys. Both give the same
+    layout.
+    """
+    payload = None
+    if ORJSON_AVAILABLE:
+        try:
+            payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        except orjson.JSONEncodeError:
+            pass
+    if payload is None:
+        payload = json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(payload)
+    return payload
+
+
+# Warm-start snapshots: a pickled copy of a JSON file's data next to it.
+# The JSON file stays the source of truth; a snapshot is used only while
+# the file's size, mtime and SHA-256 match the ones it was taken from.
+SNAPSHOT_SUFFIX = ".snapshot"
+SNAPSHOT_FORMAT = 1
+
+
+def snapshot_path(path: str) -> str:
+    """Sidecar snapshot path of a JSON file"""
+    return path + SNAPSHOT_SUFFIX
+
+
+def _file_stamp(path: str, payload: bytes) -> Dict[str, Any]:
+    stat = os.stat(path)
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": hashlib.sha256(payload).hexdigest()
+    }
+
+
+def write_json_snapshot(path: str, data: Any, payload: Optional[bytes] = None) -> bool:
+    """
+    Write the warm-start snapshot of the JSON file at path
+
+    data is the file's parsed content and payload its bytes, read back
+    from the file when not given. The snapshot is replaced atomically;
+    returns False if it could not be written.
+    """
+    target = snapshot_path(path)
+    temp = f"{target}.{os.getpid()}.tmp"
+    try:
+        if payload is None:
+            with open(path, "rb") as f:
+                payload = f.read()
+        with open(temp, "wb") as f:
+            pickle.dump(_file_stamp(path, payload), f, protocol=5)
+            pickler = pickle.Pickler(f, protocol=5)
+            # JSON data has no cycles, so skip the memo: several times
+            # faster on large tables
+            pickler.fast = True
+            pickler.dump(data)
+        os.replace(temp, target)
+        return True
+    except (OSError, pickle.PicklingError, TypeError):
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        return False
+
+
+def load_json_snapshot(path: str) -> Optional[Any]:
+    """
+    Data of the JSON file at path from its snapshot, None if it is stale
+
+    Size and mtime are compared first; the file is then hashed, which is
+    much cheaper than parsing it.
+    """
+    try:
+        with open(snapshot_path(path), "rb") as f:
+            stamp = pickle.load(f)
+            stat = os.stat(path)
+            if not isinstance(stamp, dict) or stamp.get("format") != SNAPSHOT_FORMAT \
+                    or stamp.get("size") != stat.st_size or stamp.get("mtime_ns") != stat.st_mtime_ns:
+                return None
+            with open(path, "rb") as source:
+                if hashlib.sha256(source.read()).hexdigest() != stamp.get("sha256"):
+                    return None
+            return pickle.load(f)
+    except Exception:
+        # Missing, truncated or foreign snapshot: parse the JSON instead
+        return None
+
+
+# Receipt sequence files: one memory-mapped file per key (e.g. preset).
+# Header: magic, highest reserved number, numbers voided (after reboots
+# or given back out of order), slot count. Each lease slot: owner pid (0 = free), flags, owner boot
+# id, next number and end of the leased block (exclusive). Unused ranges
+# of free slots are handed out again before new blocks are reserved.
+_SEQ_MAGIC = b"KSEQ0001"
+_SEQ_HEADER = struct.Struct("<8sQQQ")
+_SEQ_SLOT = struct.Struct("<QQQQQ")
+_SEQ_NEXT = struct.Struct("<Q")
+_SEQ_NEXT_OFFSET = 24
+_SEQ_SLOTS = 128
+_SEQ_FILE_SIZE = _SEQ_HEADER.size + _SEQ_SLOTS * _SEQ_SLOT.size
+_SEQ_DURABLE = 1
+
+
+def _read_boot_id() -> Tuple[int, int]:
+    """Id of the running boot, and how far apart two ids of one boot can be"""
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r") as f:
+            return int(f.read().strip().replace("-", "")[:16], 16), 0
+    except (OSError, ValueError):
+        # Boot time in seconds; wall clock adjustments move it a little
+        return int(time.time() - time.monotonic()), 120
+
+
+_BOOT_ID, _BOOT_TOLERANCE = _read_boot_id()
+
+
+def _process_alive(pid: int) -> bool:
+    """False only if pid is known not to be running"""
+    if pid == os.getpid() or not FCNTL_AVAILABLE:
+        # Without fcntl (Windows) there is no safe signal-0 probe; such
+        # leases are reclaimed after a reboot or when closed
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _SequenceCounter:
+    """A key's sequence file and this process's lease on it"""
+
+    # fcntl record locks do not exclude threads of the same process
+    file_lock = threading.Lock()
+
+    def __init__(self, path: str, block_size: int, durable: bool):
+        self.block_size = block_size
+        self.flags = _SEQ_DURABLE if durable else 0
+        self.lock = threading.Lock()
+        self.slot: Optional[int] = None
+        self.next = 0
+        self.end = 0
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with self.locked_file():
+                size = os.fstat(self.fd).st_size
+                if size == 0:
+                    os.ftruncate(self.fd, _SEQ_FILE_SIZE)
+                elif size != _SEQ_FILE_SIZE:
+                    raise ValueError(f"Not a receipt sequence file: {path}")
+                self.map = mmap.mmap(self.fd, _SEQ_FILE_SIZE)
+                if size == 0:
+                    _SEQ_HEADER.pack_into(self.map, 0, _SEQ_MAGIC, 0, 0, _SEQ_SLOTS)
+                    self.map.flush()
+            if self.map[:8] != _SEQ_MAGIC:
+                self.map.close()
+                raise ValueError(f"Not a receipt sequence file: {path}")
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    @contextmanager
+    def locked_file(self):
+        """Exclusive lock on the sequence file across threads and processes"""
+        with self.file_lock:
+            if FCNTL_AVAILABLE:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX, 0, 0, os.SEEK_SET)
+            else:
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.lockf(self.fd, fcntl.LOCK_UN, 0, 0, os.SEEK_SET)
+                else:
+                    os.lseek(self.fd, 0, os.SEEK_SET)
+                    msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+
+    def allocate(self) -> int:
+        with self.lock:
+            number = self.next
+            if number >= self.end:
+                number = self._lease()
+            self.next = number + 1
+            # A plain memory store: survives a crash of this process, and
+            # reaches the disk at the next msync unless durable
+            _SEQ_NEXT.pack_into(self.map, self._slot_offset(self.slot) + _SEQ_NEXT_OFFSET, number + 1)
+            if self.flags & _SEQ_DURABLE:
+                self.map.flush()
+            return number
+
+    def give_back(self, number: int) -> bool:
+        """Undo the allocation of number if it is still the latest one of this lease"""
+        with self.lock:
+            if self.slot is not None and number == self.next - 1:
+                self.next = number
+                _SEQ_NEXT.pack_into(self.map, self._slot_offset(self.slot) + _SEQ_NEXT_OFFSET, number)
+                if self.flags & _SEQ_DURABLE:
+                    self.map.flush()
+                return True
+            # A later number is out already: record the gap as voided
+            with self.locked_file():
+                magic, high, voided, slots = _SEQ_HEADER.unpack_from(self.map, 0)
+                _SEQ_HEADER.pack_into(self.map, 0, magic, high, voided + 1, slots)
+                self.map.flush()
+            return False
+
+    def reserved(self) -> Tuple[int, int]:
+        """Highest reserved number and count of voided numbers"""
+        _, high, voided, _ = _SEQ_HEADER.unpack_from(self.map, 0)
+        return high, voided
+
+    @staticmethod
+    def _slot_offset(slot: int) -> int:
+        return _SEQ_HEADER.size + slot * _SEQ_SLOT.size
+
+    def _lease(self) -> int:
+        """Take a range left by a closed or crashed lease, or reserve a new block"""
+        pid = os.getpid()
+        with self.locked_file():
+            magic, high, voided, slots = _SEQ_HEADER.unpack_from(self.map, 0)
+            if self.slot is not None:
+                # Ours is used up
+                _SEQ_SLOT.pack_into(self.map, self._slot_offset(self.slot), 0, 0, 0, self.end, self.end)
+                self.slot = None
+            free = None
+            for slot in range(slots):
+                offset = self._slot_offset(slot)
+                owner, flags, boot, start, end = _SEQ_SLOT.unpack_from(self.map, offset)
+                if start >= end:
+                    if owner == 0 and free is None:
+                        free = slot
+                    continue
+                same_boot = abs(boot - _BOOT_ID) <= _BOOT_TOLERANCE
+                if owner and same_boot and _process_alive(owner):
+                    continue
+                if owner and not same_boot and not flags & _SEQ_DURABLE:
+                    # The owner's last numbers may not have reached the
+                    # disk before the reboot: skip the rest of its block
+                    voided += end - start
+                    _SEQ_SLOT.pack_into(self.map, offset, 0, 0, 0, end, end)
+                    if free is None:
+                        free = slot
+                    continue
+                self.slot, self.next, self.end = slot, start, end
+                break
+            else:
+                if free is None:
+                    raise RuntimeError("All receipt sequence lease slots are in use")
+                self.slot, self.next, self.end = free, high + 1, high + 1 + self.block_size
+                high = self.end - 1
+            _SEQ_HEADER.pack_into(self.map, 0, magic, high, voided, slots)
+            _SEQ_SLOT.pack_into(
+                self.map, self._slot_offset(self.slot), pid, self.flags, _BOOT_ID, self.next, self.end
+            )
+            self.map.flush()
+        return self.next
+
+    def release(self):
+        """Hand the unused rest of the lease back and close the file"""
+        with self.lock:
+            if self.slot is not None:
+                with self.locked_file():
+                    magic, high, voided, slots = _SEQ_HEADER.unpack_from(self.map, 0)
+                    offset = self._slot_offset(self.slot)
+                    if self.end - 1 == high:
+                        # Last block reserved: give the numbers back outright
+                        high = self.next - 1
+                        _SEQ_HEADER.pack_into(self.map, 0, magic, high, voided, slots)
+                        _SEQ_SLOT.pack_into(self.map, offset, 0, 0, 0, self.next, self.next)
+                    else:
+                        _SEQ_SLOT.pack_into(self.map, offset, 0, 0, 0, self.next, self.end)
+                    self.map.flush()
+                self.slot = None
+            self.next = self.end = 0
+            self.map.close()
+            os.close(self.fd)
+
+    def forget_lease(self):
+        """Drop the lease inherited over fork, it belongs to the parent"""
+        self.lock = threading.Lock()
+        self.slot = None
+        self.next = self.end = 0
+
+
+_open_counters: "weakref.WeakSet[_SequenceCounter]" = weakref.WeakSet()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: [counter.forget_lease() for counter in list(_open_counters)])
+
+
+class ReceiptSequencer:
+    """
+    Crash-safe receipt numbers per key, shared by threads and processes
+
+    Each key (e.g. preset id) has a memory-mapped counter file in
+    directory, locked with fcntl. A process leases a block of block_size
+    numbers under the file lock, then hands them out with a memory store
+    per receipt and no system call. Numbers are never handed out twice.
+    Within a lease they increase; leases of different lanes interleave.
+
+    Issued numbers stay gap-free: a lane's unused numbers go back to the
+    file on close() or when its process dies, and are handed out before
+    any new block. After a power loss or reboot, the unused rest of a
+    dead lease is voided instead (counted in info()), since its last
+    numbers may not have reached the disk. durable=True syncs every
+    number to disk (a system call per receipt) so those ranges can be
+    reused too. block_size=1 gives strictly increasing numbers at the
+    cost of a file lock per receipt. A number taken for a receipt that
+    then failed to render goes back with give_back().
+    """
+
+    def __init__(self, directory: str, block_size: int = 100, durable: bool = False):
+        self.directory = directory
+        self.block_size = max(1, block_size)
+        self.durable = durable
+        self._counters: Dict[str, _SequenceCounter] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        if re.fullmatch(r"[A-Za-z0-9_.-]{1,64}", key) and not key.startswith("."):
+            name = key
+        else:
+            name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, f"{name}.seq")
+
+    def _counter(self, key: str) -> _SequenceCounter:
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.get(key)
+                if counter is None:
+                    counter = _SequenceCounter(self._path(key), self.block_size, self.durable)
+                    _open_counters.add(counter)
+                    self._counters[key] = counter
+        return counter
+
+    def allocate(self, key: str) -> int:
+        """Next receipt number for key, starting from 1"""
+        return self._counter(key).allocate()
+
+    def give_back(self, key: str, number: int) -> bool:
+        """
+        Return a number whose receipt was never issued
+
+        The number is handed out again if no later number of this lane
+        was taken in between; otherwise it is counted as voided in
+        info(). Returns True if it will be reused.
+        """
+        return self._counter(key).give_back(number)
+
+    def info(self, key: str) -> Dict[str, int]:
+        """Highest reserved and voided receipt numbers of key"""
+        high, voided = self._counter(key).reserved()
+        return {"reserved": high, "voided": voided}
+
+    def close(self):
+        """Return unused leased numbers and close the counter files"""
+        with self._lock:
+            counters = list(self._counters.values())
+            self._counters.clear()
+        for counter in counters:
+            _open_counters.discard(counter)
+            counter.release()
+
+    def __enter__(self) -> "ReceiptSequencer":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Display widths of characters on a fixed-width receipt. Wide ranges are
+# East Asian Wide/Fullwidth characters and emoji, zero-width ranges are
+# combining marks, variation selectors and invisible format characters.
+# Everything else, including €, ✓ and box drawing, is one column wide.
+_WIDE_RANGES: Tuple[Tuple[int, int], ...] = (
+    (0x1100, 0x115F), (0x231A, 0x231B), (0x2329, 0x232A), (0x23E9, 0x23EC),
+    (0x23F0, 0x23F0), (0x23F3, 0x23F3), (0x25FD, 0x25FE), (0x2614, 0x2615),
+    (0x2648, 0x2653), (0x267F, 0x267F), (0x2693, 0x2693), (0x26A1, 0x26A1),
+    (0x26AA, 0x26AB), (0x26BD, 0x26BE), (0x26C4, 0x26C5), (0x26CE, 0x26CE),
+    (0x26D4, 0x26D4), (0x26EA, 0x26EA), (0x26F2, 0x26F3), (0x26F5, 0x26F5),
+    (0x26FA, 0x26FA), (0x26FD, 0x26FD), (0x2705, 0x2705), (0x270A, 0x270B),
+    (0x2728, 0x2728), (0x274C, 0x274C), (0x274E, 0x274E), (0x2753, 0x2755),
+    (0x2757, 0x2757), (0x2795, 0x2797), (0x27B0, 0x27B0), (0x27BF, 0x27BF),
+    (0x2B1B, 0x2B1C), (0x2B50, 0x2B50), (0x2B55, 0x2B55), (0x2E80, 0x303E),
+    (0x3041, 0x33FF), (0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xA000, 0xA4CF),
+    (0xA960, 0xA97F), (0xAC00, 0xD7A3), (0xF900, 0xFAFF), (0xFE10, 0xFE19),
+    (0xFE30, 0xFE6F), (0xFF00, 0xFF60), (0xFFE0, 0xFFE6),
+    (0x16FE0, 0x18CFF), (0x1B000, 0x1B2FF), (0x1F004, 0x1F004), (0x1F0CF, 0x1F0CF),
+    (0x1F18E, 0x1F18E), (0x1F191, 0x1F19A), (0x1F200, 0x1F2FF), (0x1F300, 0x1F320),
+    (0x1F32D, 0x1F335), (0x1F337, 0x1F37C), (0x1F37E, 0x1F393), (0x1F3A0, 0x1F3CA),
+    (0x1F3CF, 0x1F3D3), (0x1F3E0, 0x1F3F0), (0x1F3F4, 0x1F3F4), (0x1F3F8, 0x1F43E),
+    (0x1F440, 0x1F440), (0x1F442, 0x1F4FC), (0x1F4FF, 0x1F53D), (0x1F54B, 0x1F54E),
+    (0x1F550, 0x1F567), (0x1F57A, 0x1F57A), (0x1F595, 0x1F596), (0x1F5A4, 0x1F5A4),
+    (0x1F5FB, 0x1F64F), (0x1F680, 0x1F6C5), (0x1F6CC, 0x1F6CC), (0x1F6D0, 0x1F6D2),
+    (0x1F6D5, 0x1F6DF), (0x1F6EB, 0x1F6EC), (0x1F6F4, 0x1F6FC), (0x1F7E0, 0x1F7F0),
+    (0x1F90C, 0x1F93A), (0x1F93C, 0x1F945), (0x1F947, 0x1F9FF), (0x1FA70, 0x1FAFF),
+    (0x20000, 0x2FFFD), (0x30000, 0x3FFFD),
+)
+_ZERO_WIDTH_RANGES: Tuple[Tuple[int, int], ...] = (
+    (0x0300, 0x036F), (0x0483, 0x0489), (0x0591, 0x05BD), (0x0610, 0x061A),
+    (0x064B, 0x065F), (0x1160, 0x11FF), (0x1AB0, 0x1AFF), (0x1DC0, 0x1DFF),
+    (0x200B, 0x200F), (0x202A, 0x202E), (0x2060, 0x2064), (0x20D0, 0x20FF),
+    (0x302A, 0x302D), (0x3099, 0x309A), (0xFE00, 0xFE0F), (0xFE20, 0xFE2F),
+    (0xFEFF, 0xFEFF), (0x1F3FB, 0x1F3FF), (0xE0000, 0xE0FFF),
+)
+
+
+def _build_width_tables():
+    """One byte per BMP code point, sorted ranges for the rest"""
+    bmp = bytearray(b"\x01") * 0x10000
+    astral = []
+    for ranges, width in ((_WIDE_RANGES, 2), (_ZERO_WIDTH_RANGES, 0)):
+        for start, end in ranges:
+            if start < 0x10000:
+                bmp[start:end + 1] = bytes([width]) * (end + 1 - start)
+            else:
+                astral.append((start, end, width))
+    astral.sort()
+    return bytes(bmp), [r[0] for r in astral], astral
+
+
+_BMP_WIDTHS, _ASTRAL_STARTS, _ASTRAL_RANGES = _build_width_tables()
+
+
+def char_width(char: str) -> int:
+    """Display width of one character: 0, 1 or 2 columns"""
+    code = ord(char)
+    if code < 0x10000:
+        return _BMP_WIDTHS[code]
+    i = bisect_right(_ASTRAL_STARTS, code) - 1
+    if i >= 0 and code <= _ASTRAL_RANGES[i][1]:
+        return _ASTRAL_RANGES[i][2]
+    return 1
+
+
+@lru_cache(maxsize=4096)
+def _non_ascii_width(text: str) -> int:
+    table = _BMP_WIDTHS
+    width = 0
+    for char in text:
+        code = ord(char)
+        width += table[code] if code < 0x10000 else char_width(char)
+    return width
+
+
+def display_width(text: str) -> int:
+    """Number of printer columns text occupies"""
+    if text.isascii():
+        return len(text)
+    return _non_ascii_width(text)
+
+
+class TextLayout:
+    """
+    Fixed-width receipt layout
+    
+    Wraps text to the receipt width and right-aligns amounts in a price
+    column. Widths are measured in printer columns with display_width(),
+    so names with ä/ö, € signs or emoji line up on 58 mm printers too.
+    Short ASCII rows, the common case, take a single len() check.
+    """
+    
+    def __init__(self, width: int):
+        self.width = width
+    
+    def wrap(self, text: str, indent: str = "") -> str:
+        """Wrap text at word boundaries; continuation lines get indent"""
+        if len(text) <= self.width and (text.isascii() or _non_ascii_width(text) <= self.width):
+            return text
+        return "\n".join(self.wrap_lines(text, self.width, indent))
+    
+    @staticmethod
+    def wrap_lines(text: str, width: int, indent: str = "") -> List[str]:
+        """Wrap text into lines of at most width columns"""
+        indent_width = display_width(indent)
+        if indent_width >= width:
+            indent, indent_width = "", 0
+        stripped = text.lstrip(" ")
+        lines = []
+        # Leading spaces of the first line are kept as they are
+        line = text[:len(text) - len(stripped)]
+        line_width = len(line)
+        has_words = False
+        for word in stripped.split(" "):
+            word_width = display_width(word)
+            if has_words:
+                if line_width + 1 + word_width <= width:
+                    line += " " + word
+                    line_width += 1 + word_width
+                    continue
+                lines.append(line)
+                line, line_width = indent, indent_width
+                has_words = False
+                if not word:
+                    continue
+            # Words longer than a line are broken at the column limit
+            while line_width + word_width > width:
+                take = []
+                room = width - line_width
+                for char in word:
+                    w = char_width(char)
+                    if w > room and take:
+                        break
+                    take.append(char)
+                    room -= w
+                head = "".join(take)
+                lines.append(line + head)
+                word = word[len(head):]
+                word_width = display_width(word)
+                line, line_width = indent, indent_width
+            line += word
+            line_width += word_width
+            has_words = True
+        lines.append(line)
+        return lines
+    
+    def row(self, left: str, right: str, indent: str = "") -> str:
+        """Left text wrapped, right text aligned to the right edge of its last line"""
+        right_width = len(right) if right.isascii() else _non_ascii_width(right)
+        gap = self.width - right_width - (len(left) if left.isascii() else _non_ascii_width(left))
+        if gap >= 1:
+            return left + " " * gap + right
+        width = self.width
+        
+        room = width - right_width - 1
+        if room < 1:
+            # Amount does not fit beside any text, print it on its own line
+            return self.wrap(left, indent) + "\n" + " " * max(width - right_width, 0) + right
+        lines = self.wrap_lines(left, room, indent)
+        last = lines[-1]
+        lines[-1] = last + " " * (width - display_width(last) - right_width) + right
+        return "\n".join(lines)
+    
+    def columns(self, cells: Sequence[str], first_width: int = 6) -> str:
+        """First cell left-aligned, the rest right-aligned in equal columns"""
+        rest = cells[1:]
+        column = (self.width - first_width) // len(rest)
+        first = cells[0]
+        pad = self.width - column * len(rest) - display_width(first)
+        return first + " " * max(pad, 0) + "".join(
+            " " * max(column - display_width(cell), 1) + cell for cell in rest
+        )
+    
+    def clip(self, text: str) -> str:
+        """Cut every line of text to the receipt width"""
+        lines = text.split("\n")
+        for i, line in enumerate(lines):
+            if display_width(line) > self.width:
+                room = self.width
+                end = 0
+                for end, char in enumerate(line):
+                    room -= char_width(char)
+                    if room < 0:
+                        break
+                lines[i] = line[:end]
+        return "\n".join(lines)
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton for matching many keywords at once
+    
+    Keywords match case-insensitively anywhere in a text. search() walks
+    the texts once, character by character, whatever the number of
+    keywords, and returns the indexes of the keywords found. A match
+    never spans two texts. Transitions that follow failure links are
+    remembered as they are first taken, so each character then costs a
+    single lookup.
+    """
+    __slots__ = ("keywords", "_goto", "_fail", "_out", "_delta")
+    
+    _SEPARATOR = "\x00"
+    
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = list(keywords)
+        goto: List[Dict[str, int]] = [{}]
+        out: List[Tuple[int, ...]] = [()]
+        for index, keyword in enumerate(self.keywords):
+            key = keyword.casefold()
+            if not key or self._SEPARATOR in key:
+                raise ValueError(f"Invalid keyword: {keyword!r}")
+            state = 0
+            for char in key:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    out.append(())
+                state = next_state
+            out[state] += (index,)
+        
+        # Breadth first, so a state's failure target is finished before it
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for char, child in goto[state].items():
+                target = fail[state]
+                while target and char not in goto[target]:
+                    target = fail[target]
+                fail[child] = goto[target].get(char, 0)
+                out[child] += out[fail[child]]
+                queue.append(child)
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+        self._delta = [dict(transitions) for transitions in goto]
+    
+    def __len__(self) -> int:
+        return len(self.keywords)
+    
+    def _step(self, state: int, char: str) -> int:
+        """Follow failure links for a missing transition and remember the result"""
+        goto = self._goto
+        target = state
+        while target and char not in goto[target]:
+            target = self._fail[target]
+        next_state = goto[target].get(char, 0)
+        self._delta[state][char] = next_state
+        return next_state
+    
+    def search(self, texts: Iterable[str]) -> Set[int]:
+        """Indexes of the keywords occurring in any of the texts"""
+        delta = self._delta
+        out = self._out
+        found: Set[int] = set()
+        state = 0
+        for char in self._SEPARATOR.join(texts).casefold():
+            next_state = delta[state].get(char)
+            state = self._step(state, char) if next_state is None else next_state
+            if out[state]:
+                found.update(out[state])
+        return found
+    
+    def search_each(self, texts: Iterable[str]) -> List[Set[int]]:
+        """Indexes of the keywords occurring in each text, in one pass"""
+        delta = self._delta
+        out = self._out
+        results = []
+        for text in texts:
+            found: Set[int] = set()
+            state = 0
+            for char in text.casefold():
+                next_state = delta[state].get(char)
+                state = self._step(state, char) if next_state is None else next_state
+                if out[state]:
+                    found.update(out[state])
+            results.append(found)
+        return results
+
+
+# Money is kept in integer cents. Prices are rounded to cents once on
+# entry, VAT is rounded half up per receipt, and every printed amount is
+# formatted from cents, so printed subtotal + VAT always equals the total.
+
+def to_cents(amount: float) -> int:
+    """Euro amount to integer cents"""
+    return int(round(amount * 100))
+
+
+def format_cents(cents: int) -> str:
+    """Integer cents as a printed amount, e.g. 1250 -> 12.50"""
+    # Exact: cents / 100 is the double nearest to the decimal amount
+    return f"{cents / 100:.2f}"
+
+
+def vat_basis_points(vat_rate: float) -> int:
+    """VAT rate in 1/10000, e.g. 0.24 -> 2400"""
+    return int(round(vat_rate * 10000))
+
+
+def vat_cents(subtotal_cents: int, vat_rate: float) -> int:
+    """VAT of a subtotal, rounded half up to the cent"""
+    scaled = subtotal_cents * vat_basis_points(vat_rate)
+    if scaled >= 0:
+        return (scaled + 5000) // 10000
+    return -((-scaled + 5000) // 10000)
+
+
+def allocate_cents(total_cents: int, weights: Sequence[int]) -> List[int]:
+    """
+    Split total_cents over weights in proportion, in one pass
+    
+    Each share is rounded from the running total, so the shares add up
+    to exactly total_cents, each is within a cent of its exact
+    proportion, and none exceeds its weight while total_cents does not
+    exceed the sum of the weights.
+    """
+    weight_total = sum(weights)
+    if weight_total <= 0:
+        raise ValueError("weights must have a positive sum")
+    shares = []
+    cumulative = allocated = 0
+    for weight in weights:
+        cumulative += weight
+        target = (2 * total_cents * cumulative + weight_total) // (2 * weight_total)
+        shares.append(target - allocated)
+        allocated = target
+    return shares
+
+
+def format_rate(vat_rate: float) -> str:
+    """VAT rate as printed percent, e.g. 0.255 -> 25.5"""
+    return f"{vat_rate * 100:g}"
+
+
+# (VAT rate, net cents, VAT cents) per rate, highest rate first
+VatRow = Tuple[float, int, int]
+
+
+class MoneyTotals:
+    """
+    Running receipt totals in integer cents
+    
+    add() and remove() update the subtotal and the per-rate nets in O(1),
+    so totals never walk the product list. Lines without their own VAT
+    rate are kept under None and taxed at the receipt's default rate.
+    VAT is rounded once per rate, which is also how it is printed.
+    """
+    __slots__ = ("subtotal_cents", "lines", "net_by_rate")
+    
+    def __init__(self):
+        self.subtotal_cents = 0
+        self.lines = 0
+        # rate -> [net cents, line count]
+        self.net_by_rate: Dict[Optional[float], List[int]] = {}
+    
+    def add(self, line_cents: int, vat_rate: Optional[float] = None):
+        self.subtotal_cents += line_cents
+        self.lines += 1
+        group = self.net_by_rate.get(vat_rate)
+        if group is None:
+            self.net_by_rate[vat_rate] = [line_cents, 1]
+        else:
+            group[0] += line_cents
+            group[1] += 1
+    
+    def remove(self, line_cents: int, vat_rate: Optional[float] = None):
+        self.subtotal_cents -= line_cents
+        self.lines -= 1
+        group = self.net_by_rate[vat_rate]
+        group[0] -= line_cents
+        group[1] -= 1
+        if not group[1]:
+            del self.net_by_rate[vat_rate]
+    
+    def discount(self, cents: int, vat_rate: Optional[float] = None):
+        """Take a discount off the net of one rate, before VAT"""
+        self.subtotal_cents -= cents
+        self.net_by_rate[vat_rate][0] -= cents
+    
+    def reset(self, lines: Iterable[Tuple[int, Optional[float]]] = ()):
+        """Start over from (line cents, VAT rate) pairs"""
+        self.subtotal_cents = 0
+        self.lines = 0
+        self.net_by_rate = {}
+        for line_cents, vat_rate in lines:
+            self.add(line_cents, vat_rate)
+    
+    def breakdown(self, default_rate: float) -> List[VatRow]:
+        """Net and VAT per rate, highest rate first"""
+        nets: Dict[float, int] = {}
+        for rate, (net, _) in self.net_by_rate.items():
+            if rate is None:
+                rate = default_rate
+            nets[rate] = nets.get(rate, 0) + net
+        return [(rate, net, vat_cents(net, rate)) for rate, net in sorted(nets.items(), reverse=True)]
+    
+    def vat_cents(self, default_rate: float) -> int:
+        if len(self.net_by_rate) <= 1:
+            rate = next(iter(self.net_by_rate), None)
+            return vat_cents(self.subtotal_cents, default_rate if rate is None else rate)
+        return sum(vat for _, _, vat in self.breakdown(default_rate))
+    
+    def total_cents(self, default_rate: float) -> int:
+        return self.subtotal_cents + self.vat_cents(default_rate)
+
+
+def format_vat_breakdown(rows: Iterable[VatRow], layout: "TextLayout") -> str:
+    """Grouped VAT breakdown block: rate, net, VAT and gross per rate"""
+    lines = [
+        "ALV-ERITTELY / VAT BREAKDOWN",
+        layout.columns(("ALV%", "Netto", "ALV", "Brutto"))
+    ]
+    net_total = vat_total = 0
+    for rate, net, vat in rows:
+        lines.append(layout.columns((
+            format_rate(rate), format_cents(net), format_cents(vat), format_cents(net + vat)
+        )))
+        net_total += net
+        vat_total += vat
+    lines.append(layout.columns((
+        "Yht.", format_cents(net_total), format_cents(vat_total), format_cents(net_total + vat_total)
+    )))
+    return "\n".join(lines)
+
+
+def batch_totals(
+    quantities: Sequence[int],
+    prices: Sequence[float],
+    receipt_ids: Optional[Sequence[int]] = None,
+    vat_rate: float = 0.24,
+    vat_rates: Optional[Sequence[float]] = None
+) -> Dict[str, Any]:
+    """
+    Subtotal, VAT and total in cents for many receipt lines at once
+    
+    Lines are grouped by receipt_ids (all lines form one receipt when it
+    is None). vat_rates gives each line its own rate, otherwise vat_rate
+    applies to all. VAT is rounded per receipt and rate exactly like
+    MoneyTotals, so report totals match the printed receipts. "by_rate"
+    maps each rate to its (net cents, VAT cents) over all receipts, which
+    is the month-end VAT report.
+    
+    All lines are aggregated in a single pass. Uses NumPy when available;
+    the per-receipt values are arrays then, lists otherwise. Passing NumPy
+    arrays instead of lists skips the conversion.
+    """
+    if NUMPY_AVAILABLE:
+        return _batch_totals_numpy(quantities, prices, receipt_ids, vat_rate, vat_rates)
+    
+    if receipt_ids is None:
+        receipt_ids = [0] * len(quantities)
+        count = 1
+    else:
+        count = max(receipt_ids) + 1 if len(receipt_ids) else 0
+    if vat_rates is None:
+        vat_rates = [vat_rate] * len(quantities)
+    
+    nets: Dict[Tuple[int, float], int] = {}
+    for receipt_id, quantity, price, rate in zip(receipt_ids, quantities, prices, vat_rates):
+        key = (receipt_id, rate)
+        nets[key] = nets.get(key, 0) + quantity * to_cents(price)
+    
+    subtotals = [0] * count
+    vats = [0] * count
+    by_rate: Dict[float, Tuple[int, int]] = {}
+    for (receipt_id, rate), net in nets.items():
+        vat = vat_cents(net, rate)
+        subtotals[receipt_id] += net
+        vats[receipt_id] += vat
+        rate_net, rate_vat = by_rate.get(rate, (0, 0))
+        by_rate[rate] = (rate_net + net, rate_vat + vat)
+    totals = [net + vat for net, vat in zip(subtotals, vats)]
+    return {
+        "subtotal_cents": subtotals,
+        "vat_cents": vats,
+        "total_cents": totals,
+        "by_rate": dict(sorted(by_rate.items(), reverse=True)),
+        "sum_subtotal_cents": sum(subtotals),
+        "sum_vat_cents": sum(vats),
+        "sum_total_cents": sum(totals)
+    }
+
+
+def _batch_totals_numpy(quantities, prices, receipt_ids, vat_rate, vat_rates) -> Dict[str, Any]:
+    # np.rint rounds half to even like round() in to_cents
+    line_cents = np.asarray(quantities, dtype=np.int64) * np.rint(
+        np.asarray(prices, dtype=np.float64) * 100
+    ).astype(np.int64)
+    if receipt_ids is None:
+        ids = np.zeros(len(line_cents), dtype=np.int64)
+        count = 1
+    else:
+        ids = np.asarray(receipt_ids, dtype=np.int64)
+        count = int(ids.max()) + 1 if len(ids) else 0
+    
+    # Rates in basis points index a small table of the rates in use,
+    # found with a bincount instead of sorting the lines
+    if vat_rates is None:
+        rate_bp = np.array([vat_basis_points(vat_rate)], dtype=np.int64)
+        rate_index = np.zeros(len(line_cents), dtype=np.int64)
+    else:
+        line_bp = np.rint(np.asarray(vat_rates, dtype=np.float64) * 10000).astype(np.int64)
+        rate_bp = np.flatnonzero(np.bincount(line_bp)) if len(line_bp) else np.zeros(0, dtype=np.int64)
+        lookup = np.zeros(int(rate_bp[-1]) + 1 if len(rate_bp) else 1, dtype=np.int64)
+        lookup[rate_bp] = np.arange(len(rate_bp))
+        rate_index = lookup[line_bp]
+    rates = len(rate_bp)
+    
+    # float64 sums of whole cents are exact below 2**53 cents per group
+    nets = np.rint(np.bincount(
+        ids * rates + rate_index, weights=line_cents, minlength=count * rates
+    )).astype(np.int64).reshape(count, rates)
+    scaled = nets * rate_bp
+    vats = np.sign(scaled) * ((np.abs(scaled) + 5000) // 10000)
+    
+    subtotals = nets.sum(axis=1)
+    receipt_vats = vats.sum(axis=1)
+    totals = subtotals + receipt_vats
+    rate_nets = nets.sum(axis=0)
+    rate_vats = vats.sum(axis=0)
+    by_rate = {}
+    if len(line_cents):
+        for i in reversed(range(rates)):
+            rate = vat_rate if vat_rates is None else int(rate_bp[i]) / 10000
+            by_rate[rate] = (int(rate_nets[i]), int(rate_vats[i]))
+    return {
+        "subtotal_cents": subtotals,
+        "vat_cents": receipt_vats,
+        "total_cents": totals,
+        "by_rate": by_rate,
+        "sum_subtotal_cents": int(subtotals.sum()),
+        "sum_vat_cents": int(receipt_vats.sum()),
+        "sum_total_cents": int(totals.sum())
+    }
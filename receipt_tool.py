@@ -19,9 +19,17 @@ import re
 import subprocess
 import sys
 import tempfile
+import time
+from contextlib import nullcontext
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Iterator, Optional, Tuple, Union
+
+from receipt_core import (
+    BlockType, MoneyTotals, ReceiptBlock, ReceiptDocument, ReceiptRenderCache, ReceiptSequencer, StageTimer,
+    TextBackend, TextLayout,
+    display_width, format_cents, format_rate, format_vat_breakdown, render_cache_key, to_cents
+)
 
 # Try to import GUI libraries
 GUI_AVAILABLE = False
@@ -77,40 +85,224 @@ DEFAULT_CONFIG = {
             "logo": "*** {name} ***",
             "header_format": "{name} | {business_id}",
             "footer": "Kiitos!"
+        },
+        "vat_breakdown": {
+            "name": "ALV-erittely / VAT breakdown",
+            "extends": "default",
+            "vat_breakdown": True
         }
     },
     "history": []
 }
 
 
+DEFAULT_FOOTER = "Kiitos ostoksesta! / Thank you for your purchase!"
+
+# Compiled templates keyed by (template id, company info, template chain)
+COMPILED_TEMPLATE_CACHE_SIZE = 128
+_compiled_templates: Dict[tuple, "CompiledTemplate"] = {}
+
+
+class CompiledTemplate:
+    """Template with inheritance resolved and texts formatted with company info"""
+    __slots__ = ("template_id", "found", "logo", "header", "footer", "vat_breakdown")
+    
+    def __init__(
+        self,
+        template_id: str,
+        found: bool,
+        logo: str,
+        header: str,
+        footer: str,
+        vat_breakdown: bool = False
+    ):
+        self.template_id = template_id
+        self.found = found
+        self.logo = logo
+        self.header = header
+        self.footer = footer
+        self.vat_breakdown = vat_breakdown
+
+
+def _template_chain(templates: Dict, template_id: str) -> List[Dict]:
+    """Template followed by its ancestors ("extends" key)"""
+    chain = []
+    seen = set()
+    while template_id in templates and template_id not in seen:
+        seen.add(template_id)
+        template = templates[template_id]
+        chain.append(template)
+        template_id = template.get("extends")
+    return chain
+
+
+def compile_template(
+    templates: Dict,
+    template_id: str,
+    company_info: Dict,
+    width: int = 0
+) -> CompiledTemplate:
+    """
+    Compile a receipt_tool template once per (template, company info, width)
+    
+    Templates may name a parent with "extends"; missing keys are taken
+    from the parent. The logo, header and footer are formatted once and
+    the result is cached, so preview refreshes skip the .format() work.
+    Header and footer lines are wrapped to width when it is given.
+    """
+    chain = _template_chain(templates, template_id)
+    key = (
+        template_id,
+        width,
+        tuple(company_info.items()),
+        tuple(tuple(template.items()) for template in chain)
+    )
+    compiled = _compiled_templates.get(key)
+    if compiled is not None:
+        return compiled
+    
+    merged = {}
+    for template in reversed(chain):
+        merged.update(template)
+    
+    header_format = merged.get("header_format", "")
+    if header_format:
+        header = "\n" + header_format.format(**company_info)
+    else:
+        header = "\n".join([
+            f"\n{company_info['name']}",
+            f"Y-tunnus: {company_info['business_id']}",
+            f"{company_info['address']}",
+            f"Puh: {company_info['phone']}"
+        ])
+    
+    footer = merged.get("footer", DEFAULT_FOOTER)
+    if width:
+        layout = TextLayout(width)
+        header = "\n".join(layout.wrap(line) for line in header.split("\n"))
+        footer = "\n".join(layout.wrap(line) for line in footer.split("\n"))
+    
+    compiled = CompiledTemplate(
+        template_id=template_id,
+        found=bool(chain and chain[0]),
+        logo=merged.get("logo", "").format(**company_info),
+        header=header,
+        footer=f"\n{footer}\n",
+        vat_breakdown=bool(merged.get("vat_breakdown", False))
+    )
+    if len(_compiled_templates) >= COMPILED_TEMPLATE_CACHE_SIZE:
+        _compiled_templates.clear()
+    _compiled_templates[key] = compiled
+    return compiled
+
+
 class Product:
-    """Product object"""
-    def __init__(self, name: str, quantity: int, price: float):
+    """
+    Product object, vat_rate None means the receipt's rate
+    
+    While the product is on a receipt, changing its quantity, price or
+    VAT rate moves its line in the receipt's running totals.
+    """
+    def __init__(self, name: str, quantity: int, price: float, vat_rate: Optional[float] = None):
+        self._totals: Optional[MoneyTotals] = None  # Set by the receipt holding the product
         self.name = name
         self.quantity = quantity
         self.price = price
+        self.vat_rate = vat_rate
+    
+    def _change(self, **values):
+        """Set attributes, keeping the receipt's running totals in step"""
+        totals = self._totals
+        if totals is not None:
+            totals.remove(self.total_cents(), self._vat_rate)
+        self.__dict__.update(values)
+        if totals is not None:
+            totals.add(self.total_cents(), self._vat_rate)
+    
+    @property
+    def quantity(self) -> int:
+        return self._quantity
+    
+    @quantity.setter
+    def quantity(self, value: int):
+        self._change(_quantity=value)
+    
+    @property
+    def price(self) -> float:
+        return self._price
+    
+    @price.setter
+    def price(self, value: float):
+        # Rounded to cents once; all totals are computed in cents
+        self._change(_price=value, price_cents=to_cents(value))
+    
+    @property
+    def vat_rate(self) -> Optional[float]:
+        return self._vat_rate
+    
+    @vat_rate.setter
+    def vat_rate(self, value: Optional[float]):
+        self._change(_vat_rate=value)
+    
+    def total_cents(self) -> int:
+        return self.quantity * self.price_cents
     
     def total(self) -> float:
-        return self.quantity * self.price
+        return self.total_cents() / 100
     
     def to_dict(self) -> Dict:
-        return {
+        data = {
             "name": self.name,
             "quantity": self.quantity,
             "price": self.price
         }
+        if self.vat_rate is not None:
+            data["vat_rate"] = self.vat_rate
+        return data
     
     @classmethod
     def from_dict(cls, data: Dict):
-        return cls(data["name"], data["quantity"], data["price"])
+        return cls(data["name"], data["quantity"], data["price"], data.get("vat_rate"))
 
 
 class Receipt:
-    """Enhanced Receipt class with template and manual override support"""
+    """
+    Enhanced Receipt class with template and manual override support
     
-    def __init__(self, config: Optional[Dict] = None):
-        self.config = config or self._load_config()
-        self.products: List[Product] = []
+    With a sequencer, assign_number() gives the sale the next number of
+    sequence_key; the number is printed until release_number() or
+    clear_products() ends the sale.
+    
+    products is read-only: lines are added and removed through
+    add_product() and remove_product(), and edits to a listed Product
+    update the running totals.
+    
+    With a timer, generate_text records its total time ("receipt") and
+    each run of blocks by block type, and config I/O records
+    "load_config" and "save_config".
+    """
+    
+    def __init__(
+        self,
+        config: Optional[Dict] = None,
+        clock: Callable[[], datetime] = datetime.now,
+        render_cache: Optional[ReceiptRenderCache] = None,
+        sequencer: Optional[ReceiptSequencer] = None,
+        sequence_key: str = "receipt_tool",
+        timer: Optional[StageTimer] = None
+    ):
+        self.timer = timer
+        if not config:
+            with self._timing("load_config"):
+                config = self._load_config()
+        self.config = config
+        self.clock = clock
+        self.render_cache = render_cache
+        self.sequencer = sequencer
+        self.sequence_key = sequence_key
+        self.receipt_number: Optional[int] = None
+        self._products: List[Product] = []
+        self.totals = MoneyTotals()  # Running totals in cents
         self._manual_override_text: Optional[str] = None
         self.current_template = "default"
         
@@ -119,6 +311,10 @@ class Receipt:
         self.vat_rate = self.config.get("vat_rate", DEFAULT_VAT_RATE)
         self.width = self.config.get("width", DEFAULT_WIDTH)
     
+    def _timing(self, stage: str):
+        """Context manager timing stage when a timer is set"""
+        return self.timer.time(stage) if self.timer is not None else nullcontext()
+    
     @staticmethod
     def _load_config() -> Dict:
         """Load configuration from JSON file"""
@@ -141,13 +337,18 @@ class Receipt:
             print(f"Error saving config: {e}")
             return False
     
+    def get_template(self) -> CompiledTemplate:
+        """Get current template compiled with company info"""
+        return compile_template(
+            self.config.get("templates", {}), self.current_template, self.company_info, self.width
+        )
+    
     def get_logo(self) -> str:
         """Get current logo from config or template"""
-        template = self.config.get("templates", {}).get(self.current_template, {})
-        if template:
-            logo = template.get("logo", "")
-            # Format logo with company info
-            return logo.format(**self.company_info)
+        template = self.get_template()
+        if template.found:
+            # Logo formatted with company info
+            return template.logo
         return self.config.get("logo_ascii", DEFAULT_LOGO).strip()
     
     def set_logo(self, logo: str) -> bool:
@@ -173,18 +374,21 @@ class Receipt:
     def _validate_logo(self, logo: str) -> bool:
         """Validate logo max line width"""
         lines = logo.split('\n')
-        max_line_width = max(len(line) for line in lines) if lines else 0
+        max_line_width = max(display_width(line) for line in lines) if lines else 0
         if max_line_width > self.width + 10:  # Allow some overflow
             print(f"Warning: Logo line width {max_line_width} exceeds configured width {self.width}")
             return False
         return True
     
-    def add_product(self, name: str, quantity: int, price: float) -> bool:
-        """Add product"""
+    def add_product(self, name: str, quantity: int, price: float, vat_rate: Optional[float] = None) -> bool:
+        """Add product, optionally with its own VAT rate"""
         try:
-            if quantity <= 0 or price < 0:
+            if quantity <= 0 or price < 0 or (vat_rate is not None and vat_rate < 0):
                 return False
-            self.products.append(Product(name, quantity, price))
+            product = Product(name, quantity, price, vat_rate)
+            self._products.append(product)
+            self.totals.add(product.total_cents(), vat_rate)
+            product._totals = self.totals
             return True
         except Exception:
             return False
@@ -192,72 +396,184 @@ class Receipt:
     def remove_product(self, index: int) -> bool:
         """Remove product"""
         try:
-            if 0 <= index < len(self.products):
-                self.products.pop(index)
+            if 0 <= index < len(self._products):
+                product = self._products.pop(index)
+                self.totals.remove(product.total_cents(), product.vat_rate)
+                product._totals = None
                 return True
             return False
         except Exception:
             return False
     
+    def clear_products(self):
+        """Remove all products"""
+        for product in self._products:
+            product._totals = None
+        self._products.clear()
+        self.totals.reset()
+        self.receipt_number = None
+    
+    def assign_number(self) -> Optional[int]:
+        """Number the sale from the sequencer once, None without a sequencer"""
+        if self.receipt_number is None and self.sequencer is not None:
+            self.receipt_number = self.sequencer.allocate(self.sequence_key)
+        return self.receipt_number
+    
+    def release_number(self, issued: bool = True):
+        """
+        End the numbered sale so the next save takes a new number
+        
+        A number whose receipt was never issued (the save failed) goes
+        back to the sequencer instead of leaving a gap.
+        """
+        if self.receipt_number is not None and not issued and self.sequencer is not None:
+            self.sequencer.give_back(self.sequence_key, self.receipt_number)
+        self.receipt_number = None
+    
+    @property
+    def products(self) -> Tuple[Product, ...]:
+        """Products on the receipt, in order"""
+        return tuple(self._products)
+    
+    def get_subtotal_cents(self) -> int:
+        return self.totals.subtotal_cents
+    
+    def get_vat_cents(self) -> int:
+        return self.totals.vat_cents(self.vat_rate)
+    
+    def get_total_cents(self) -> int:
+        return self.totals.subtotal_cents + self.totals.vat_cents(self.vat_rate)
+    
+    def get_vat_breakdown(self) -> List[Tuple[float, int, int]]:
+        """(VAT rate, net cents, VAT cents) per rate, highest rate first"""
+        return self.totals.breakdown(self.vat_rate)
+    
     def get_subtotal(self) -> float:
-        return sum(p.total() for p in self.products)
+        return self.get_subtotal_cents() / 100
     
     def get_vat(self) -> float:
-        return self.get_subtotal() * self.vat_rate
+        return self.get_vat_cents() / 100
     
     def get_total(self) -> float:
-        return self.get_subtotal() + self.get_vat()
+        return self.get_total_cents() / 100
+    
+    def generate_text(self, timestamp: Optional[datetime] = None) -> str:
+        """Generate text receipt (uses override if set), dated timestamp or now"""
+        timer = self.timer
+        if timer is not None:
+            start = time.perf_counter()
+        if self.render_cache is None:
+            text = "\n".join(self.iter_text_chunks(timestamp))
+        else:
+            text = self.build_document(timestamp).text()
+        if timer is not None:
+            timer.record("receipt", time.perf_counter() - start)
+        return text
+    
+    def iter_text_chunks(self, timestamp: Optional[datetime] = None) -> Iterator[str]:
+        """
+        Generate text receipt section by section
+        
+        Joining the chunks with newlines gives exactly generate_text(),
+        so a printer can consume the receipt while it is being rendered.
+        """
+        for block in self.iter_blocks(timestamp):
+            yield block.text
+    
+    def build_document(self, timestamp: Optional[datetime] = None) -> ReceiptDocument:
+        """
+        Render receipt once into typed blocks shared by all exporters
+        
+        With a render_cache, preview refreshes and re-exports of an
+        unchanged receipt within the same printed minute are cache hits.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        if self.render_cache is None:
+            return ReceiptDocument(self.iter_blocks(timestamp))
+        
+        # The whole "extends" chain, so editing a parent template misses too
+        key = render_cache_key(
+            self.current_template,
+            _template_chain(self.config.get("templates", {}), self.current_template),
+            self.config.get("logo_ascii"),
+            self.company_info,
+            self.width,
+            self.vat_rate,
+            [p.to_dict() for p in self._products],
+            self._manual_override_text,
+            timestamp.strftime('%d.%m.%Y %H:%M'),
+            self.receipt_number
+        )
+        document = self.render_cache.get(key)
+        if document is None:
+            document = ReceiptDocument(self.iter_blocks(timestamp))
+            self.render_cache.put(key, document, document.nbytes())
+        return document
     
-    def generate_text(self) -> str:
-        """Generate text receipt (uses override if set)"""
+    def iter_blocks(self, timestamp: Optional[datetime] = None) -> Iterator[ReceiptBlock]:
+        """Generate receipt as typed blocks (uses override if set)"""
+        blocks = self._render_blocks(timestamp)
+        return blocks if self.timer is None else self.timer.timed_blocks(blocks)
+    
+    def _render_blocks(self, timestamp: Optional[datetime]) -> Iterator[ReceiptBlock]:
+        if timestamp is None:
+            timestamp = self.clock()
         if self._manual_override_text:
-            return self._cleanup_text(self._manual_override_text)
+            yield ReceiptBlock(BlockType.TEXT, self._cleanup_text(self._manual_override_text))
+            return
         
-        lines = []
+        template = self.get_template()
         
         # Logo
-        logo = self.get_logo()
+        logo = template.logo if template.found else self.get_logo()
         if logo:
-            lines.append(logo)
+            yield ReceiptBlock(BlockType.LOGO, logo)
         
         # Header
-        template = self.config.get("templates", {}).get(self.current_template, {})
-        header_format = template.get("header_format", "")
-        if header_format:
-            lines.append("")
-            lines.append(header_format.format(**self.company_info))
-        else:
-            lines.append(f"\n{self.company_info['name']}")
-            lines.append(f"Y-tunnus: {self.company_info['business_id']}")
-            lines.append(f"{self.company_info['address']}")
-            lines.append(f"Puh: {self.company_info['phone']}")
-        
-        # Date
-        lines.append(f"\nPäivämäärä: {datetime.now().strftime('%d.%m.%Y %H:%M')}")
-        lines.append("\n" + "=" * self.width)
-        
-        # Products
-        lines.append("\nTUOTTEET / PRODUCTS:")
-        lines.append("-" * self.width)
-        
-        for i, product in enumerate(self.products, 1):
-            lines.append(f"{i}. {product.name}")
-            lines.append(f"   {product.quantity} kpl x {product.price:.2f} € = {product.total():.2f} €")
-        
-        # Totals
-        lines.append("-" * self.width)
-        lines.append(f"Välisumma (ilman ALV): {self.get_subtotal():.2f} €")
-        lines.append(f"ALV {int(self.vat_rate * 100)}%: {self.get_vat():.2f} €")
-        lines.append("=" * self.width)
-        lines.append(f"YHTEENSÄ: {self.get_total():.2f} €")
-        lines.append("=" * self.width)
+        yield ReceiptBlock(BlockType.HEADER, template.header)
+        
+        # Date and receipt number
+        number = f"\nKuitti nro: {self.receipt_number}" if self.receipt_number is not None else ""
+        yield ReceiptBlock(BlockType.DATE, "\n".join([
+            f"\nPäivämäärä: {timestamp.strftime('%d.%m.%Y %H:%M')}{number}",
+            "\n" + "=" * self.width,
+            "\nTUOTTEET / PRODUCTS:",
+            "-" * self.width
+        ]))
+        
+        # Products: names wrapped, line totals in a right-aligned column
+        layout = TextLayout(self.width)
+        wrap = layout.wrap
+        row = layout.row
+        for i, product in enumerate(self._products, 1):
+            yield ReceiptBlock(
+                BlockType.ITEM,
+                wrap(f"{i}. {product.name}", "   ") + "\n" +
+                row(
+                    f"   {product.quantity} kpl x {format_cents(product.price_cents)} €",
+                    f"{format_cents(product.total_cents())} €",
+                    "   "
+                )
+            )
         
-        # Footer
-        footer = template.get("footer", "Kiitos ostoksesta! / Thank you for your purchase!")
-        lines.append(f"\n{footer}")
-        lines.append("")
+        # Totals, one VAT line per rate
+        subtotal = self.get_subtotal_cents()
+        breakdown = self.totals.breakdown(self.vat_rate)
+        lines = ["-" * self.width, row("Välisumma (ilman ALV):", f"{format_cents(subtotal)} €")]
+        if not breakdown:
+            breakdown = [(self.vat_rate, 0, 0)]
+        for rate, _, vat in breakdown:
+            lines.append(row(f"ALV {format_rate(rate)}%:", f"{format_cents(vat)} €"))
+        vat = sum(vat for _, _, vat in breakdown)
+        lines.extend(["=" * self.width, row("YHTEENSÄ:", f"{format_cents(subtotal + vat)} €"), "=" * self.width])
+        yield ReceiptBlock(BlockType.TOTALS, "\n".join(lines))
+        
+        if template.vat_breakdown:
+            yield ReceiptBlock(BlockType.VAT, "\n" + format_vat_breakdown(breakdown, layout))
         
-        return "\n".join(lines)
+        # Footer
+        yield ReceiptBlock(BlockType.FOOTER, template.footer)
     
     def set_manual_override(self, text: Optional[str]):
         """Set manual override text"""
@@ -266,14 +582,24 @@ class Receipt:
         else:
             self._manual_override_text = None
     
-    def save_to_history(self):
-        """Save current receipt to history"""
+    def save_to_history(self, document: Optional[ReceiptDocument] = None, timestamp: Optional[datetime] = None):
+        """
+        Save current receipt to history
+        
+        Pass the exported document and the timestamp it was built with,
+        so history records the receipt that was issued without rendering
+        it again.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        text = document.text() if document is not None else self.generate_text(timestamp)
         history_item = {
-            "timestamp": datetime.now().isoformat(),
-            "products": [p.to_dict() for p in self.products],
+            "timestamp": timestamp.isoformat(),
+            "receipt_number": self.receipt_number,
+            "products": [p.to_dict() for p in self._products],
             "template": self.current_template,
             "total": self.get_total(),
-            "text_preview": self.generate_text()[:200]  # First 200 chars
+            "text_preview": text[:200]  # First 200 chars
         }
         
         if "history" not in self.config:
@@ -282,12 +608,13 @@ class Receipt:
         self.config["history"].insert(0, history_item)
         # Keep only last 50 receipts
         self.config["history"] = self.config["history"][:50]
-        self._save_config(self.config)
+        with self._timing("save_config"):
+            self._save_config(self.config)
     
     def to_dict(self) -> Dict:
         """Export receipt to dictionary"""
         return {
-            "products": [p.to_dict() for p in self.products],
+            "products": [p.to_dict() for p in self._products],
             "template": self.current_template,
             "company_info": self.company_info,
             "totals": {
@@ -299,13 +626,25 @@ class Receipt:
 
 
 class ReceiptExporter:
-    """Export receipts to various formats"""
+    """
+    Export receipts to various formats
+    
+    Exporters accept a Receipt or a ReceiptDocument. Build the document
+    once with Receipt.build_document() when exporting the same sale to
+    several formats.
+    """
+    
+    @staticmethod
+    def _document(receipt: Union[Receipt, ReceiptDocument]) -> ReceiptDocument:
+        if isinstance(receipt, ReceiptDocument):
+            return receipt
+        return receipt.build_document()
     
     @staticmethod
-    def export_txt(receipt: Receipt, filepath: str) -> bool:
+    def export_txt(receipt: Union[Receipt, ReceiptDocument], filepath: str) -> bool:
         """Export receipt as TXT"""
         try:
-            text = receipt.generate_text()
+            text = TextBackend.render(ReceiptExporter._document(receipt))
             with open(filepath, 'w', encoding='utf-8') as f:
                 f.write(text)
             return True
@@ -314,7 +653,7 @@ class ReceiptExporter:
             return False
     
     @staticmethod
-    def export_pdf(receipt: Receipt, filepath: str) -> bool:
+    def export_pdf(receipt: Union[Receipt, ReceiptDocument], filepath: str) -> bool:
         """Export receipt as PDF"""
         if not REPORTLAB_AVAILABLE:
             print("Error: reportlab library is required for PDF export")
@@ -322,8 +661,7 @@ class ReceiptExporter:
             return False
         
         try:
-            text = receipt.generate_text()
-            lines = text.split('\n')
+            document = ReceiptExporter._document(receipt)
             
             # Create PDF
             c = canvas.Canvas(filepath, pagesize=A4)
@@ -338,16 +676,19 @@ class ReceiptExporter:
             x = 30
             y = height - 50
             
-            c.setFont(font_name, font_size)
-            
-            for line in lines:
-                if y < 50:  # Start new page if needed
-                    c.showPage()
-                    c.setFont(font_name, font_size)
-                    y = height - 50
+            for block in document.blocks:
+                # Totals in bold, everything else in regular monospace
+                block_font = "Courier-Bold" if block.kind == BlockType.TOTALS else font_name
+                c.setFont(block_font, font_size)
                 
-                c.drawString(x, y, line)
-                y -= line_height
+                for line in block.lines():
+                    if y < 50:  # Start new page if needed
+                        c.showPage()
+                        c.setFont(block_font, font_size)
+                        y = height - 50
+                    
+                    c.drawString(x, y, line)
+                    y -= line_height
             
             c.save()
             return True
@@ -425,7 +766,7 @@ class ReceiptEditor:
 class ReceiptToolGUI:
     """Beautiful GUI for receipt tool"""
     
-    def __init__(self, root):
+    def __init__(self, root, sequencer: Optional[ReceiptSequencer] = None):
         self.root = root
         self.root.title("Receipt Tool - HRK")
         self.root.geometry("1000x700")
@@ -439,7 +780,8 @@ class ReceiptToolGUI:
         self.accent_purple = "#9b59b6"
         self.accent_red = "#e74c3c"
         
-        self.receipt = Receipt()
+        # Preview refreshes re-render unchanged receipts, serve them from cache
+        self.receipt = Receipt(render_cache=ReceiptRenderCache(max_bytes=1024 * 1024), sequencer=sequencer)
         
         self.create_ui()
         self.update_preview()
@@ -710,11 +1052,17 @@ class ReceiptToolGUI:
         )
         
         if filepath:
-            if ReceiptExporter.export_txt(self.receipt, filepath):
-                self.receipt.save_to_history()
+            self.receipt.assign_number()
+            timestamp = self.receipt.clock()
+            document = self.receipt.build_document(timestamp)
+            if ReceiptExporter.export_txt(document, filepath):
+                self.receipt.save_to_history(document, timestamp)
+                self.receipt.release_number()
                 messagebox.showinfo("Success", f"Receipt saved to:\n{filepath}")
             else:
+                self.receipt.release_number(issued=False)
                 messagebox.showerror("Error", "Failed to save receipt")
+            self.update_preview()
     
     def export_pdf(self):
         """Export receipt as PDF"""
@@ -733,11 +1081,17 @@ class ReceiptToolGUI:
         )
         
         if filepath:
-            if ReceiptExporter.export_pdf(self.receipt, filepath):
-                self.receipt.save_to_history()
+            self.receipt.assign_number()
+            timestamp = self.receipt.clock()
+            document = self.receipt.build_document(timestamp)
+            if ReceiptExporter.export_pdf(document, filepath):
+                self.receipt.save_to_history(document, timestamp)
+                self.receipt.release_number()
                 messagebox.showinfo("Success", f"Receipt exported to:\n{filepath}")
             else:
+                self.receipt.release_number(issued=False)
                 messagebox.showerror("Error", "Failed to export PDF")
+            self.update_preview()
     
     def show_history(self):
         """Show receipt history"""
@@ -791,8 +1145,8 @@ class ReceiptToolGUI:
 class ReceiptToolCLI:
     """Command-line interface for receipt tool"""
     
-    def __init__(self):
-        self.receipt = Receipt()
+    def __init__(self, sequencer: Optional[ReceiptSequencer] = None):
+        self.receipt = Receipt(sequencer=sequencer)
     
     def preview(self):
         """Show preview in console"""
@@ -820,10 +1174,15 @@ class ReceiptToolCLI:
     
     def save_txt(self, path: str):
         """Save as TXT"""
-        if ReceiptExporter.export_txt(self.receipt, path):
-            self.receipt.save_to_history()
+        self.receipt.assign_number()
+        timestamp = self.receipt.clock()
+        document = self.receipt.build_document(timestamp)
+        if ReceiptExporter.export_txt(document, path):
+            self.receipt.save_to_history(document, timestamp)
+            self.receipt.release_number()
             print(f"✓ Receipt saved to: {path}")
         else:
+            self.receipt.release_number(issued=False)
             print(f"✗ Failed to save receipt")
     
     def export_pdf(self, path: str):
@@ -833,10 +1192,15 @@ class ReceiptToolCLI:
             print("  Install with: pip install reportlab")
             return
         
-        if ReceiptExporter.export_pdf(self.receipt, path):
-            self.receipt.save_to_history()
+        self.receipt.assign_number()
+        timestamp = self.receipt.clock()
+        document = self.receipt.build_document(timestamp)
+        if ReceiptExporter.export_pdf(document, path):
+            self.receipt.save_to_history(document, timestamp)
+            self.receipt.release_number()
             print(f"✓ Receipt exported to: {path}")
         else:
+            self.receipt.release_number(issued=False)
             print(f"✗ Failed to export PDF")
     
     @staticmethod
@@ -916,6 +1280,7 @@ OPTIONS:
   --preview          Show receipt preview in console
   --save-txt PATH    Save receipt as TXT file
   --export-pdf PATH  Export receipt as PDF file
+  --numbers DIR      Number saved receipts from sequence files in DIR
   --smoke-test       Run smoke test with demo receipt
   --help             Show this help message
 
@@ -932,6 +1297,9 @@ EXAMPLES:
   # Export to PDF
   python receipt_tool.py --export-pdf receipt.pdf
   
+  # Save a numbered receipt (Kuitti nro), shared with other lanes
+  python receipt_tool.py --numbers ./receipt_numbers --save-txt receipt.txt
+  
   # Run smoke test
   python receipt_tool.py --smoke-test
 
@@ -970,9 +1338,26 @@ def main():
     if "--smoke-test" in args:
         return ReceiptToolCLI.smoke_test()
     
+    sequencer = None
+    if "--numbers" in args:
+        idx = args.index("--numbers")
+        if idx + 1 >= len(args):
+            print("Error: --numbers requires a directory")
+            return 1
+        sequencer = ReceiptSequencer(args[idx + 1])
+    try:
+        return _run_tool(args, sequencer)
+    finally:
+        # Unused numbers of this session go back for the next one
+        if sequencer is not None:
+            sequencer.close()
+
+
+def _run_tool(args: List[str], sequencer: Optional[ReceiptSequencer] = None) -> int:
+    """Run the CLI or GUI for command line args"""
     # CLI mode with flags
     if any(flag in args for flag in ["--edit", "--edit-logo", "--preview", "--save-txt", "--export-pdf"]):
-        cli = ReceiptToolCLI()
+        cli = ReceiptToolCLI(sequencer)
         
         if "--edit-logo" in args:
             cli.edit_logo()
@@ -1004,7 +1389,7 @@ def main():
     # GUI mode (default)
     if GUI_AVAILABLE and "--terminal" not in args:
         root = tk.Tk()
-        app = ReceiptToolGUI(root)
+        app = ReceiptToolGUI(root, sequencer)
         root.mainloop()
         return 0
     else:
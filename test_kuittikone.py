@@ -1,17 +1,36 @@
 #!/usr/bin/env python3
 """Test suite for kuittikone.py"""
 
+import asyncio
+import io
+import json
 import os
+import re
+import shutil
 import sys
 import tempfile
+import threading
+import time
 import unittest
-from datetime import datetime, timedelta
+import unittest.mock
+from collections import Counter
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import List, Optional
 
 # Add the current directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
 import kuittikone
+from receipt_core import display_width, snapshot_path
+
+
+def remove_config(path: str):
+    """Remove a test config file and its warm-start snapshot"""
+    for name in (path, snapshot_path(path)):
+        if os.path.exists(name):
+            os.unlink(name)
 
 
 class TestPaymentCardPreset(unittest.TestCase):
@@ -129,6 +148,102 @@ class TestWarrantyInfo(unittest.TestCase):
         self.assertIn("Test note", text)
 
 
+class TestWarrantyTable(unittest.TestCase):
+    """Test lazily hydrated warranty database"""
+    
+    def setUp(self):
+        self.temp_file = tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False)
+        self.temp_file.close()
+        self.records = {
+            f"SN-{n}": {
+                "serial_number": f"SN-{n}",
+                "purchase_date": "2024-01-15T10:30:00",
+                "warranty_months": 24,
+                "product_name": f"Tuote {n}",
+                "return_days": 14,
+                "notes": ""
+            }
+            for n in range(1000)
+        }
+        self.manager = kuittikone.KuittikoneManager(
+            self.temp_file.name, config={"presets": {}, "warranty_database": self.records, "settings": {}}
+        )
+    
+    def tearDown(self):
+        remove_config(self.temp_file.name)
+    
+    def test_lazy_hydration(self):
+        """Test warranties are materialised only when touched"""
+        table = self.manager.warranty_db
+        self.assertEqual(len(table), 1000)
+        self.assertEqual(table.hydrated_count(), 0)
+        self.assertIn("SN-5", table)
+        self.assertNotIn("SN-X", table)
+        self.assertEqual(table.hydrated_count(), 0)
+        
+        warranty = self.manager.get_warranty("SN-5")
+        self.assertEqual(warranty.product_name, "Tuote 5")
+        self.assertIs(self.manager.get_warranty("SN-5"), warranty)
+        self.assertIsNone(self.manager.get_warranty("SN-X"))
+        self.assertEqual(table.hydrated_count(), 1)
+        
+        # Reports over the whole table hydrate everything
+        self.assertEqual(sum(1 for w in table.values() if w.warranty_months == 24), 1000)
+        self.assertEqual(table.hydrated_count(), 1000)
+    
+    def test_save_encodes_only_changed_entries(self):
+        """Test saving re-encodes changed warranties and keeps the rest"""
+        untouched = self.records["SN-1"]
+        self.manager.get_warranty("SN-1")
+        self.manager.warranty_db["SN-2"] = kuittikone.WarrantyInfo("SN-2", "2024-02-01", 12, "Uusi")
+        self.assertEqual(self.manager.warranty_db.dirty_count(), 1)
+        self.manager.add_warranty(kuittikone.WarrantyInfo("NEW-1", "2024-03-01", 36, "Nosturi"))
+        
+        table = self.manager.warranty_db
+        self.assertEqual(table.dirty_count(), 0)
+        self.assertEqual(len(table), 1001)
+        self.assertIs(self.manager.config["warranty_database"]["SN-1"], untouched)
+        self.assertEqual(self.manager.config["warranty_database"]["SN-2"]["product_name"], "Uusi")
+        
+        reloaded = kuittikone.KuittikoneManager(self.temp_file.name)
+        self.assertEqual(len(reloaded.warranty_db), 1001)
+        self.assertEqual(reloaded.get_warranty("NEW-1").warranty_months, 36)
+        self.assertEqual(reloaded.get_warranty("SN-2").product_name, "Uusi")
+        
+        del table["SN-2"]
+        self.assertNotIn("SN-2", self.manager.config["warranty_database"])
+        with self.assertRaises(KeyError):
+            del table["SN-2"]
+    
+    def test_packed_rows_from_snapshot(self):
+        """Test a warm start serves warranties from packed snapshot rows"""
+        self.records["ODD-1"] = {"serial_number": "ODD-1", "purchase_date": "2024-05-01",
+                                 "warranty_months": 6, "product_name": "Vanha"}
+        self.manager._save_config()
+        
+        warm = kuittikone.KuittikoneManager(self.temp_file.name)
+        table = warm.warranty_db
+        self.assertTrue(table.needs_flush())
+        self.assertEqual(warm.config["warranty_database"], {})
+        self.assertEqual(len(table), 1001)
+        self.assertIn("SN-7", table)
+        self.assertEqual(warm.get_warranty("SN-7").product_name, "Tuote 7")
+        self.assertEqual(warm.get_warranty("ODD-1").return_days, 14)
+        self.assertEqual(table.hydrated_count(), 2)
+        
+        del table["SN-8"]
+        warm.add_warranty(kuittikone.WarrantyInfo("NEW-1", "2024-03-01", 36, "Nosturi"))
+        self.assertFalse(table.needs_flush())
+        self.assertEqual(len(warm.config["warranty_database"]), 1001)
+        self.assertNotIn("SN-8", warm.config["warranty_database"])
+        
+        cold = kuittikone.KuittikoneManager(self.temp_file.name, warm_start=False)
+        self.assertEqual(cold.config, warm.config)
+        again = kuittikone.KuittikoneManager(self.temp_file.name)
+        self.assertEqual(sorted(again.warranty_db), sorted(cold.warranty_db))
+        self.assertEqual(again.get_warranty("NEW-1").warranty_months, 36)
+
+
 class TestPromoRule(unittest.TestCase):
     """Test PromoRule class"""
     
@@ -162,6 +277,462 @@ class TestPromoRule(unittest.TestCase):
         self.assertEqual(rule.condition_value, restored.condition_value)
 
 
+class TestPromoIndex(unittest.TestCase):
+    """Test compiled promo rule evaluation"""
+    
+    @staticmethod
+    def _linear(rules, amount, card_type, names=()):
+        lines = []
+        for rule in rules:
+            if not rule.enabled:
+                continue
+            if rule.condition_type == "amount_over":
+                applies = amount > float(rule.condition_value)
+            elif rule.condition_type == "product_contains":
+                keywords = [rule.condition_value] if isinstance(rule.condition_value, str) else rule.condition_value
+                applies = any(k.lower() in name.lower() for k in keywords for name in names)
+            else:
+                applies = bool(card_type) and card_type.value == rule.condition_value
+            if applies and rule.action_type == "add_line":
+                lines.append(rule.action_value)
+            elif applies and rule.action_type == "add_bonus_code":
+                lines.append(f"Bonuskoodi: {rule.action_value}")
+        return lines
+    
+    def test_matches_linear_evaluation_in_rule_order(self):
+        """Test index gives the same lines in the same order as walking the rules"""
+        import random
+        rng = random.Random(3)
+        cards = list(kuittikone.CardType)
+        words = ["pora", "nosturi", "raskas", "kevyt", "öljy", "ra"]
+        rules = []
+        for n in range(300):
+            kind = rng.random()
+            if kind < 0.3:
+                condition = ("card_type", rng.choice(cards).value)
+            elif kind < 0.5:
+                condition = ("product_contains", rng.choice([rng.choice(words), rng.sample(words, 2)]))
+            else:
+                condition = ("amount_over", rng.choice([rng.randint(0, 500), str(rng.randint(0, 500))]))
+            rules.append(kuittikone.PromoRule(
+                f"r{n}", "", condition[0], condition[1],
+                rng.choice(["add_line", "add_bonus_code", "noop"]), f"L{n}", enabled=rng.random() < 0.8
+            ))
+        index = kuittikone.PromoIndex(rules)
+        carts = [[], ["Iskuporakone"], ["Kevyt NOSTURI", "Öljynsuodatin"], ["Raskas kuormaaja", "Teippi"]]
+        for amount in (0.0, 0.5, 100.0, 250.25, 499.99, 500.0, 1000.0):
+            for card_type in cards + [None]:
+                for names in carts:
+                    self.assertEqual(
+                        index.evaluate(amount, card_type, names), self._linear(rules, amount, card_type, names)
+                    )
+    
+    def test_product_contains_keywords(self):
+        """Test product rules match any keyword in any product name, once per rule"""
+        rules = [
+            kuittikone.PromoRule("a", "", "product_contains", ["pora", "vasara"], "add_line", "Terät -20%"),
+            kuittikone.PromoRule("b", "", "product_contains", "Nosturi", "add_bonus_code", "NOSTO"),
+            kuittikone.PromoRule("c", "", "product_contains", ["", " "], "add_line", "never"),
+        ]
+        index = kuittikone.PromoIndex(rules)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.evaluate(0.0, None, ["Iskupora", "Vasara", "nosturin vaijeri"]),
+                         ["Terät -20%", "Bonuskoodi: NOSTO"])
+        self.assertEqual(index.evaluate(0.0, None, ["Nostu", "ripora"]), ["Terät -20%"])
+        self.assertEqual(index.evaluate(0.0, None), [])
+    
+    def test_discount_values(self):
+        """Test percentage and fixed discounts, invalid values are dropped"""
+        def rule(value):
+            return kuittikone.PromoRule("d", "Alennus", "amount_over", 0, "add_discount", value)
+        self.assertEqual(kuittikone.Discount.parse(rule("10%")).amount(1005), 101)
+        self.assertEqual(kuittikone.Discount.parse(rule("12,5 %")).basis_points, 1250)
+        self.assertEqual(kuittikone.Discount.parse(rule("5.00 €")).amount(10000), 500)
+        self.assertEqual(kuittikone.Discount.parse(rule("5")).amount(300), 300)
+        for value in ("", "abc", "0%", "150%", "-5", "0"):
+            self.assertIsNone(kuittikone.Discount.parse(rule(value)))
+        index = kuittikone.PromoIndex([rule("abc"), rule("10%")])
+        self.assertEqual((len(index), index.discount_count), (0, 1))
+    
+    def test_discount_priority_and_exclusivity(self):
+        """Test discounts stack in priority order and exclusive ones stand alone"""
+        rules = [
+            kuittikone.PromoRule("a", "Kanta-asiakas", "amount_over", 0, "add_discount", "10%"),
+            kuittikone.PromoRule("b", "Kampanja", "amount_over", 0, "add_discount", "5.00", priority=5),
+            kuittikone.PromoRule("c", "Visa", "card_type", "visa", "add_discount", "50%", exclusive=True),
+            kuittikone.PromoRule("d", "", "amount_over", 0, "add_line", "Kiitos!"),
+        ]
+        index = kuittikone.PromoIndex(rules)
+        result = index.apply_discounts(100.0, None, (), [6000, 4000])
+        # Fixed 5.00 first, then 10% of the 95.00 left
+        self.assertEqual(result.applied, [("Kampanja", 500), ("Kanta-asiakas", 950)])
+        self.assertEqual(result.line_discounts, [870, 580])
+        self.assertEqual(result.total_cents, 1450)
+        self.assertEqual(index.lines(result.matches), ["Kiitos!"])
+        # Exclusive rule comes after higher priority discounts, so it is skipped
+        result = index.apply_discounts(100.0, kuittikone.CardType.VISA, (), [10000])
+        self.assertEqual([label for label, _ in result.applied], ["Kampanja", "Kanta-asiakas"])
+        
+        rules[2].priority = 9
+        result = kuittikone.PromoIndex(rules).apply_discounts(100.0, kuittikone.CardType.VISA, (), [10000])
+        self.assertEqual(result.applied, [("Visa", 5000)])
+    
+    def test_product_discount_allocation(self):
+        """Test product discounts cover only matching lines, returns get nothing"""
+        rules = [
+            kuittikone.PromoRule("p", "Porat -20%", "product_contains", "pora", "add_discount", "20%"),
+            kuittikone.PromoRule("f", "Lahjakortti", "amount_over", 0, "add_discount", "10"),
+        ]
+        index = kuittikone.PromoIndex(rules)
+        names = ["Iskupora", "Vasara", "Porakone", "Palautus: pora"]
+        result = index.apply_discounts(400.0, None, names, [10000, 5000, 5000, -2000])
+        self.assertEqual(result.applied, [("Porat -20%", 3000), ("Lahjakortti", 1000)])
+        # The fixed discount is split over what is left: 80.00, 50.00 and 40.00
+        self.assertEqual(result.line_discounts[1], 294)
+        self.assertEqual(result.line_discounts[3], 0)
+        self.assertEqual(sum(result.line_discounts), 4000)
+        self.assertGreater(result.line_discounts[0], result.line_discounts[2])
+    
+    def test_drops_disabled_and_unknown_rules(self):
+        """Test disabled rules and unknown card types are dropped at compile time"""
+        rules = [
+            kuittikone.PromoRule("a", "", "amount_over", 10, "add_line", "off", enabled=False),
+            kuittikone.PromoRule("b", "", "card_type", "dinosaur", "add_line", "never"),
+            kuittikone.PromoRule("c", "", "amount_over", 10, "add_bonus_code", "B10"),
+        ]
+        index = kuittikone.PromoIndex(rules)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.evaluate(10.0, None), [])
+        self.assertEqual(index.evaluate(10.01, kuittikone.CardType.VISA), ["Bonuskoodi: B10"])
+    
+    def test_skips_invalid_amounts(self):
+        """Test amount_over rules without a numeric amount are skipped and listed"""
+        rules = [
+            kuittikone.PromoRule("words", "", "amount_over", "sata euroa", "add_line", "never"),
+            kuittikone.PromoRule("none", "", "amount_over", None, "add_line", "never"),
+            kuittikone.PromoRule("list", "", "amount_over", [10], "add_discount", "10%"),
+            kuittikone.PromoRule("nan", "", "amount_over", "nan", "add_line", "never"),
+            kuittikone.PromoRule("ok", "", "amount_over", "10.5", "add_line", "Kiitos"),
+            kuittikone.PromoRule("action", "", "amount_over", 10, "add_discount", "abc"),
+            kuittikone.PromoRule("off", "", "amount_over", "sata euroa", "add_line", "never", enabled=False),
+        ]
+        output = io.StringIO()
+        with redirect_stdout(output):
+            index = kuittikone.PromoIndex(rules)
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual((len(index), index.discount_count), (1, 0))
+        self.assertEqual(index.evaluate(11.0, None), ["Kiitos"])
+        self.assertEqual(index.skipped, [
+            ("words", "invalid condition"), ("none", "invalid condition"), ("list", "invalid condition"),
+            ("nan", "invalid condition"), ("action", "invalid action"),
+        ])
+
+
+class TestPromoSchedule(unittest.TestCase):
+    """Test time-windowed promo rules"""
+    
+    @staticmethod
+    def _active(rule, when):
+        """Straightforward validity check the schedule must agree with"""
+        if rule.valid_from is not None and when < datetime.fromisoformat(rule.valid_from):
+            return False
+        if rule.valid_until is not None:
+            end = datetime.fromisoformat(rule.valid_until)
+            if len(rule.valid_until) == 10:
+                end += timedelta(days=1)
+            if when >= end:
+                return False
+        if rule.weekdays is None and rule.time_from is None and rule.time_until is None:
+            return True
+        start = int(rule.time_from[:2]) * 60 + int(rule.time_from[3:]) if rule.time_from else 0
+        end = int(rule.time_until[:2]) * 60 + int(rule.time_until[3:]) if rule.time_until else 1440
+        minute = when.hour * 60 + when.minute
+        days = rule.weekdays if rule.weekdays is not None else range(7)
+        if end > start:
+            return when.weekday() in days and start <= minute < end
+        # Crossing midnight: evening of a listed day or early hours after it
+        return (when.weekday() in days and minute >= start) or ((when.weekday() - 1) % 7 in days and minute < end)
+    
+    def test_matches_direct_window_checks(self):
+        """Test the interval index picks exactly the rules valid at each moment"""
+        import random
+        rng = random.Random(11)
+        rules = []
+        for n in range(200):
+            rule = kuittikone.PromoRule(f"r{n}", "", "amount_over", 0, "add_line", f"L{n}")
+            if rng.random() < 0.5:
+                start = datetime(2025, 1, 1) + timedelta(days=rng.randint(0, 300))
+                rule.valid_from = start.date().isoformat() if rng.random() < 0.5 else start.isoformat()
+                if rng.random() < 0.8:
+                    end = start + timedelta(days=rng.randint(0, 40), hours=rng.randint(0, 23))
+                    rule.valid_until = end.date().isoformat() if rng.random() < 0.5 else end.isoformat()
+            if rng.random() < 0.4:
+                rule.weekdays = rng.sample(range(7), rng.randint(1, 3))
+            if rng.random() < 0.4:
+                rule.time_from = f"{rng.randint(0, 23):02d}:{rng.choice([0, 30]):02d}"
+                rule.time_until = f"{rng.randint(0, 23):02d}:{rng.choice([0, 30]):02d}"
+            rules.append(rule)
+        schedule = kuittikone.PromoSchedule(rules)
+        when = datetime(2024, 12, 25)
+        while when < datetime(2025, 12, 31):
+            expected = [rule.action_value for rule in rules if self._active(rule, when)]
+            self.assertEqual(schedule.at(when).evaluate(1.0, None), expected, when)
+            when += timedelta(minutes=rng.randint(1, 3000))
+    
+    def test_happy_hour_and_campaign_dates(self):
+        """Test midnight-crossing hours, inclusive end dates and broken windows"""
+        rules = [
+            kuittikone.PromoRule("always", "", "amount_over", 0, "add_line", "Aina"),
+            kuittikone.PromoRule("late", "", "amount_over", 0, "add_line", "Yöale",
+                                 weekdays=[4], time_from="22:00", time_until="02:00"),
+            kuittikone.PromoRule("summer", "", "amount_over", 0, "add_line", "Kesä",
+                                 valid_from="2025-06-01", valid_until="2025-08-31"),
+            kuittikone.PromoRule("broken", "", "amount_over", 0, "add_line", "Rikki", time_from="25:00"),
+        ]
+        schedule = kuittikone.PromoSchedule(rules)
+        self.assertEqual(schedule.at(datetime(2025, 6, 6, 23, 0)).evaluate(1.0, None), ["Aina", "Yöale", "Kesä"])
+        self.assertEqual(schedule.at(datetime(2025, 6, 7, 1, 59)).evaluate(1.0, None), ["Aina", "Yöale", "Kesä"])
+        self.assertEqual(schedule.at(datetime(2025, 6, 7, 2, 0)).evaluate(1.0, None), ["Aina", "Kesä"])
+        self.assertEqual(schedule.at(datetime(2025, 8, 31, 23, 59)).evaluate(1.0, None), ["Aina", "Kesä"])
+        self.assertEqual(schedule.at(datetime(2025, 9, 1)).evaluate(1.0, None), ["Aina"])
+        
+        # Lookups inside the same window reuse one compiled index
+        self.assertIs(schedule.at(datetime(2025, 9, 2, 10)), schedule.at(datetime(2025, 9, 2, 11)))
+        static = kuittikone.PromoSchedule(rules[:1])
+        self.assertIs(static.at(datetime(2025, 1, 1)), static.static)
+        
+        # A broken window never applies, even with no valid window to index
+        broken = kuittikone.PromoRule("broken", "", "amount_over", 0, "add_line", "Rikki", time_from="25:99")
+        schedule = kuittikone.PromoSchedule([broken])
+        self.assertEqual(schedule.at(datetime(2025, 6, 6, 23, 0)).evaluate(1.0, None), [])
+        schedule = kuittikone.PromoSchedule([rules[0], broken])
+        self.assertIs(schedule.at(datetime(2025, 6, 6, 23, 0)), schedule.static)
+        self.assertEqual(schedule.static.evaluate(1.0, None), ["Aina"])
+    
+    def test_aware_timestamps_and_bounds(self):
+        """Test aware timestamps and bounds with an offset compare in local time"""
+        rules = [
+            kuittikone.PromoRule("summer", "", "amount_over", 0, "add_line", "Kesä",
+                                 valid_from="2025-06-01", valid_until="2025-08-31"),
+            kuittikone.PromoRule("launch", "", "amount_over", 0, "add_line", "Avajaiset",
+                                 valid_from="2025-07-01T09:00:00+00:00", valid_until="2025-07-02T09:00:00Z"),
+        ]
+        schedule = kuittikone.PromoSchedule(rules)
+        self.assertEqual(schedule.at(datetime(2025, 7, 15, 12, tzinfo=timezone.utc)).evaluate(1.0, None), ["Kesä"])
+        self.assertEqual(
+            schedule.at(datetime(2025, 10, 1, 12, tzinfo=timezone(timedelta(hours=3)))).evaluate(1.0, None), []
+        )
+        
+        opening = datetime(2025, 7, 1, 9, tzinfo=timezone.utc)
+        local_opening = opening.astimezone().replace(tzinfo=None)
+        for when in (opening, local_opening):
+            self.assertEqual(schedule.at(when).evaluate(1.0, None), ["Kesä", "Avajaiset"], when)
+            self.assertEqual(schedule.at(when - timedelta(seconds=1)).evaluate(1.0, None), ["Kesä"], when)
+        self.assertEqual(schedule.at(opening + timedelta(days=1)).evaluate(1.0, None), ["Kesä"])
+    
+    def test_window_serialization(self):
+        """Test window fields round-trip and old rules load without them"""
+        rule = kuittikone.PromoRule("h", "Happy hour", "amount_over", 0, "add_discount", "15%",
+                                    weekdays=[4, 5], time_from="16:00", time_until="18:00")
+        restored = kuittikone.PromoRule.from_dict(rule.to_dict())
+        self.assertEqual(restored.weekdays, [4, 5])
+        self.assertTrue(restored.has_window())
+        old = {key: value for key, value in rule.to_dict().items()
+               if key not in ("valid_from", "valid_until", "weekdays", "time_from", "time_until")}
+        self.assertFalse(kuittikone.PromoRule.from_dict(old).has_window())
+
+
+@unittest.skipUnless(kuittikone.NUMPY_AVAILABLE, "NumPy not installed")
+class TestPromoSimulation(unittest.TestCase):
+    """Test what-if promo simulation over sales history"""
+    
+    WORDS = ["pora", "terä", "vasara", "kypärä"]
+    
+    def _random_case(self, seed: int):
+        import random
+        rng = random.Random(seed)
+        rules = []
+        for n in range(24):
+            kind = rng.choice(["amount_over", "card_type", "product_contains"])
+            value = {
+                "amount_over": rng.choice([0, 20, 100, 500]),
+                "card_type": rng.choice(["visa", "amex", "debit"]),
+                "product_contains": rng.sample(self.WORDS, rng.randint(1, 2))
+            }[kind]
+            action = rng.choice(["add_line", "add_bonus_code", "add_discount", "add_discount"])
+            value_text = rng.choice(["10%", "5.00", "33%", "2,5 %"]) if action == "add_discount" else f"Rivi {n}"
+            rule = kuittikone.PromoRule(f"r{n}", f"Ale {n}", kind, value, action, value_text,
+                                        priority=rng.randint(0, 3), exclusive=rng.random() < 0.15)
+            if rng.random() < 0.4:
+                rule.weekdays = rng.sample(range(7), 3)
+                rule.time_from, rule.time_until = "16:00", "02:00"
+            if rng.random() < 0.2:
+                rule.valid_from, rule.valid_until = "2025-03-01", "2025-03-20"
+            rules.append(rule)
+        sales = []
+        for _ in range(500):
+            products = [
+                {
+                    "name": f"{rng.choice(self.WORDS).capitalize()} {rng.randint(1, 30)}",
+                    "quantity": rng.choice([1, 1, 2, -1]),
+                    "price": round(rng.uniform(0.5, 300.0), 2)
+                }
+                for _ in range(rng.randint(1, 6))
+            ]
+            timestamp = datetime(2025, 2, 20) + timedelta(minutes=rng.randint(0, 60 * 24 * 40))
+            sales.append({
+                "timestamp": timestamp.isoformat(),
+                "products": products,
+                "card_type": rng.choice(["visa", "amex", "debit", None])
+            })
+        return rules, sales
+    
+    def test_matches_receipt_engine(self):
+        """Test hits and discounts per rule equal running every sale through the promo engine"""
+        for seed in (1, 2):
+            rules, sales = self._random_case(seed)
+            labels = {}
+            for rule in rules:
+                if rule.action_type == "add_discount":
+                    labels[rule.description] = rule.rule_id
+                elif rule.action_type == "add_bonus_code":
+                    labels[f"Bonuskoodi: {rule.action_value}"] = rule.rule_id
+                else:
+                    labels[rule.action_value] = rule.rule_id
+            expected = {rule.rule_id: [0, 0, 0] for rule in rules}
+            schedule = kuittikone.PromoSchedule(rules)
+            for sale in sales:
+                index = schedule.at(datetime.fromisoformat(sale["timestamp"]))
+                line_cents = [p["quantity"] * kuittikone.to_cents(p["price"]) for p in sale["products"]]
+                card_type = kuittikone.CardType(sale["card_type"]) if sale["card_type"] else None
+                result = index.apply_discounts(
+                    sum(line_cents) / 100, card_type, [p["name"] for p in sale["products"]], line_cents
+                )
+                for position in result.matches:
+                    action = index.actions[position]
+                    expected[labels[action.label if isinstance(action, kuittikone.Discount) else action]][0] += 1
+                for label, cents in result.applied:
+                    expected[labels[label]][1] += 1
+                    expected[labels[label]][2] += cents
+            
+            simulation = kuittikone.simulate_promos(kuittikone.SalesHistory.from_sales(sales), rules)
+            self.assertEqual(simulation["receipts"], len(sales))
+            for row in simulation["rules"]:
+                self.assertEqual(
+                    [row["hits"], row["discounted"], row["discount_cents"]], expected[row["rule_id"]], row["rule_id"]
+                )
+            self.assertGreater(simulation["discount_cents"], 0)
+    
+    def test_rule_status(self):
+        """Test rules the engine would skip are reported, not simulated"""
+        history = kuittikone.SalesHistory.from_sales([
+            {"timestamp": "2025-06-06T12:00:00", "products": [{"name": "Pora", "quantity": 1, "price": 50.0}]}
+        ])
+        rules = [
+            kuittikone.PromoRule("ok", "", "amount_over", 10, "add_line", "Kiitos"),
+            kuittikone.PromoRule("off", "", "amount_over", 10, "add_line", "Pois", enabled=False),
+            kuittikone.PromoRule("bad_value", "", "amount_over", 10, "add_discount", "paljon"),
+            kuittikone.PromoRule("bad_type", "", "weather", "sunny", "add_line", "Aurinko"),
+            kuittikone.PromoRule("bad_amount", "", "amount_over", "nan", "add_line", "Ei"),
+            kuittikone.PromoRule("bad_time", "", "amount_over", 10, "add_line", "Rikki", time_from="25:00"),
+        ]
+        result = kuittikone.simulate_promos(history, rules)
+        self.assertEqual(
+            [(row["status"], row["hits"]) for row in result["rules"]],
+            [("ok", 1), ("disabled", 0), ("invalid action", 0), ("invalid condition", 0),
+             ("invalid condition", 0), ("invalid window", 0)]
+        )
+        self.assertIn("(invalid window)", kuittikone.format_simulation(result))
+    
+    def test_load_formats(self):
+        """Test receipt_tool history, admin orders, JSON Lines and .npz load the same columns"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        history = [
+            {"timestamp": "2025-06-06T12:00:00.123456", "receipt_number": "1",
+             "products": [{"name": "Pora", "quantity": 2, "price": 19.99}, {"name": "Terä", "price": 5.0}]},
+            {"timestamp": "2025-06-07T09:30:00", "products": [{"name": "Pora", "quantity": 1, "price": 19.99}],
+             "card_type": "visa"},
+        ]
+        config_path = os.path.join(directory, "receipt_tool.json")
+        jsonl_path = os.path.join(directory, "sales.jsonl")
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump({"history": history}, f)
+        with open(jsonl_path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(sale) + "\n" for sale in history))
+        orders_path = os.path.join(directory, "orders.json")
+        with open(orders_path, "w", encoding="utf-8") as f:
+            json.dump([
+                {"id": "o1", "items": [{"product_id": "p1", "quantity": 2, "unit_price": 19.99},
+                                       {"product_id": "p2", "quantity": 1, "unit_price": 5.0}],
+                 "created_at": "2025-06-06T12:00:00"},
+                {"id": "o2", "items": [{"product_id": "p1", "quantity": 1, "unit_price": 19.99}],
+                 "created_at": "2025-06-07T09:30:00", "card_type": "visa"},
+            ], f)
+        
+        loaded = [
+            kuittikone.SalesHistory.load(config_path),
+            kuittikone.SalesHistory.load(jsonl_path),
+            kuittikone.SalesHistory.load(orders_path, {"p1": "Pora", "p2": "Terä"}),
+        ]
+        npz_path = os.path.join(directory, "sales.npz")
+        loaded[0].save(npz_path)
+        loaded.append(kuittikone.SalesHistory.load(npz_path))
+        for history_columns in loaded:
+            self.assertEqual(history_columns.amount_cents.tolist(), [4498, 1999])
+            self.assertEqual(history_columns.card_codes.tolist(), [-1, list(kuittikone.CardType).index(
+                kuittikone.CardType.VISA)])
+            self.assertEqual(history_columns.line_receipt.tolist(), [0, 0, 1])
+            self.assertEqual(history_columns.line_cents.tolist(), [3998, 500, 1999])
+            self.assertEqual([history_columns.names[i] for i in history_columns.line_names], ["Pora", "Terä", "Pora"])
+            # Friday 12:00 and Saturday 09:30
+            self.assertEqual(history_columns.week_minutes().tolist(), [4 * 1440 + 720, 5 * 1440 + 570])
+        
+        with self.assertRaises(ValueError):
+            kuittikone.SalesHistory.from_sales([{"timestamp": "eilen", "products": []}])
+    
+    def test_simulate_command(self):
+        """Test the simulate command with candidate rules on top of a preset"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config_path = os.path.join(directory, "config.json")
+        manager = kuittikone.KuittikoneManager(config_path, warm_start=False)
+        preset = kuittikone.create_default_presets()[0]
+        preset.promo_rules = [kuittikone.PromoRule("big", "Iso osto", "amount_over", 100, "add_line", "Kiitos")]
+        manager.add_company_preset(preset)
+        rules_path = os.path.join(directory, "candidates.json")
+        with open(rules_path, "w", encoding="utf-8") as f:
+            json.dump([kuittikone.PromoRule(
+                "drills", "Porat -10%", "product_contains", "pora", "add_discount", "10%"
+            ).to_dict()], f)
+        sales_path = os.path.join(directory, "sales.jsonl")
+        with open(sales_path, "w", encoding="utf-8") as f:
+            for price in (50.0, 150.0, 250.0):
+                f.write(json.dumps({
+                    "timestamp": "2025-06-06T12:00:00",
+                    "products": [{"name": "Iskuporakone", "price": price}, {"name": "Vasara", "price": 10.0}]
+                }) + "\n")
+        
+        npz_path = os.path.join(directory, "sales.npz")
+        args = [sales_path, "--preset", preset.preset_id, "--config", config_path, "--rules", rules_path]
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(kuittikone.simulate_main(args + ["--json", "--save", npz_path]), 0)
+        result = json.loads(output.getvalue())
+        self.assertEqual(result["receipts"], 3)
+        self.assertEqual(result["sales_cents"], 48000)
+        self.assertEqual([(row["rule_id"], row["hits"]) for row in result["rules"]], [("big", 2), ("drills", 3)])
+        self.assertEqual(result["rules"][1]["discount_cents"], 4500)  # Drills only, not the hammers
+        self.assertEqual(result["discount_cents"], 4500)
+        
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(kuittikone.simulate_main([npz_path] + args[1:]), 0)
+        self.assertIn("45.00", output.getvalue())
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(kuittikone.simulate_main([sales_path, "--preset", "missing", "--config", config_path]), 1)
+
+
 class TestReceiptLayout(unittest.TestCase):
     """Test ReceiptLayout class"""
     
@@ -251,6 +822,31 @@ class TestCompanyPreset(unittest.TestCase):
         self.assertEqual(preset.company_name, restored.company_name)
         self.assertEqual(preset.template_type, restored.template_type)
         self.assertEqual(preset.vat_rate, restored.vat_rate)
+    
+    def test_slotted_round_trip(self):
+        """Test model classes are slotted and round-trip through dicts"""
+        preset = kuittikone.CompanyPreset(
+            preset_id="slots",
+            company_name="Slots Oy",
+            business_id="FI1",
+            address="Addr",
+            phone="123",
+            email="slots@test.com",
+            promo_rules=[kuittikone.PromoRule("r1", "Yli 100", "amount_over", 100, "add_line", "Kiitos!")]
+        )
+        preset.layout.header_font = kuittikone.FontStyle.BLOCK
+        warranty = kuittikone.WarrantyInfo("SN-1", "2024-01-15", 24, "Pora", notes="Huom")
+        
+        for obj in (preset, preset.layout, preset.payment_presets[0], preset.promo_rules[0], warranty):
+            self.assertFalse(hasattr(obj, "__dict__"))
+            with self.assertRaises(AttributeError):
+                obj.misspelled = True
+            self.assertEqual(type(obj).from_dict(obj.to_dict()), obj)
+        
+        data = preset.to_dict()
+        self.assertEqual(data["layout"]["header_font"], "block")
+        self.assertEqual(data["promo_rules"][0]["condition_value"], 100)
+        self.assertEqual(warranty.to_dict()["notes"], "Huom")
 
 
 class TestASCIILogoEncoder(unittest.TestCase):
@@ -320,7 +916,7 @@ class TestKuittikoneManager(unittest.TestCase):
     def tearDown(self):
         """Clean up temporary files"""
         try:
-            os.unlink(self.temp_file.name)
+            remove_config(self.temp_file.name)
         except FileNotFoundError:
             # File may already have been deleted; ignore this error
             pass
@@ -330,6 +926,40 @@ class TestKuittikoneManager(unittest.TestCase):
         self.assertIsNotNone(self.manager)
         self.assertIsNotNone(self.manager.config)
     
+    def test_warm_start_snapshot(self):
+        """Test start-up uses the snapshot until the JSON file changes"""
+        self.manager.add_company_preset(kuittikone.CompanyPreset(
+            preset_id="warm",
+            company_name="Warm Oy",
+            business_id="FI1",
+            address="Addr",
+            phone="123",
+            email="warm@test.com"
+        ))
+        self.assertTrue(os.path.exists(snapshot_path(self.temp_file.name)))
+        
+        with unittest.mock.patch.object(kuittikone, "load_json_file") as load_json:
+            warm = kuittikone.KuittikoneManager(self.temp_file.name)
+        load_json.assert_not_called()
+        self.assertEqual(warm.get_company_preset("warm").company_name, "Warm Oy")
+        
+        # A hand edit of the JSON wins over the snapshot
+        with open(self.temp_file.name, "r", encoding="utf-8") as f:
+            text = f.read()
+        with open(self.temp_file.name, "w", encoding="utf-8") as f:
+            f.write(text.replace("Warm Oy", "Edited Oy"))
+        edited = kuittikone.KuittikoneManager(self.temp_file.name)
+        self.assertEqual(edited.get_company_preset("warm").company_name, "Edited Oy")
+        
+        # ...and refreshes it
+        with unittest.mock.patch.object(kuittikone, "load_json_file") as load_json:
+            warm = kuittikone.KuittikoneManager(self.temp_file.name)
+        load_json.assert_not_called()
+        self.assertEqual(warm.get_company_preset("warm").company_name, "Edited Oy")
+        
+        cold = kuittikone.KuittikoneManager(self.temp_file.name, warm_start=False)
+        self.assertEqual(cold.get_company_preset("warm").company_name, "Edited Oy")
+    
     def test_add_preset(self):
         """Test adding company preset"""
         preset = kuittikone.CompanyPreset(
@@ -497,6 +1127,23 @@ class TestKuittikoneManager(unittest.TestCase):
         self.assertIn("TAKUUTIEDOT", receipt)
         self.assertIn("TEST-W-001", receipt)
     
+    def test_promo_rules_compiled_once(self):
+        """Test promo rules are evaluated through the cached render plan index"""
+        preset = kuittikone.CompanyPreset(
+            preset_id="promo_index",
+            company_name="Index Oy",
+            business_id="FI777",
+            address="Addr",
+            phone="123",
+            email="test@test.com"
+        )
+        preset.promo_rules.append(kuittikone.PromoRule("r", "Visa", "card_type", "visa", "add_line", "Visa!"))
+        plan = self.manager._get_render_plan(preset)
+        self.assertIs(self.manager._get_render_plan(preset).promos, plan.promos)
+        self.assertEqual(
+            self.manager._evaluate_promo_rules(preset, 5.0, kuittikone.CardType.VISA), ["Visa!"]
+        )
+    
     def test_receipt_with_promo(self):
         """Test receipt with promotional rules"""
         preset = kuittikone.CompanyPreset(
@@ -530,7 +1177,578 @@ class TestKuittikoneManager(unittest.TestCase):
         
         self.assertIn("TARJOUKSET", receipt)
         self.assertIn("Get 10% off", receipt)
+
+    def test_receipt_with_discounts(self):
+        """Test discounts are printed and taken off the nets before VAT"""
+        preset = kuittikone.CompanyPreset(
+            preset_id="discount_test",
+            company_name="Discount Test",
+            business_id="FI888",
+            address="Addr",
+            phone="123",
+            email="test@test.com",
+            template_type=kuittikone.TemplateType.VAT_BREAKDOWN,
+            vat_rate=0.255
+        )
+        preset.promo_rules.append(kuittikone.PromoRule(
+            "books", "Kirjat -50%", "product_contains", "kirja", "add_discount", "50%"
+        ))
+        preset.promo_rules.append(kuittikone.PromoRule(
+            "big", "Yli 100 €", "amount_over", 100, "add_discount", "10.00"
+        ))
+        self.manager.add_company_preset(preset)
+        self.manager.switch_preset("discount_test")
+        
+        receipt = self.manager.generate_receipt(
+            [
+                {"name": "Kaivuukirja", "quantity": 1, "price": 40.0, "vat_rate": 0.14},
+                {"name": "Lapio", "quantity": 2, "price": 50.0}
+            ],
+            kuittikone.PaymentMethod.CASH
+        )
+        lines = receipt.split("\n")
+        
+        def amount(label):
+            row = next(line for line in lines if line.startswith(label))
+            return row.split()[-2]
+        
+        self.assertEqual(amount("Tuotteet yhteensä:"), "140.00")
+        self.assertEqual(amount("Kirjat -50%"), "-20.00")
+        self.assertEqual(amount("Yli 100 €"), "-10.00")
+        self.assertEqual(amount("Välisumma (ilman ALV):"), "110.00")
+        # 10.00 splits 20.00 : 100.00, so nets are 18.33 at 14% and 91.67 at 25.5%
+        self.assertEqual(amount("ALV 14%:"), "2.57")
+        self.assertEqual(amount("ALV 25.5%:"), "23.38")
+        self.assertEqual(amount("YHTEENSÄ:"), "135.95")
+        self.assertNotIn("TARJOUKSET", receipt)
+    
+    def test_receipt_with_timed_promo(self):
+        """Test windowed rules follow the receipt timestamp"""
+        preset = kuittikone.CompanyPreset(
+            preset_id="timed_test",
+            company_name="Timed Test",
+            business_id="FI888",
+            address="Addr",
+            phone="123",
+            email="test@test.com"
+        )
+        preset.promo_rules.append(kuittikone.PromoRule(
+            "happy", "Happy hour", "amount_over", 0, "add_discount", "20%",
+            weekdays=[4], time_from="16:00", time_until="18:00"
+        ))
+        preset.promo_rules.append(kuittikone.PromoRule(
+            "xmas", "Joulu", "amount_over", 0, "add_line", "Hyvää joulua!",
+            valid_from="2025-12-01", valid_until="2025-12-24"
+        ))
+        self.manager.add_company_preset(preset)
+        products = [{"name": "Lapio", "quantity": 1, "price": 50.0}]
+        
+        def receipt(when):
+            return self.manager.generate_receipt(
+                products, kuittikone.PaymentMethod.CASH, preset_id="timed_test", timestamp=when
+            )
+        
+        friday = receipt(datetime(2025, 12, 5, 17, 15))
+        self.assertIn("Happy hour", friday)
+        self.assertIn("Hyvää joulua!", friday)
+        self.assertNotIn("Happy hour", receipt(datetime(2025, 12, 5, 18, 0)))
+        later = receipt(datetime(2026, 1, 2, 16, 0))
+        self.assertIn("Happy hour", later)
+        self.assertNotIn("joulua", later)
+        self.assertEqual(
+            self.manager._evaluate_promo_rules(preset, 1.0, None, timestamp=datetime(2025, 12, 24, 23, 59)),
+            ["Hyvää joulua!"]
+        )
+    
+    def test_receipt_with_product_promo(self):
+        """Test product_contains promos and their matcher is rebuilt only on preset change"""
+        preset = kuittikone.CompanyPreset(
+            preset_id="product_promo",
+            company_name="Promo Test",
+            business_id="FI888",
+            address="Addr",
+            phone="123",
+            email="test@test.com"
+        )
+        preset.promo_rules.append(kuittikone.PromoRule(
+            "drills", "Porat", "product_contains", ["pora", "terä"], "add_line", "Teroitus kaupan päälle"
+        ))
+        self.manager.add_company_preset(preset)
+        self.manager.switch_preset("product_promo")
+        
+        receipt = self.manager.generate_receipt(
+            [{"name": "Iskuporakone", "quantity": 1, "price": 10.0}], kuittikone.PaymentMethod.CASH
+        )
+        self.assertIn("Teroitus kaupan päälle", receipt)
+        receipt = self.manager.generate_receipt(
+            [{"name": "Vasara", "quantity": 1, "price": 10.0}], kuittikone.PaymentMethod.CASH
+        )
+        self.assertNotIn("TARJOUKSET", receipt)
+        
+        current = self.manager.get_current_preset()
+        matcher = self.manager._get_render_plan(current).promos.static.matcher
+        self.manager.generate_receipt([{"name": "Terä"}], kuittikone.PaymentMethod.CASH)
+        self.assertIs(self.manager._get_render_plan(current).promos.static.matcher, matcher)
+        
+        preset.promo_rules[0].condition_value = "vasara"
+        self.manager.add_company_preset(preset)
+        current = self.manager.get_current_preset()
+        self.assertIsNot(self.manager._get_render_plan(current).promos.static.matcher, matcher)
+        receipt = self.manager.generate_receipt(
+            [{"name": "Vasara", "quantity": 1, "price": 10.0}], kuittikone.PaymentMethod.CASH
+        )
+        self.assertIn("Teroitus kaupan päälle", receipt)
+        self.assertEqual(
+            self.manager._evaluate_promo_rules(current, 0.0, None, [{"name": "Kumivasara"}]),
+            ["Teroitus kaupan päälle"]
+        )
+
+    def test_render_plan_cache(self):
+        """Test render plan is compiled once and invalidated on preset changes"""
+        preset = kuittikone.CompanyPreset(
+            preset_id="plan_test",
+            company_name="Plan Test Oy",
+            business_id="FI555",
+            address="Plan St",
+            phone="123",
+            email="plan@test.com",
+            slogan="Old slogan"
+        )
+        self.manager.add_company_preset(preset)
+        self.manager.switch_preset("plan_test")
+        products = [{"name": "Item", "quantity": 1, "price": 10.0}]
+
+        self.manager.generate_receipt(products, kuittikone.PaymentMethod.CASH)
+        plan = self.manager._render_plans["plan_test"]
+        self.manager.generate_receipt(products, kuittikone.PaymentMethod.CASH)
+        self.assertIs(self.manager._render_plans["plan_test"], plan)
+
+        # Updating the preset must drop the stale plan
+        preset.slogan = "New slogan"
+        self.manager.add_company_preset(preset)
+        self.assertNotIn("plan_test", self.manager._render_plans)
+        receipt = self.manager.generate_receipt(products, kuittikone.PaymentMethod.CASH)
+        self.assertIn("New slogan", receipt)
+        self.assertNotIn("Old slogan", receipt)
+
+        self.manager.delete_preset("plan_test")
+        self.assertNotIn("plan_test", self.manager._render_plans)
+
+    def test_receipt_templates(self):
+        """Test template types render through compiled templates"""
+        products = [{"name": "Item", "quantity": 2, "price": 10.0}]
+        receipts = {}
+        for template_type in kuittikone.TemplateType:
+            preset = kuittikone.CompanyPreset(
+                preset_id=f"tpl_{template_type.value}",
+                company_name="Template Oy",
+                business_id="FI777",
+                address="Template St",
+                phone="123",
+                email="tpl@test.com",
+                template_type=template_type,
+                promo_rules=[kuittikone.PromoRule(
+                    rule_id="p1", description="Promo", condition_type="amount_over",
+                    condition_value=5, action_type="add_line", action_value="Promo text"
+                )]
+            )
+            self.manager.add_company_preset(preset)
+            receipts[template_type] = self.manager.generate_receipt(
+                products, kuittikone.PaymentMethod.CASH, preset_id=preset.preset_id
+            )
+        
+        self.assertIn("Template Oy | Y-tunnus: FI777", receipts[kuittikone.TemplateType.MINIMAL])
+        self.assertRegex(receipts[kuittikone.TemplateType.COMPACT], r"1\. Item 2 x 10\.00 +20\.00 €")
+        self.assertIn("ALV", receipts[kuittikone.TemplateType.VAT_BREAKDOWN])
+        self.assertIn("kuluttajansuojalain", receipts[kuittikone.TemplateType.LEGAL_HEAVY])
+        
+        # Promo template prints offers before the payment section
+        promo = receipts[kuittikone.TemplateType.PROMO]
+        self.assertLess(promo.index("★ TARJOUKSET ★"), promo.index("Maksutapa"))
+        corporate = receipts[kuittikone.TemplateType.CORPORATE]
+        self.assertGreater(corporate.index("TARJOUKSET:"), corporate.index("Maksutapa"))
     
+    def test_template_inheritance(self):
+        """Test templates inherit unset fields from their parent"""
+        compact = kuittikone.RECEIPT_TEMPLATES[kuittikone.TemplateType.COMPACT.value].resolve()
+        corporate = kuittikone.RECEIPT_TEMPLATES[kuittikone.TemplateType.CORPORATE.value].resolve()
+        self.assertEqual(compact["sections"], corporate["sections"])
+        self.assertEqual(compact["logo_style"], "")
+        self.assertEqual(compact["products_heading"], "TUOTTEET:")
+        
+        loop_a = kuittikone.ReceiptTemplate(template_id="loop_a", parent="loop_b")
+        loop_b = kuittikone.ReceiptTemplate(template_id="loop_b", parent="loop_a")
+        kuittikone.RECEIPT_TEMPLATES["loop_a"] = loop_a
+        kuittikone.RECEIPT_TEMPLATES["loop_b"] = loop_b
+        try:
+            with self.assertRaises(ValueError):
+                loop_a.resolve()
+        finally:
+            del kuittikone.RECEIPT_TEMPLATES["loop_a"]
+            del kuittikone.RECEIPT_TEMPLATES["loop_b"]
+    
+    def test_reregister_template(self):
+        """Test a template re-registered under the same id renders with its new layout"""
+        preset = kuittikone.CompanyPreset(
+            preset_id="reregister_test",
+            company_name="Reregister Oy",
+            business_id="FI999",
+            address="Template St",
+            phone="123",
+            email="tpl@test.com",
+            template_type=kuittikone.TemplateType.COMPACT
+        )
+        self.manager.add_company_preset(preset)
+        self.manager.render_cache = kuittikone.ReceiptRenderCache()
+        products = [{"name": "Item", "quantity": 2, "price": 10.0}]
+        timestamp = datetime(2025, 6, 1, 12, 0)
+        
+        def render():
+            return self.manager.generate_receipt(
+                products, kuittikone.PaymentMethod.CASH, preset_id=preset.preset_id, timestamp=timestamp
+            )
+        
+        original = kuittikone.RECEIPT_TEMPLATES[kuittikone.TemplateType.COMPACT.value]
+        self.assertRegex(render(), r"1\. Item 2 x 10\.00")
+        kuittikone.register_template(kuittikone.ReceiptTemplate(
+            template_id=original.template_id,
+            parent=original.parent,
+            item_format="#{index} {name!r} ({quantity} kpl)\t{total:.2f} €"
+        ))
+        try:
+            receipt = render()
+            self.assertIn("#1 'Item' (2 kpl)", receipt)
+            self.assertNotRegex(receipt, r"1\. Item 2 x 10\.00")
+        finally:
+            kuittikone.register_template(original)
+        self.assertRegex(render(), r"1\. Item 2 x 10\.00")
+    
+    def test_item_format_cannot_run_code(self):
+        """Test item formats only fill in item fields"""
+        for item_format in ("{__import__('os').getcwd()}", "{name.upper}", "{price:{total}}", "{0}", "{}"):
+            with self.assertRaises(ValueError, msg=item_format):
+                kuittikone.register_template(kuittikone.ReceiptTemplate(template_id="evil", item_format=item_format))
+        self.assertNotIn("evil", kuittikone.RECEIPT_TEMPLATES)
+        format_item = kuittikone._compile_item_format("{index}. {{{name}}}\t{total:>8.2f}", kuittikone.TextLayout(30))
+        self.assertEqual(format_item(1, "Pora", 1, 9.5, 9.5), "1. {Pora}" + " " * 13 + "    9.50")
+    
+    def test_compiled_template_cache(self):
+        """Test compiled templates are shared between identical presets"""
+        preset = kuittikone.CompanyPreset(
+            preset_id="compiled_test",
+            company_name="Compiled Oy",
+            business_id="FI888",
+            address="Compiled St",
+            phone="123",
+            email="compiled@test.com"
+        )
+        plan = kuittikone.ReceiptRenderPlan.compile(preset, 40)
+        self.assertIs(kuittikone.ReceiptRenderPlan.compile(preset, 40), plan)
+        
+        copy = kuittikone.CompanyPreset.from_dict(preset.to_dict())
+        self.assertIs(kuittikone.ReceiptRenderPlan.compile(copy, 40), plan)
+        
+        copy.slogan = "Different slogan"
+        self.assertIsNot(kuittikone.ReceiptRenderPlan.compile(copy, 40), plan)
+    
+    def test_column_layout(self):
+        """Test product rows fit a 58 mm printer and prices line up"""
+        self.manager.config["settings"]["default_receipt_width"] = 32
+        preset = kuittikone.CompanyPreset(
+            preset_id="narrow",
+            company_name="Pitkän Nimen Konevuokraamo Oy",
+            business_id="FI999",
+            address="Teollisuustie 1",
+            phone="123",
+            email="narrow@test.com",
+            logo_base64="x",
+            payment_presets=[kuittikone.PaymentCardPreset(
+                card_type=kuittikone.CardType.VISA, enabled=True, name="Visa", fee_percentage=1.5, icon="💳"
+            )]
+        )
+        self.manager.add_company_preset(preset)
+        products = [
+            {"name": "Hydraulivasara HM-200 erikoispitkällä nimellä", "quantity": 1, "price": 1250.0},
+            {"name": "Ämpäri", "quantity": 3, "price": 2.5}
+        ]
+        receipt = self.manager.generate_receipt(
+            products, kuittikone.PaymentMethod.CARD, kuittikone.CardType.VISA, preset_id="narrow"
+        )
+        lines = receipt.split("\n")
+        self.assertTrue(all(display_width(line) <= 32 for line in lines))
+        
+        price_rows = [line for line in lines if line.endswith(" €") and " kpl x " in line]
+        self.assertEqual(len(price_rows), 2)
+        self.assertTrue(all(display_width(line) == 32 for line in price_rows))
+        self.assertIn("YHTEENSÄ:", receipt)
+    
+    def test_mixed_vat_rates(self):
+        """Test per-line VAT rates and the grouped breakdown block"""
+        preset = kuittikone.CompanyPreset(
+            preset_id="vat_test",
+            company_name="Vat Oy",
+            business_id="FI321",
+            address="Vat St",
+            phone="123",
+            email="vat@test.com",
+            vat_rate=0.255,
+            template_type=kuittikone.TemplateType.VAT_BREAKDOWN
+        )
+        self.manager.add_company_preset(preset)
+        products = [
+            {"name": "Kaivinkone vuokra", "quantity": 1, "price": 100.0},
+            {"name": "Kahvi", "quantity": 3, "price": 2.5, "vat_rate": 0.14},
+            {"name": "B2B huolto", "quantity": 1, "price": 50.0, "vat_rate": 0.0}
+        ]
+        receipt = self.manager.generate_receipt(products, kuittikone.PaymentMethod.CASH, preset_id="vat_test")
+        
+        self.assertRegex(receipt, r"ALV 25\.5%: +25\.50 €")
+        self.assertRegex(receipt, r"ALV 14%: +1\.05 €")
+        self.assertRegex(receipt, r"ALV 0%: +0\.00 €")
+        self.assertRegex(receipt, r"YHTEENSÄ: +184\.05 €")
+        self.assertIn("ALV-ERITTELY", receipt)
+        self.assertRegex(receipt, r"\n14 +7\.50 +1\.05 +8\.55\n")
+        
+        # Corporate receipts list the rates but have no breakdown block
+        preset.template_type = kuittikone.TemplateType.CORPORATE
+        self.manager.add_company_preset(preset)
+        receipt = self.manager.generate_receipt(products, kuittikone.PaymentMethod.CASH, preset_id="vat_test")
+        self.assertRegex(receipt, r"ALV 14%: +1\.05 €")
+        self.assertNotIn("ALV-ERITTELY", receipt)
+    
+    def test_preset_cache(self):
+        """Test hydrated presets are reused until the preset changes"""
+        preset = kuittikone.CompanyPreset(
+            preset_id="cache_test",
+            company_name="Cache Test Oy",
+            business_id="FI444",
+            address="Cache St",
+            phone="123",
+            email="cache@test.com"
+        )
+        self.manager.add_company_preset(preset)
+        self.manager.switch_preset("cache_test")
+
+        first = self.manager.get_current_preset()
+        self.assertEqual(self.manager.preset_cache_info()["misses"], 1)
+
+        products = [{"name": "Item", "quantity": 1, "price": 10.0}]
+        for _ in range(5):
+            self.manager.generate_receipt(products, kuittikone.PaymentMethod.CASH)
+        self.assertIs(self.manager.get_company_preset("cache_test"), first)
+        self.assertIs(self.manager.list_presets()[0], first)
+
+        info = self.manager.preset_cache_info()
+        self.assertEqual(info["misses"], 1)
+        self.assertEqual(info["hits"], 7)
+
+        preset.company_name = "Renamed Oy"
+        self.manager.add_company_preset(preset)
+        updated = self.manager.get_company_preset("cache_test")
+        self.assertIsNot(updated, first)
+        self.assertEqual(updated.company_name, "Renamed Oy")
+        self.assertEqual(self.manager.preset_cache_info()["misses"], 2)
+
+        self.manager.delete_preset("cache_test")
+        self.assertIsNone(self.manager.get_company_preset("cache_test"))
+
+    def test_iter_receipt_chunks(self):
+        """Test streamed receipt matches generate_receipt and is produced lazily"""
+        preset = kuittikone.CompanyPreset(
+            preset_id="stream_test",
+            company_name="Stream Test Oy",
+            business_id="FI333",
+            address="Stream St",
+            phone="123",
+            email="stream@test.com"
+        )
+        preset.layout.show_warranty = True
+        self.manager.add_company_preset(preset)
+        self.manager.switch_preset("stream_test")
+        
+        serials = [f"STREAM-{i:03d}" for i in range(200)]
+        for serial in serials:
+            self.manager.warranty_db[serial] = kuittikone.WarrantyInfo(
+                serial_number=serial,
+                purchase_date=datetime.now().isoformat(),
+                warranty_months=12,
+                product_name="Rental unit"
+            )
+        products = [{"name": f"Unit {i}", "quantity": 1, "price": 5.0} for i in range(50)]
+        
+        chunks = list(self.manager.iter_receipt_chunks(
+            products, kuittikone.PaymentMethod.INVOICE, serial_numbers=serials
+        ))
+        receipt = self.manager.generate_receipt(
+            products, kuittikone.PaymentMethod.INVOICE, serial_numbers=serials
+        )
+        def strip_date(text):
+            return [line for line in text.split("\n") if not line.startswith("Päivämäärä")]
+        
+        self.assertEqual(strip_date("\n".join(chunks)), strip_date(receipt))
+        self.assertGreater(len(chunks), 250)
+        
+        # Header is available before products are consumed
+        def product_stream():
+            yield products[0]
+            raise AssertionError("products consumed too early")
+        
+        stream = self.manager.iter_receipt_chunks(product_stream(), kuittikone.PaymentMethod.CASH)
+        self.assertIn("Stream Test Oy", next(stream))
+    
+    def test_build_receipt_document(self):
+        """Test receipt document blocks are typed and match the text receipt"""
+        for preset in kuittikone.create_default_presets():
+            self.manager.add_company_preset(preset)
+        self.manager.switch_preset("hrk_default")
+        products = [{"name": "Kaivinkone", "quantity": 1, "price": 850.0}]
+        
+        document = self.manager.build_receipt_document(
+            products, kuittikone.PaymentMethod.CARD, kuittikone.CardType.VISA
+        )
+        kinds = [block.kind for block in document.blocks]
+        self.assertEqual(kinds[0], kuittikone.BlockType.HEADER)
+        self.assertIn(kuittikone.BlockType.ITEM, kinds)
+        self.assertIn(kuittikone.BlockType.PAYMENT, kinds)
+        self.assertIn(kuittikone.BlockType.PROMO, kinds)
+        self.assertEqual(kinds[-1], kuittikone.BlockType.FOOTER)
+        self.assertIn("Korttityyppi: Visa", document.text())
+    
+    def test_injectable_timestamp_and_render_cache(self):
+        """Test fixed timestamps give reproducible, cacheable receipts"""
+        cache = kuittikone.ReceiptRenderCache(max_bytes=1024 * 1024)
+        fixed = datetime(2025, 6, 1, 10, 15)
+        manager = kuittikone.KuittikoneManager(self.temp_file.name, clock=lambda: fixed, render_cache=cache)
+        for preset in kuittikone.create_default_presets():
+            manager.add_company_preset(preset)
+        manager.switch_preset("hrk_default")
+        products = [{"name": "Kaivinkone", "quantity": 1, "price": 850.0}]
+        
+        first = manager.generate_receipt(products, kuittikone.PaymentMethod.CARD, kuittikone.CardType.VISA)
+        self.assertIn("Päivämäärä: 01.06.2025 10:15", first)
+        second = manager.generate_receipt(products, kuittikone.PaymentMethod.CARD, kuittikone.CardType.VISA)
+        self.assertEqual(first, second)
+        self.assertEqual(cache.hits, 1)
+        self.assertGreater(cache.size_bytes, len(first))
+        
+        # A different timestamp is a different receipt
+        later = manager.generate_receipt(
+            products, kuittikone.PaymentMethod.CARD, kuittikone.CardType.VISA,
+            timestamp=datetime(2025, 6, 2, 9, 0)
+        )
+        self.assertIn("Päivämäärä: 02.06.2025 09:00", later)
+        self.assertEqual(cache.hits, 1)
+        
+        # Preset changes invalidate cached receipts
+        preset = manager.get_company_preset("hrk_default")
+        preset.footer_text = "Uusi alatunniste"
+        manager.add_company_preset(preset)
+        updated = manager.generate_receipt(products, kuittikone.PaymentMethod.CARD, kuittikone.CardType.VISA)
+        self.assertIn("Uusi alatunniste", updated)
+        self.assertEqual(cache.hits, 1)
+    
+    def test_generate_receipts_batch(self):
+        """Test batch generation keeps input order on a process pool"""
+        for preset in kuittikone.create_default_presets():
+            self.manager.add_company_preset(preset)
+        self.manager.switch_preset("hrk_default")
+
+        orders = []
+        for i in range(40):
+            products = [{"name": f"Item {i}", "quantity": 1, "price": float(i)}]
+            preset_id = "minimal_company" if i % 3 == 0 else None
+            orders.append((products, kuittikone.PaymentMethod.CARD, kuittikone.CardType.VISA, None, preset_id))
+
+        def strip_date(receipt):
+            return [line for line in receipt.split("\n") if not line.startswith("Päivämäärä")]
+
+        expected = [strip_date(self.manager.generate_receipt(*order)) for order in orders]
+        for workers in (1, 2):
+            results = self.manager.generate_receipts_batch(iter(orders), workers=workers, chunksize=4)
+            self.assertEqual([strip_date(r) for r in results], expected)
+
+    def test_stage_timer(self):
+        """Test a timer records render sections and config I/O"""
+        timer = kuittikone.StageTimer("kuittikone")
+        manager = kuittikone.KuittikoneManager(self.temp_file.name, timer=timer)
+        for preset in kuittikone.create_default_presets():
+            manager.add_company_preset(preset)
+        manager.switch_preset("hrk_default")
+        products = [{"name": "Pora", "quantity": 1, "price": 10.0}]
+        for _ in range(5):
+            manager.generate_receipt(products, kuittikone.PaymentMethod.CASH)
+        
+        histograms = timer.histograms()
+        self.assertEqual(histograms["receipt"]["count"], 5)
+        for stage in ("preset", "items", "totals", "payment", "load_config", "save_config", "snapshot"):
+            self.assertIn(stage, histograms)
+        self.assertEqual(histograms["items"]["count"], 5)
+        # Stages fit inside the whole receipt
+        self.assertLessEqual(histograms["items"]["total_ms"], histograms["receipt"]["total_ms"])
+        # Timed receipts are the same receipts
+        timestamp = datetime(2025, 6, 1, 12, 0)
+        self.assertEqual(
+            manager.generate_receipt(products, kuittikone.PaymentMethod.CASH, timestamp=timestamp),
+            kuittikone.KuittikoneManager(self.temp_file.name).generate_receipt(
+                products, kuittikone.PaymentMethod.CASH, timestamp=timestamp
+            )
+        )
+
+    def test_receipt_numbers(self):
+        """Test numbered receipts take one number per sale and preset"""
+        for preset in kuittikone.create_default_presets():
+            self.manager.add_company_preset(preset)
+        self.manager.switch_preset("hrk_default")
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.manager.sequencer = kuittikone.ReceiptSequencer(directory, block_size=8)
+        self.addCleanup(self.manager.sequencer.close)
+        self.manager.render_cache = kuittikone.ReceiptRenderCache()
+        products = [{"name": "Pora", "quantity": 1, "price": 10.0}]
+        timestamp = datetime(2025, 6, 1, 12, 0)
+        
+        def numbers(receipts):
+            return [int(re.search(r"Kuitti nro: (\d+)", r).group(1)) for r in receipts]
+        
+        receipts = [
+            self.manager.generate_receipt(products, kuittikone.PaymentMethod.CASH, timestamp=timestamp)
+            for _ in range(3)
+        ]
+        # Same sale repeated is three receipts, not three cache hits
+        self.assertEqual(numbers(receipts), [1, 2, 3])
+        self.assertEqual(self.manager.render_cache.hits, 0)
+        minimal = self.manager.generate_receipt(
+            products, kuittikone.PaymentMethod.CASH, preset_id="minimal_company"
+        )
+        self.assertEqual(numbers([minimal]), [1])
+        reprint = self.manager.generate_receipt(
+            products, kuittikone.PaymentMethod.CASH, timestamp=timestamp, receipt_number=2
+        )
+        self.assertEqual(reprint, receipts[1])
+        
+        # Receipts that are never printed give their number back
+        missing = self.manager.generate_receipt(products, kuittikone.PaymentMethod.CASH, preset_id="missing")
+        self.assertEqual(missing, "Error: No preset selected")
+        
+        def broken_totals(manager, preset, plan, sale):
+            raise RuntimeError("totals failed")
+            yield
+        
+        with unittest.mock.patch.dict(kuittikone.KuittikoneManager._SECTION_RENDERERS, {"totals": broken_totals}):
+            with self.assertRaises(RuntimeError):
+                self.manager.generate_receipt(products, kuittikone.PaymentMethod.CASH)
+        
+        # Previews do not use up numbers, checkouts do
+        lane = self.manager.open_lane("1")
+        lane.add_product("Nosturi", 1, 20.0)
+        self.assertNotIn("Kuitti nro", lane.preview(kuittikone.PaymentMethod.CASH))
+        self.assertEqual(numbers([lane.checkout(kuittikone.PaymentMethod.CASH)]), [4])
+        
+        orders = [(products, kuittikone.PaymentMethod.CASH, None, None, None)] * 20
+        batch = numbers(self.manager.generate_receipts_batch(orders, workers=2, chunksize=4))
+        self.assertEqual(len(set(batch)), 20)
+        self.assertTrue(all(number > 4 for number in batch))
+
     def test_backup_restore(self):
         """Test backup and restore functionality"""
         # Add some data
@@ -561,8 +1779,16 @@ class TestKuittikoneManager(unittest.TestCase):
         backup_files = list(Path(backup_dir).glob("kuittikone_backup_*.json"))
         self.assertEqual(len(backup_files), 1)
         
-        # Create new manager and restore
-        new_manager = kuittikone.KuittikoneManager(tempfile.NamedTemporaryFile(suffix='.json', delete=False).name)
+        # Create new manager with a warranty of its own and restore
+        new_config = tempfile.NamedTemporaryFile(suffix='.json', delete=False).name
+        self.addCleanup(remove_config, new_config)
+        new_manager = kuittikone.KuittikoneManager(new_config)
+        new_manager.add_warranty(kuittikone.WarrantyInfo(
+            serial_number="OLD-001",
+            purchase_date=datetime.now().isoformat(),
+            warranty_months=12,
+            product_name="Old Product"
+        ))
         result = new_manager.restore_from_usb(str(backup_files[0]))
         self.assertTrue(result)
         
@@ -574,6 +1800,389 @@ class TestKuittikoneManager(unittest.TestCase):
         restored_warranty = new_manager.get_warranty("BACKUP-001")
         self.assertIsNotNone(restored_warranty)
         self.assertEqual(restored_warranty.product_name, "Backup Product")
+        self.assertIsNone(new_manager.get_warranty("OLD-001"))
+        
+        # A warm restart reads the snapshot written by the restore
+        restarted = kuittikone.KuittikoneManager(new_config)
+        self.assertEqual(restarted.get_warranty("BACKUP-001").product_name, "Backup Product")
+        self.assertIsNone(restarted.get_warranty("OLD-001"))
+        self.assertIsNotNone(restarted.get_company_preset("backup_test"))
+
+
+class TestReadWriteLock(unittest.TestCase):
+    """Test ReadWriteLock class"""
+    
+    def test_readers_share_writers_exclude(self):
+        """Test readers run together and a writer waits for them"""
+        lock = kuittikone.ReadWriteLock()
+        both_reading = threading.Barrier(2, timeout=5)
+        events = []
+        
+        def reader():
+            with lock.read():
+                both_reading.wait()
+                time.sleep(0.05)
+                events.append("read")
+        
+        def writer():
+            with lock.write():
+                events.append("write")
+        
+        readers = [threading.Thread(target=reader) for _ in range(2)]
+        for thread in readers:
+            thread.start()
+        time.sleep(0.01)
+        writer_thread = threading.Thread(target=writer)
+        writer_thread.start()
+        for thread in readers + [writer_thread]:
+            thread.join(5)
+        self.assertEqual(events, ["read", "read", "write"])
+    
+    def test_reentrancy(self):
+        """Test nested sections and reading inside a write section"""
+        lock = kuittikone.ReadWriteLock()
+        with lock.write():
+            with lock.write():
+                with lock.read():
+                    pass
+        with lock.read():
+            with lock.read():
+                with self.assertRaises(RuntimeError):
+                    lock.acquire_write()
+        # Lock is free again for other threads
+        done = []
+        
+        def take_write():
+            with lock.write():
+                done.append(True)
+        
+        thread = threading.Thread(target=take_write)
+        thread.start()
+        thread.join(5)
+        self.assertEqual(done, [True])
+
+
+class ProbedLock(kuittikone.ReadWriteLock):
+    """ReadWriteLock recording any overlap of a writer with other holders"""
+    
+    HOLD = 0.0002  # Widens each section so a broken lock would overlap
+    
+    def __init__(self):
+        super().__init__()
+        self._state = threading.Lock()
+        self._depths = threading.local()
+        self.readers = 0
+        self.writers = 0
+        self.writes = 0
+        self.violations = []
+    
+    def _enter(self, side: str):
+        depth = getattr(self._depths, side, 0)
+        setattr(self._depths, side, depth + 1)
+        if depth or (side == "read" and getattr(self._depths, "write", 0)):
+            return  # Nested section of a thread already counted
+        with self._state:
+            if side == "write":
+                self.writers += 1
+                self.writes += 1
+                if self.writers != 1 or self.readers:
+                    self.violations.append(("write", self.writers, self.readers))
+            else:
+                self.readers += 1
+                if self.writers:
+                    self.violations.append(("read", self.writers, self.readers))
+        time.sleep(self.HOLD)
+    
+    def _leave(self, side: str):
+        depth = getattr(self._depths, side) - 1
+        setattr(self._depths, side, depth)
+        if depth or (side == "read" and getattr(self._depths, "write", 0)):
+            return
+        with self._state:
+            if side == "write":
+                self.writers -= 1
+            else:
+                self.readers -= 1
+    
+    def acquire_read(self):
+        super().acquire_read()
+        self._enter("read")
+    
+    def release_read(self):
+        self._leave("read")
+        super().release_read()
+    
+    def acquire_write(self):
+        super().acquire_write()
+        self._enter("write")
+    
+    def release_write(self):
+        self._leave("write")
+        super().release_write()
+
+
+class TestCheckoutLanes(unittest.TestCase):
+    """Test concurrent checkout lanes"""
+    
+    LANES = 16
+    
+    def setUp(self):
+        self.temp_file = tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False)
+        self.temp_file.close()
+        self.manager = kuittikone.KuittikoneManager(self.temp_file.name)
+        for i in range(self.LANES):
+            for brand in ("a", "b"):
+                self.manager.add_company_preset(kuittikone.CompanyPreset(
+                    preset_id=f"lane{i}{brand}",
+                    company_name=f"Lane {i} Oy",
+                    business_id=f"FI{i:04d}",
+                    address="Lane St",
+                    phone="123",
+                    email="lane@test.com",
+                    slogan=f"Brand {brand}"
+                ))
+        self.manager.switch_preset("lane0a")
+    
+    def tearDown(self):
+        remove_config(self.temp_file.name)
+    
+    def test_lane_state_is_separate(self):
+        """Test lanes keep their own preset and pending sale"""
+        lane1 = self.manager.open_lane("1", "lane1a")
+        lane2 = self.manager.open_lane("2")
+        self.assertIs(self.manager.open_lane("1"), lane1)
+        self.assertEqual(lane2.preset_id, "lane0a")
+        
+        self.assertTrue(lane1.switch_preset("lane1b"))
+        self.assertFalse(lane1.switch_preset("missing"))
+        self.assertEqual(self.manager.current_preset_id, "lane0a")
+        
+        lane1.add_product("Pora", 1, 10.0)
+        self.assertFalse(lane1.add_product("Virhe", 0, 10.0))
+        lane2.add_product("Nosturi", 1, 20.0)
+        receipt = lane1.checkout(kuittikone.PaymentMethod.CASH)
+        self.assertIn("Lane 1 Oy", receipt)
+        self.assertIn("Brand b", receipt)
+        self.assertIn("Pora", receipt)
+        self.assertNotIn("Nosturi", receipt)
+        self.assertEqual(lane1.products, [])
+        self.assertEqual(len(lane2.products), 1)
+        
+        self.assertEqual(len(self.manager.list_lanes()), 2)
+        self.assertTrue(self.manager.close_lane("1"))
+        self.assertFalse(self.manager.close_lane("1"))
+    
+    def _run_lane(self, lane_id: int, receipts: int, errors: list, start: threading.Barrier,
+                  printed: Optional[list] = None):
+        lane = self.manager.open_lane(f"lane-{lane_id}", f"lane{lane_id}a")
+        start.wait()
+        for n in range(receipts):
+            brand = "ab"[n % 2]
+            lane.switch_preset(f"lane{lane_id}{brand}")
+            lane.add_product(f"L{lane_id}-item-{n}", 1 + n % 3, 10.0 + lane_id)
+            lane.add_product(f"L{lane_id}-extra", 1, 1.0)
+            receipt = lane.checkout(kuittikone.PaymentMethod.CASH)
+            if printed is not None:
+                printed.append(receipt)
+            companies = set(re.findall(r"Lane (\d+) Oy", receipt))
+            items = set(re.findall(r"L(\d+)-", receipt))
+            if companies != {str(lane_id)} or items != {str(lane_id)} or f"Brand {brand}" not in receipt \
+                    or f"L{lane_id}-item-{n}\n" not in receipt:
+                errors.append((lane_id, n, receipt))
+    
+    def _run_lanes(self, lanes: int, receipts: int, with_writer: bool) -> List[str]:
+        errors = []
+        printed = []
+        start = threading.Barrier(lanes + 1, timeout=30)
+        threads = [
+            threading.Thread(target=self._run_lane, args=(i, receipts, errors, start, printed))
+            for i in range(lanes)
+        ]
+        stop = threading.Event()
+        
+        def writer():
+            n = 0
+            while not stop.is_set():
+                self.manager.add_warranty(kuittikone.WarrantyInfo(
+                    serial_number=f"SN-{n}",
+                    purchase_date=datetime.now().isoformat(),
+                    warranty_months=12,
+                    product_name="Pora"
+                ))
+                preset = self.manager.get_company_preset(f"lane{n % lanes}a")
+                self.manager.add_company_preset(kuittikone.CompanyPreset.from_dict(preset.to_dict()))
+                n += 1
+                time.sleep(0.001)
+        
+        writer_thread = threading.Thread(target=writer) if with_writer else None
+        for thread in threads:
+            thread.start()
+        if writer_thread:
+            writer_thread.start()
+        start.wait()
+        for thread in threads:
+            thread.join(60)
+        stop.set()
+        if writer_thread:
+            writer_thread.join(10)
+        
+        self.assertEqual(errors, [])
+        return printed
+    
+    def test_sixteen_concurrent_lanes(self):
+        """Test 16 lanes with a concurrent writer show no cross-lane bleed"""
+        self._run_lanes(self.LANES, 60, with_writer=True)
+        self.assertGreater(len(self.manager.warranty_db), 0)
+    
+    def test_lanes_with_writer_are_exact(self):
+        """Test no receipt is lost or duplicated and writes exclude all readers"""
+        # Throughput is measured by benchmarks/bench_lanes.py, not here
+        lock = ProbedLock()
+        self.manager._lock = lock
+        printed = self._run_lanes(self.LANES, 30, with_writer=True)
+        
+        self.assertEqual(len(printed), self.LANES * 30)
+        items = Counter(re.search(r"L\d+-item-\d+", receipt).group() for receipt in printed)
+        self.assertEqual(set(items.values()), {1})
+        self.assertEqual(set(items), {
+            f"L{lane_id}-item-{n}" for lane_id in range(self.LANES) for n in range(30)
+        })
+        self.assertGreater(lock.writes, 0)
+        self.assertEqual(lock.violations, [])
+        self.assertEqual((lock.readers, lock.writers), (0, 0))
+
+class TestAsyncKuittikoneManager(unittest.IsolatedAsyncioTestCase):
+    """Test asyncio facade"""
+    
+    def setUp(self):
+        self.temp_file = tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False)
+        self.temp_file.close()
+        self.backup_dir = tempfile.mkdtemp()
+        self.kassa = kuittikone.AsyncKuittikoneManager(config_file=self.temp_file.name, max_workers=2)
+        self.preset = kuittikone.CompanyPreset(
+            preset_id="async",
+            company_name="Async Oy",
+            business_id="FI555",
+            address="Loop St",
+            phone="123",
+            email="async@test.com"
+        )
+        self.preset.layout.show_warranty = True
+    
+    async def asyncTearDown(self):
+        await self.kassa.aclose()
+    
+    def tearDown(self):
+        remove_config(self.temp_file.name)
+        for backup in Path(self.backup_dir).glob("*.json"):
+            backup.unlink()
+        os.rmdir(self.backup_dir)
+    
+    async def test_async_operations(self):
+        """Test awaitable receipts, warranties, presets and backup/restore"""
+        self.assertTrue(await self.kassa.add_company_preset(self.preset))
+        self.assertTrue(await self.kassa.switch_preset("async"))
+        self.assertEqual((await self.kassa.get_company_preset("async")).company_name, "Async Oy")
+        self.assertEqual([p.preset_id for p in await self.kassa.list_presets()], ["async"])
+        
+        await self.kassa.add_warranty(kuittikone.WarrantyInfo(
+            serial_number="ASYNC-1",
+            purchase_date=datetime.now().isoformat(),
+            warranty_months=12,
+            product_name="Pora"
+        ))
+        self.assertEqual((await self.kassa.get_warranty("ASYNC-1")).product_name, "Pora")
+        self.assertIsNone(await self.kassa.get_warranty("missing"))
+        
+        receipt = await self.kassa.generate_receipt(
+            [{"name": "Pora", "quantity": 1, "price": 10.0}], kuittikone.PaymentMethod.CASH,
+            serial_numbers=["ASYNC-1"]
+        )
+        self.assertIn("Async Oy", receipt)
+        self.assertIn("ASYNC-1", receipt)
+        
+        self.assertTrue(await self.kassa.backup_to_usb(self.backup_dir))
+        self.assertTrue(await self.kassa.delete_preset("async"))
+        self.assertIsNone(await self.kassa.get_company_preset("async"))
+        await self.kassa.add_warranty(kuittikone.WarrantyInfo(
+            serial_number="ASYNC-2",
+            purchase_date=datetime.now().isoformat(),
+            warranty_months=12,
+            product_name="Nosturi"
+        ))
+        backup = next(Path(self.backup_dir).glob("kuittikone_backup_*.json"))
+        self.assertTrue(await self.kassa.restore_from_usb(str(backup)))
+        self.assertIsNotNone(await self.kassa.get_company_preset("async"))
+        self.assertIsNone(await self.kassa.get_warranty("ASYNC-2"))
+        
+        # A warm restart sees the restored warranties, not the replaced ones
+        restarted = kuittikone.KuittikoneManager(self.temp_file.name)
+        self.assertEqual(restarted.get_warranty("ASYNC-1").product_name, "Pora")
+        self.assertIsNone(restarted.get_warranty("ASYNC-2"))
+    
+    async def test_identical_reads_are_coalesced(self):
+        """Test concurrent identical reads share one call"""
+        await self.kassa.add_company_preset(self.preset)
+        products = [{"name": "Pora", "quantity": 2, "price": 10.0}]
+        timestamp = datetime(2024, 1, 15, 10, 30)
+        receipts = await asyncio.gather(*[
+            self.kassa.generate_receipt(products, kuittikone.PaymentMethod.CASH, timestamp=timestamp)
+            for _ in range(20)
+        ])
+        self.assertEqual(len(set(receipts)), 1)
+        self.assertEqual(self.kassa.coalesced, 19)
+        
+        # Different inputs are not merged, finished reads are not reused
+        await asyncio.gather(
+            self.kassa.get_warranty("A"), self.kassa.get_warranty("B"), self.kassa.get_warranty("A")
+        )
+        self.assertEqual(self.kassa.coalesced, 20)
+        await self.kassa.get_warranty("A")
+        self.assertEqual(self.kassa.coalesced, 20)
+        self.assertEqual(self.kassa._inflight, {})
+    
+    async def test_loop_runs_during_backup(self):
+        """Test a large backup runs on the thread pool while the event loop keeps ticking"""
+        manager = self.kassa.manager
+        manager.config["warranty_database"] = {
+            f"SN-{n}": {
+                "serial_number": f"SN-{n}",
+                "purchase_date": "2024-01-15T10:30:00",
+                "warranty_months": 24,
+                "product_name": f"Tuote {n}",
+                "notes": "Asiakas"
+            }
+            for n in range(20000)
+        }
+        manager._load_warranty_db()
+        
+        # The backup only finishes after the loop has ticked; run on the
+        # loop itself it would block those ticks and the wait would time out
+        ticked = threading.Event()
+        backup_threads = []
+        ticked_in_time = []
+        backup_to_usb = manager.backup_to_usb
+        
+        def backup(usb_path):
+            backup_threads.append(threading.current_thread())
+            ticked_in_time.append(ticked.wait(5))
+            return backup_to_usb(usb_path)
+        
+        with unittest.mock.patch.object(manager, "backup_to_usb", side_effect=backup):
+            backup_task = asyncio.ensure_future(self.kassa.backup_to_usb(self.backup_dir))
+            ticks = 0
+            while not backup_task.done():
+                await asyncio.sleep(0.001)
+                ticks += 1
+                if ticks == 10:
+                    ticked.set()
+            self.assertTrue(await backup_task)
+        
+        self.assertEqual(ticked_in_time, [True])
+        self.assertIsNot(backup_threads[0], threading.current_thread())
+        self.assertTrue(backup_threads[0].name.startswith("kuittikone"))
+        self.assertGreaterEqual(ticks, 10)
+        self.assertTrue(any(Path(self.backup_dir).glob("kuittikone_backup_*.json")))
 
 
 class TestDefaultPresets(unittest.TestCase):
@@ -645,7 +2254,7 @@ class TestIntegration(unittest.TestCase):
             
         finally:
             try:
-                os.unlink(temp_file.name)
+                remove_config(temp_file.name)
             except FileNotFoundError:
                 # It's OK if the file was already deleted
                 pass
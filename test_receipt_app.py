@@ -5,6 +5,7 @@ import os
 import sys
 import tempfile
 import unittest
+from unittest import mock
 from pathlib import Path
 
 # Add the current directory to path
@@ -108,6 +109,26 @@ class TestReceipt(unittest.TestCase):
         total = self.receipt.get_total()
         self.assertEqual(total, 310.0)
     
+    def test_running_totals(self):
+        """Test totals follow add, remove and clear in whole cents"""
+        self.receipt.add_product("Item 1", 3, 0.1)
+        self.receipt.add_product("Item 2", 1, 12.35)
+        self.receipt.add_product("Item 3", 2, 1.0)
+        self.receipt.remove_product(2)
+        self.assertEqual(self.receipt.totals.subtotal_cents, 1265)
+        self.assertEqual(self.receipt.get_subtotal(), 12.65)
+        self.assertEqual(self.receipt.get_vat_cents(), 304)
+        self.assertEqual(self.receipt.get_total(), 15.69)
+        
+        # Printed amounts add up
+        text = self.receipt.generate_text()
+        self.assertIn("12.65 €", text)
+        self.assertIn("3.04 €", text)
+        self.assertIn("15.69 €", text)
+        
+        self.receipt.clear_products()
+        self.assertEqual(self.receipt.get_total_cents(), 0)
+    
     def test_generate_text(self):
         """Test text receipt generation"""
         self.receipt.add_product("Kaivinkone 15t", 1, 850.0)
@@ -147,6 +168,92 @@ class TestReceiptPrinter(unittest.TestCase):
         finally:
             if os.path.exists(temp_path):
                 os.unlink(temp_path)
+    
+    def test_print_chunks_streams_to_lpr(self):
+        """Test chunks are written to lpr as they are produced"""
+        receipt = receipt_app.Receipt()
+        receipt.add_product("Test Product", 1, 10.0)
+        
+        written = []
+        
+        class FakeStdin:
+            def write(self, data):
+                written.append(data)
+            
+            def flush(self):
+                pass
+            
+            def close(self):
+                pass
+        
+        process = mock.Mock(stdin=FakeStdin())
+        process.wait.return_value = 0
+        
+        with mock.patch.object(receipt_app.platform, "system", return_value="Linux"), \
+                mock.patch.object(receipt_app.subprocess, "Popen", return_value=process) as popen:
+            result = receipt_app.ReceiptPrinter.print_chunks(receipt.iter_text_chunks())
+        
+        self.assertTrue(result)
+        popen.assert_called_once()
+        self.assertGreater(len(written), 1)
+        printed = b"".join(written).decode("utf-8")
+        # Minute may roll over between renders; compare everything but the date
+        self.assertEqual(printed.split("Päivämäärä")[0], receipt.generate_text().split("Päivämäärä")[0])
+        self.assertIn("YHTEENSÄ: 12.40 €", printed)
+    
+    def test_print_chunks_windows_text_file(self):
+        """Test notepad gets a UTF-8 text mode file, so lines end in \\r\\n on Windows"""
+        receipt = receipt_app.Receipt()
+        receipt.add_product("Test Product", 1, 10.0)
+        opened = []
+        printed = []
+        named_temporary_file = tempfile.NamedTemporaryFile
+        
+        def temp_file(**kwargs):
+            opened.append(kwargs)
+            return named_temporary_file(**kwargs)
+        
+        def notepad(command, check):
+            with open(command[-1], encoding="utf-8", newline="") as f:
+                printed.append(f.read())
+        
+        with mock.patch.object(receipt_app.platform, "system", return_value="Windows"), \
+                mock.patch.object(receipt_app.tempfile, "NamedTemporaryFile", side_effect=temp_file), \
+                mock.patch.object(receipt_app.subprocess, "run", side_effect=notepad):
+            self.assertTrue(receipt_app.ReceiptPrinter.print_chunks(receipt.iter_text_chunks()))
+        
+        self.assertEqual((opened[0]["mode"], opened[0]["encoding"]), ("w", "utf-8"))
+        self.assertEqual(
+            printed[0].split("Päivämäärä")[0],
+            receipt.generate_text().replace("\n", os.linesep).split("Päivämäärä")[0]
+        )
+    
+    def test_print_to_network_printer_segments(self):
+        """Test network printing sends bounded segments and reports where to resume"""
+        receipt = receipt_app.Receipt()
+        for i in range(100):
+            receipt.add_product(f"Product {i}", 1, 10.0)
+        text = receipt.generate_text()
+        
+        with mock.patch.object(receipt_app, "SegmentedPrinter") as printer:
+            self.assertTrue(receipt_app.ReceiptPrinter.print_to_network_printer(text, "printer.local", max_bytes=512))
+        segments, start, checksum = printer.return_value.print_segments.call_args[0]
+        self.assertGreater(len(segments), 1)
+        self.assertTrue(all(len(segment.data) <= 512 for segment in segments))
+        self.assertEqual((start, checksum), (0, None))
+        
+        printer.return_value.print_segments.side_effect = receipt_app.PrintInterrupted("stalled", 3, 1234)
+        with mock.patch.object(receipt_app, "SegmentedPrinter", printer), \
+                mock.patch("builtins.print") as output:
+            self.assertFalse(receipt_app.ReceiptPrinter.print_to_network_printer(text, "printer.local"))
+        self.assertIn("start_segment=3, start_checksum=1234", output.call_args[0][0])
+        
+        # Resuming a receipt that renders differently now is refused, not printed half
+        with mock.patch("builtins.print") as output:
+            self.assertFalse(receipt_app.ReceiptPrinter.print_to_network_printer(
+                text, "printer.local", start_segment=1, start_checksum=segments[0].checksum ^ 1
+            ))
+        self.assertIn("CRC-32", output.call_args[0][0])
 
 
 class TestTerminalApp(unittest.TestCase):
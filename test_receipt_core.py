@@ -0,0 +1,714 @@
+#!/usr/bin/env python3
+"""Test suite for receipt_core.py"""
+
+import dataclasses
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+import zlib
+from pathlib import Path
+
+# Add the current directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import receipt_core
+
+
+def _allocate_numbers(directory: str, count: int, block_size: int, close: bool = True):
+    """Sequencer worker process: returns its numbers"""
+    sequencer = receipt_core.ReceiptSequencer(directory, block_size=block_size)
+    numbers = [sequencer.allocate("hrk") for _ in range(count)]
+    if close:
+        sequencer.close()
+    return numbers
+
+
+def _allocate_and_crash(directory: str, count: int, durable: bool, key: str):
+    """Sequencer worker process that dies without closing its lease"""
+    sequencer = receipt_core.ReceiptSequencer(directory, block_size=100, durable=durable)
+    for _ in range(count):
+        sequencer.allocate(key)
+    os._exit(0)
+
+
+class TestReceiptDocument(unittest.TestCase):
+    """Test ReceiptDocument class"""
+    
+    def setUp(self):
+        """Set up a small document"""
+        self.document = receipt_core.ReceiptDocument([
+            receipt_core.ReceiptBlock(receipt_core.BlockType.HEADER, "Test Oy\nY-tunnus: FI1"),
+            receipt_core.ReceiptBlock(receipt_core.BlockType.ITEM, "1. Item\n   1 kpl x 5.00 € = 5.00 €"),
+            receipt_core.ReceiptBlock(receipt_core.BlockType.TOTALS, "YHTEENSÄ: 5.00 €"),
+            receipt_core.ReceiptBlock(receipt_core.BlockType.FOOTER, "Kiitos!")
+        ])
+    
+    def test_text_and_lines(self):
+        """Test text joins blocks and lines split them"""
+        text = self.document.text()
+        self.assertEqual(text, "\n".join(self.document.chunks()))
+        self.assertEqual(self.document.lines(), text.split("\n"))
+        self.assertEqual(len(self.document.lines()), 6)
+    
+    def test_text_backend(self):
+        """Test text backend returns plain text"""
+        self.assertEqual(receipt_core.TextBackend.render(self.document), self.document.text())
+    
+    def test_escpos_backend(self):
+        """Test ESC/POS backend styles blocks by type"""
+        data = receipt_core.EscPosBackend.render(self.document)
+        self.assertTrue(data.startswith(receipt_core.EscPosBackend.INIT))
+        self.assertTrue(data.endswith(receipt_core.EscPosBackend.CUT))
+        
+        totals = receipt_core.EscPosBackend.BOLD_ON + "YHTEENSÄ: 5.00 €\n".encode("cp858")
+        self.assertIn(totals, data)
+        header = receipt_core.EscPosBackend.ALIGN_CENTER + b"Test Oy"
+        self.assertIn(header, data)
+
+
+class FakePrinter:
+    """
+    Local network printer acknowledging segments like a real one
+
+    After stall_after acknowledged segments on the first connection it
+    stops answering and drops everything else it receives, like a
+    printer whose receive buffer overran. With stall_always it stays
+    stalled on later connections too.
+    """
+    
+    ACK_REQUEST = b"\x1D\x28\x48\x06\x00\x30\x30"
+    
+    def __init__(self, stall_after=None, stall_always=False):
+        self.stall_after = stall_after
+        self.stall_always = stall_always
+        self.printed = []  # (sequence, data) of processed segments
+        self.connections = []  # first sequence received on each connection
+        self.accepted = 0
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+    
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            with conn:
+                self.accepted += 1
+                self._handle(conn, stall=self.accepted == 1)
+    
+    def _handle(self, conn, stall):
+        buffer = b""
+        first = None
+        stalled = self.stall_always and self.accepted > 1
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return
+            if stalled:
+                continue
+            buffer += data
+            while True:
+                end = buffer.find(self.ACK_REQUEST)
+                if end < 0 or len(buffer) < end + len(self.ACK_REQUEST) + 4:
+                    break
+                digits = buffer[end + len(self.ACK_REQUEST):end + len(self.ACK_REQUEST) + 4]
+                sequence = int(digits)
+                if first is None:
+                    first = sequence
+                    self.connections.append(sequence)
+                self.printed.append((sequence, buffer[:end]))
+                buffer = buffer[end + len(self.ACK_REQUEST) + 4:]
+                conn.sendall(b"\x37\x22" + digits + b"\x00")
+                if stall and len(self.printed) == self.stall_after:
+                    stalled = True
+                    break
+    
+    def close(self):
+        self.server.close()
+
+
+class TestSegmentedPrinting(unittest.TestCase):
+    """Test print segmentation and resume"""
+    
+    def setUp(self):
+        blocks = [receipt_core.ReceiptBlock(receipt_core.BlockType.HEADER, "Vuokraamo Oy")]
+        for n in range(300):
+            blocks.append(receipt_core.ReceiptBlock(
+                receipt_core.BlockType.ITEM, f"{n}. Kaivinkone {n}\n   1 kpl x 100.00 € = 100.00 €"
+            ))
+        blocks.append(receipt_core.ReceiptBlock(
+            receipt_core.BlockType.WARRANTY, "\n".join(f"Takuuehto {n}: 24 kk" for n in range(200))
+        ))
+        blocks.append(receipt_core.ReceiptBlock(receipt_core.BlockType.TOTALS, "YHTEENSÄ: 30000.00 €"))
+        self.document = receipt_core.ReceiptDocument(blocks)
+        self.expected = receipt_core.EscPosBackend.render(self.document)
+    
+    def printer(self, fake, **kwargs):
+        self.addCleanup(fake.close)
+        kwargs.setdefault("ack_timeout", 0.3)
+        kwargs.setdefault("retry_delay", 0.01)
+        return receipt_core.SegmentedPrinter(
+            receipt_core.SocketPrinterTransport("127.0.0.1", fake.port, timeout=2.0), **kwargs
+        )
+    
+    def assert_printed(self, fake, segments):
+        """Assert every segment printed once in order, resumed ones after their header"""
+        resumed = set(fake.connections[1:])
+        self.assertEqual([sequence for sequence, _ in fake.printed], list(range(1, len(segments) + 1)))
+        for sequence, data in fake.printed:
+            segment = segments[sequence - 1]
+            self.assertEqual(data, segment.header + segment.data if sequence in resumed else segment.data)
+    
+    def test_segments_break_at_blocks(self):
+        """Test segments are bounded, split at blocks and checksummed"""
+        segments = receipt_core.segment_document(self.document, max_bytes=1024)
+        self.assertEqual(b"".join(s.data for s in segments), self.expected)
+        self.assertEqual([s.sequence for s in segments], list(range(1, len(segments) + 1)))
+        for segment in segments:
+            self.assertLessEqual(len(segment.header + segment.data), 1024)
+            self.assertEqual(segment.header, receipt_core.EscPosBackend.INIT)
+            self.assertEqual(segment.checksum, zlib.crc32(segment.data))
+        # Small blocks are never split, the oversized warranty block is split at line ends
+        for block in self.document.blocks[:-2]:
+            data = receipt_core.EscPosBackend.render_block(block)
+            self.assertTrue(any(data in s.data for s in segments))
+        self.assertTrue(any(s.data.startswith("Takuuehto".encode("cp858")) for s in segments))
+        with self.assertRaises(ValueError):
+            receipt_core.segment_document(self.document, max_bytes=10)
+    
+    def test_resume_after_stall(self):
+        """Test a printer stalling mid-job gets only the missing segments again"""
+        segments = receipt_core.segment_document(self.document, max_bytes=1024)
+        self.assertGreater(len(segments), 10)
+        fake = FakePrinter(stall_after=5)
+        printer = self.printer(fake, window=3)
+        self.assertEqual(printer.print_segments(segments), len(segments))
+        
+        self.assertEqual(printer.resends, 1)
+        self.assertEqual(fake.connections, [1, 6])
+        self.assert_printed(fake, segments)
+    
+    def test_interrupted_job_resumes_later(self):
+        """Test a job that keeps failing reports where to resume"""
+        segments = receipt_core.segment_document(self.document, max_bytes=1024)
+        fake = FakePrinter(stall_after=4, stall_always=True)
+        printer = self.printer(fake, retries=1)
+        with self.assertRaises(receipt_core.PrintInterrupted) as raised:
+            printer.print_segments(segments)
+        self.assertEqual(raised.exception.acked, 4)
+        self.assertEqual(raised.exception.checksum, segments[3].checksum)
+        self.assertIn(f"{segments[3].checksum:08x}", str(raised.exception))
+        acked, checksum = raised.exception.acked, raised.exception.checksum
+        
+        fake.stall_always = False
+        fake.stall_after = None
+        # A different job, or a segment changed since, is refused before anything is sent
+        other = receipt_core.segment_document(
+            receipt_core.ReceiptDocument(self.document.blocks[1:]), max_bytes=1024
+        )
+        with self.assertRaises(ValueError):
+            printer.print_segments(other, acked, checksum)
+        tampered = list(segments)
+        tampered[acked] = dataclasses.replace(segments[acked], data=segments[acked].data + b"!")
+        with self.assertRaises(ValueError):
+            printer.print_segments(tampered, acked, checksum)
+        self.assertEqual(len(fake.printed), acked)
+        
+        self.assertEqual(printer.print_segments(segments, acked, checksum), len(segments))
+        self.assert_printed(fake, segments)
+    
+    def test_resumed_segment_restores_style(self):
+        """Test a job resumed inside a styled block resets the printer and restores the style"""
+        backend = receipt_core.EscPosBackend
+        document = receipt_core.ReceiptDocument([
+            receipt_core.ReceiptBlock(receipt_core.BlockType.ITEM, "Kaivinkone"),
+            receipt_core.ReceiptBlock(
+                receipt_core.BlockType.FOOTER, "\n".join(f"Kiitos {n}" for n in range(60))
+            ),
+            receipt_core.ReceiptBlock(
+                receipt_core.BlockType.TOTALS, "\n".join(f"ALV {n}: 24 %" for n in range(60))
+            ),
+        ])
+        segments = receipt_core.segment_document(document, max_bytes=128)
+        self.assertEqual(b"".join(s.data for s in segments), backend.render(document))
+        headers = [s.header for s in segments]
+        self.assertIn(backend.INIT + backend.ALIGN_CENTER, headers)
+        self.assertIn(backend.INIT + backend.BOLD_ON, headers)
+        for segment in segments:
+            self.assertLessEqual(len(segment.header + segment.data), 128)
+        
+        # Resume right after the first segment that started mid-footer
+        middle = headers.index(backend.INIT + backend.ALIGN_CENTER)
+        fake = FakePrinter(stall_after=middle)
+        printer = self.printer(fake, window=1)
+        self.assertEqual(printer.print_segments(segments), len(segments))
+        self.assertEqual(fake.connections, [1, middle + 1])
+        self.assert_printed(fake, segments)
+        self.assertTrue(fake.printed[middle][1].startswith(backend.INIT + backend.ALIGN_CENTER + b"Kiitos"))
+    
+    def test_split_keeps_commands_and_characters(self):
+        """Test oversized blocks split at line ends, never inside a command or a character"""
+        backend = receipt_core.EscPosBackend
+        text = "\n".join(["Takuu"] * 10 + ["ä€" * 40] + ["Huolto"] * 10)
+        document = receipt_core.ReceiptDocument([
+            receipt_core.ReceiptBlock(receipt_core.BlockType.HEADER, text)
+        ])
+        segments = receipt_core.segment_document(document, max_bytes=64, encoding="utf-8")
+        self.assertEqual(b"".join(s.data for s in segments), backend.render(document, "utf-8"))
+        commands = (backend.INIT, backend.ALIGN_CENTER, backend.ALIGN_LEFT, backend.CUT)
+        for segment in segments:
+            self.assertLessEqual(len(segment.header + segment.data), 64)
+            data = segment.data
+            for command in commands:
+                data = data.replace(command, b"")
+            self.assertNotIn(b"\x1B", data)
+            self.assertNotIn(b"\x1D", data)
+            text_part = data.decode("utf-8")  # Raises on a cut character
+            # Short lines are never cut; only the overlong line may end mid-line
+            if text_part and "ä" not in text_part:
+                self.assertTrue(text_part.endswith("\n"), text_part)
+
+
+class TestReceiptRenderCache(unittest.TestCase):
+    """Test ReceiptRenderCache class"""
+    
+    def test_render_cache_key_is_stable(self):
+        """Test equal inputs give equal keys regardless of dict order"""
+        key1 = receipt_core.render_cache_key({"a": 1, "b": 2}, [1, 2], None)
+        key2 = receipt_core.render_cache_key({"b": 2, "a": 1}, [1, 2], None)
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, receipt_core.render_cache_key({"a": 1, "b": 3}, [1, 2], None))
+    
+    def test_get_put_and_stats(self):
+        """Test hits, misses and byte accounting"""
+        cache = receipt_core.ReceiptRenderCache(max_bytes=10000)
+        self.assertIsNone(cache.get("k1"))
+        cache.put("k1", "value", 100)
+        self.assertEqual(cache.get("k1"), "value")
+        
+        info = cache.info()
+        self.assertEqual(info["hits"], 1)
+        self.assertEqual(info["misses"], 1)
+        self.assertEqual(info["entries"], 1)
+        self.assertGreaterEqual(cache.size_bytes, 100)
+        
+        # Replacing a key does not double count its size
+        size = cache.size_bytes
+        cache.put("k1", "other", 100)
+        self.assertEqual(cache.size_bytes, size)
+    
+    def test_evicts_by_memory_budget(self):
+        """Test least recently used entries are evicted to fit the budget"""
+        cache = receipt_core.ReceiptRenderCache(max_bytes=1000)
+        cache.put("a", "A", 300)
+        cache.put("b", "B", 300)
+        cache.get("a")  # a is now most recently used
+        cache.put("c", "C", 300)
+        
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "A")
+        self.assertEqual(cache.get("c"), "C")
+        self.assertLessEqual(cache.size_bytes, 1000)
+        
+        # Entries bigger than the whole budget are not cached
+        cache.put("huge", "H", 5000)
+        self.assertIsNone(cache.get("huge"))
+        self.assertEqual(len(cache), 2)
+
+
+
+class TestStageTimer(unittest.TestCase):
+    """Test StageTimer and TimingHistogram"""
+    
+    def test_histogram_percentiles(self):
+        """Test percentiles are within one bucket of the exact values"""
+        histogram = receipt_core.TimingHistogram()
+        samples = [n / 1e6 for n in range(1, 1001)]  # 1 us ... 1 ms
+        for seconds in reversed(samples):
+            histogram.add(seconds)
+        summary = histogram.summary()
+        self.assertEqual(summary["count"], 1000)
+        self.assertEqual(summary["max_ms"], 1.0)
+        for key, exact in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+            self.assertGreaterEqual(summary[key], exact)
+            self.assertLessEqual(summary[key], exact * 1.0625)
+        self.assertEqual(receipt_core.TimingHistogram().summary()["p99_ms"], 0.0)
+    
+    def test_stages_and_dump(self):
+        """Test timed stages are aggregated and dumped as log lines"""
+        timer = receipt_core.StageTimer("test")
+        with timer.time("save"):
+            time.sleep(0.002)
+        self.assertEqual(list(timer.timed("numbers", range(3))), [0, 1, 2])
+        blocks = [
+            receipt_core.ReceiptBlock(receipt_core.BlockType.HEADER, "h"),
+            receipt_core.ReceiptBlock(receipt_core.BlockType.ITEM, "1"),
+            receipt_core.ReceiptBlock(receipt_core.BlockType.ITEM, "2"),
+            receipt_core.ReceiptBlock(receipt_core.BlockType.FOOTER, "f"),
+        ]
+        self.assertEqual(list(timer.timed_blocks(blocks)), blocks)
+        
+        histograms = timer.histograms()
+        self.assertEqual(sorted(histograms), ["footer", "header", "item", "numbers", "save"])
+        self.assertEqual(histograms["item"]["count"], 1)
+        self.assertGreaterEqual(histograms["save"]["max_ms"], 2.0)
+        
+        stream = io.StringIO()
+        timer.dump(stream)
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(set(lines[0]), {"ts", "level", "message", "meta"})
+        self.assertEqual(lines[0]["message"], "stage_timing")
+        self.assertEqual(lines[0]["meta"]["component"], "test")
+        self.assertLessEqual({"stage", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms"}, set(lines[0]["meta"]))
+        timer.reset()
+        self.assertEqual(timer.histograms(), {})
+
+
+class TestJsonFiles(unittest.TestCase):
+    """Test JSON config file helpers"""
+    
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(handle)
+    
+    def tearDown(self):
+        for path in (self.path, receipt_core.snapshot_path(self.path)):
+            if os.path.exists(path):
+                os.unlink(path)
+    
+    def test_backends_write_the_same_file(self):
+        """Test orjson and json backends give byte-identical files"""
+        data = {"presets": {"hrk": {"name": "Harjun Raskaskone Oy €", "vat_rate": 0.255, "rules": []}},
+                "warranty_database": {}, "empty": [], "n": 3, "ok": True, "none": None}
+        with unittest.mock.patch.object(receipt_core, "ORJSON_AVAILABLE", False):
+            receipt_core.dump_json_file(data, self.path)
+            with open(self.path, "rb") as f:
+                expected = f.read()
+            self.assertEqual(receipt_core.load_json_file(self.path), data)
+        self.assertEqual(expected, json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8"))
+        
+        receipt_core.dump_json_file(data, self.path)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), expected)
+        self.assertEqual(receipt_core.load_json_file(self.path), data)
+    
+    def test_non_string_keys(self):
+        """Test data orjson rejects is still written"""
+        receipt_core.dump_json_file({1: "yksi"}, self.path)
+        self.assertEqual(receipt_core.load_json_file(self.path), {"1": "yksi"})
+    
+    def test_snapshot_validation(self):
+        """Test snapshots are used only while the JSON file is unchanged"""
+        data = {"presets": {"hrk": {"name": "HRK"}}, "warranty_database": {"SN-1": {"notes": ""}}}
+        self.assertIsNone(receipt_core.load_json_snapshot(self.path))
+        payload = receipt_core.dump_json_file(data, self.path)
+        self.assertTrue(receipt_core.write_json_snapshot(self.path, data, payload))
+        self.assertEqual(receipt_core.load_json_snapshot(self.path), data)
+        
+        # Same size and mtime but different content is caught by the hash
+        stat = os.stat(self.path)
+        with open(self.path, "wb") as f:
+            f.write(payload.replace(b"HRK", b"XYZ"))
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIsNone(receipt_core.load_json_snapshot(self.path))
+        
+        # Re-snapshotting reads the file back
+        self.assertTrue(receipt_core.write_json_snapshot(self.path, receipt_core.load_json_file(self.path)))
+        self.assertEqual(receipt_core.load_json_snapshot(self.path)["presets"]["hrk"]["name"], "XYZ")
+        
+        with open(self.path, "ab") as f:
+            f.write(b"\n")
+        self.assertIsNone(receipt_core.load_json_snapshot(self.path))
+        
+        with open(receipt_core.snapshot_path(self.path), "wb") as f:
+            f.write(b"not a pickle")
+        self.assertIsNone(receipt_core.load_json_snapshot(self.path))
+
+
+class TestReceiptSequencer(unittest.TestCase):
+    """Test crash-safe receipt numbering"""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def _run_crashing_lane(self, count: int, durable: bool = False, key: str = "hrk"):
+        process = multiprocessing.Process(
+            target=_allocate_and_crash, args=(self.directory, count, durable, key)
+        )
+        process.start()
+        process.join(30)
+        self.assertEqual(process.exitcode, 0)
+    
+    def test_lanes_return_unused_numbers(self):
+        """Test unused numbers of a closed lane are handed out first"""
+        first = receipt_core.ReceiptSequencer(self.directory, block_size=4)
+        second = receipt_core.ReceiptSequencer(self.directory, block_size=4)
+        self.assertEqual([first.allocate("hrk") for _ in range(6)], [1, 2, 3, 4, 5, 6])
+        self.assertEqual([second.allocate("hrk") for _ in range(2)], [9, 10])
+        self.assertEqual(first.allocate("other"), 1)
+        first.close()
+        self.assertEqual([second.allocate("hrk") for _ in range(4)], [11, 12, 7, 8])
+        second.close()
+        
+        with receipt_core.ReceiptSequencer(self.directory, block_size=4) as third:
+            self.assertEqual(third.allocate("hrk"), 13)
+            self.assertEqual(third.info("hrk"), {"reserved": 16, "voided": 0})
+        with receipt_core.ReceiptSequencer(self.directory) as fourth:
+            self.assertEqual(fourth.allocate("hrk"), 14)
+            self.assertEqual(fourth.allocate("Kone & Co"), 1)
+    
+    def test_crashed_lane_numbers_are_reused(self):
+        """Test the rest of a crashed process's block is not lost"""
+        self._run_crashing_lane(10)
+        with receipt_core.ReceiptSequencer(self.directory, block_size=100) as sequencer:
+            numbers = [sequencer.allocate("hrk") for _ in range(100)]
+            self.assertEqual(numbers, list(range(11, 111)))
+            self.assertEqual(sequencer.info("hrk")["voided"], 0)
+    
+    def test_reboot_voids_unsynced_numbers(self):
+        """Test numbers that may not have reached the disk are never reissued"""
+        self._run_crashing_lane(10)
+        self._run_crashing_lane(10, durable=True, key="kone")
+        with unittest.mock.patch.object(receipt_core, "_BOOT_ID", receipt_core._BOOT_ID + 10**6):
+            with receipt_core.ReceiptSequencer(self.directory, block_size=100) as sequencer:
+                self.assertEqual(sequencer.allocate("hrk"), 101)
+                self.assertEqual(sequencer.info("hrk"), {"reserved": 200, "voided": 90})
+                # The durable lane synced every number, so its rest is reused
+                self.assertEqual(sequencer.allocate("kone"), 11)
+                self.assertEqual(sequencer.info("kone"), {"reserved": 100, "voided": 0})
+    
+    def test_processes_never_share_numbers(self):
+        """Test concurrent processes get unique, gap-free numbers"""
+        # Allocation speed is measured by benchmarks/bench_suite.py, not here
+        workers, count = 4, 20000
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.starmap(_allocate_numbers, [(self.directory, count, 100)] * workers)
+        numbers = [number for worker_numbers in results for number in worker_numbers]
+        self.assertEqual(len(set(numbers)), workers * count)
+        self.assertEqual(sorted(numbers), list(range(1, workers * count + 1)))
+        for worker_numbers in results:
+            self.assertEqual(worker_numbers, sorted(worker_numbers))
+    
+    def test_give_back(self):
+        """Test a returned number is reused, or voided once a later one is out"""
+        with receipt_core.ReceiptSequencer(self.directory, block_size=4) as sequencer:
+            self.assertEqual([sequencer.allocate("hrk") for _ in range(2)], [1, 2])
+            self.assertTrue(sequencer.give_back("hrk", 2))
+            self.assertEqual(sequencer.allocate("hrk"), 2)
+            first, second = sequencer.allocate("hrk"), sequencer.allocate("hrk")
+            self.assertFalse(sequencer.give_back("hrk", first))
+            self.assertEqual(sequencer.info("hrk"), {"reserved": 4, "voided": 1})
+            self.assertTrue(sequencer.give_back("hrk", second))
+            self.assertEqual(sequencer.allocate("hrk"), second)
+            # The voided number is never handed out again
+            self.assertEqual(sequencer.allocate("hrk"), 5)
+    
+    def test_rejects_foreign_files(self):
+        """Test a file that is not a sequence file is left alone"""
+        with open(os.path.join(self.directory, "hrk.seq"), "wb") as f:
+            f.write(b"receipt 1")
+        with self.assertRaises(ValueError):
+            receipt_core.ReceiptSequencer(self.directory).allocate("hrk")
+
+
+class TestTextLayout(unittest.TestCase):
+    """Test display widths and TextLayout"""
+    
+    def test_display_width(self):
+        """Test wide, narrow and zero-width characters"""
+        self.assertEqual(receipt_core.display_width("Kaivinkone"), 10)
+        self.assertEqual(receipt_core.display_width("Ämpäri €"), 8)
+        self.assertEqual(receipt_core.display_width("╔══╗ ✓"), 6)
+        self.assertEqual(receipt_core.display_width("Kortti 💳"), 9)
+        self.assertEqual(receipt_core.display_width("漢字"), 4)
+        self.assertEqual(receipt_core.display_width("e\u0301"), 1)
+    
+    def test_row(self):
+        """Test amounts are right-aligned and long names wrapped"""
+        layout = receipt_core.TextLayout(32)
+        row = layout.row("1. Ämpäri", "20.00 €")
+        self.assertEqual(receipt_core.display_width(row), 32)
+        self.assertTrue(row.endswith(" 20.00 €"))
+        
+        lines = layout.row("   Erittäin pitkä tuotenimi joka ei mahdu riville", "1234.50 €", "   ").split("\n")
+        self.assertGreater(len(lines), 1)
+        self.assertTrue(all(receipt_core.display_width(line) <= 32 for line in lines))
+        self.assertTrue(lines[0].startswith("   Erittäin"))
+        self.assertTrue(lines[1].startswith("   "))
+        self.assertTrue(lines[-1].endswith(" 1234.50 €"))
+        self.assertEqual(receipt_core.display_width(lines[-1]), 32)
+    
+    def test_wrap_and_clip(self):
+        """Test wrapping breaks overlong words and clip cuts lines"""
+        layout = receipt_core.TextLayout(10)
+        self.assertEqual(layout.wrap("Lyhyt"), "Lyhyt")
+        self.assertEqual(layout.wrap("Hydraulivasarat ja porat", "  "), "Hydrauliva\n  sarat ja\n  porat")
+        self.assertEqual(layout.wrap("💳💳💳💳💳💳"), "💳💳💳💳💳\n💳")
+        self.assertEqual(layout.clip("╔" + "═" * 20 + "╗\nok"), "╔" + "═" * 9 + "\nok")
+
+
+class TestKeywordMatcher(unittest.TestCase):
+    """Test Aho-Corasick keyword matching"""
+    
+    def test_matches_substring_search(self):
+        """Test results equal naive substring checks, including overlapping keywords"""
+        import random
+        rng = random.Random(5)
+        for _ in range(500):
+            keywords = ["".join(rng.choice("abä") for _ in range(rng.randint(1, 4))) for _ in range(6)]
+            texts = ["".join(rng.choice("abäAÄ ") for _ in range(rng.randint(0, 10))) for _ in range(3)]
+            expected = {
+                i for i, keyword in enumerate(keywords)
+                if any(keyword.casefold() in text.casefold() for text in texts)
+            }
+            self.assertEqual(receipt_core.KeywordMatcher(keywords).search(texts), expected)
+    
+    def test_matches_stay_within_one_text(self):
+        """Test case-insensitive matches that never span two texts"""
+        matcher = receipt_core.KeywordMatcher(["nosturi", "pora", "rinos"])
+        self.assertEqual(matcher.search(["Kevyt NOSTURI", "Iskupora"]), {0, 1})
+        self.assertEqual(matcher.search(["Ri", "nosturi"]), {0})
+        self.assertEqual(matcher.search([]), set())
+        with self.assertRaises(ValueError):
+            receipt_core.KeywordMatcher(["ok", ""])
+
+
+class TestMoney(unittest.TestCase):
+    """Test integer-cent money helpers"""
+    
+    def test_cents(self):
+        """Test conversion and formatting"""
+        self.assertEqual(receipt_core.to_cents(12.35), 1235)
+        self.assertEqual(receipt_core.to_cents(0.1 + 0.2), 30)
+        self.assertEqual(receipt_core.format_cents(1250), "12.50")
+        self.assertEqual(receipt_core.format_cents(5), "0.05")
+        self.assertEqual(receipt_core.format_cents(-1250), "-12.50")
+    
+    def test_vat_rounds_half_up(self):
+        """Test VAT is rounded half up to the cent"""
+        self.assertEqual(receipt_core.vat_cents(25000, 0.24), 6000)
+        self.assertEqual(receipt_core.vat_cents(1, 0.5), 1)
+        self.assertEqual(receipt_core.vat_cents(-1, 0.5), -1)
+        self.assertEqual(receipt_core.vat_cents(88775, 0.24), 21306)
+    
+    def test_money_totals(self):
+        """Test running totals follow adds and removes"""
+        totals = receipt_core.MoneyTotals()
+        totals.add(20000)
+        totals.add(5000)
+        totals.remove(20000)
+        self.assertEqual(totals.subtotal_cents, 5000)
+        self.assertEqual(totals.lines, 1)
+        self.assertEqual(totals.total_cents(0.24), 6200)
+        totals.reset([(100, None), (200, None)])
+        self.assertEqual((totals.subtotal_cents, totals.lines), (300, 2))
+    
+    def test_money_totals_mixed_rates(self):
+        """Test per-rate nets, VAT rounded once per rate"""
+        totals = receipt_core.MoneyTotals()
+        totals.add(10000, 0.255)
+        totals.add(750, 0.14)
+        totals.add(5000, 0.0)
+        totals.add(1001)
+        totals.add(333, 0.14)
+        totals.remove(333, 0.14)
+        self.assertEqual(totals.breakdown(0.24), [
+            (0.255, 10000, 2550), (0.24, 1001, 240), (0.14, 750, 105), (0.0, 5000, 0)
+        ])
+        self.assertEqual(totals.vat_cents(0.24), 2550 + 240 + 105)
+        self.assertEqual(totals.total_cents(0.24), 16751 + 2895)
+        
+        # Default-rate lines merge with explicit lines of the same rate
+        totals.add(1000, 0.24)
+        self.assertEqual(totals.breakdown(0.24)[1], (0.24, 2001, 480))
+        
+        # Discounts lower the net of their rate before VAT
+        totals.discount(1000, 0.255)
+        self.assertEqual(totals.breakdown(0.24)[0], (0.255, 9000, 2295))
+        self.assertEqual(totals.lines, 5)
+    
+    def test_allocate_cents(self):
+        """Test allocation sums exactly and stays within a cent of each proportion"""
+        import random
+        rng = random.Random(7)
+        for _ in range(500):
+            weights = [rng.choice([0, rng.randint(1, 50000)]) for _ in range(rng.randint(1, 20))]
+            if not sum(weights):
+                continue
+            total = rng.randint(0, sum(weights))
+            shares = receipt_core.allocate_cents(total, weights)
+            self.assertEqual(sum(shares), total)
+            for share, weight in zip(shares, weights):
+                self.assertLessEqual(abs(share - total * weight / sum(weights)), 1)
+                self.assertTrue(0 <= share <= weight)
+        self.assertEqual(receipt_core.allocate_cents(100, [1, 1, 1]), [33, 34, 33])
+        with self.assertRaises(ValueError):
+            receipt_core.allocate_cents(1, [0, 0])
+    
+    def test_format_vat_breakdown(self):
+        """Test the grouped block lists every rate and a total row"""
+        layout = receipt_core.TextLayout(32)
+        block = receipt_core.format_vat_breakdown([(0.255, 10000, 2550), (0.0, 5000, 0)], layout)
+        lines = block.split("\n")
+        self.assertTrue(lines[2].startswith("25.5"))
+        self.assertTrue(lines[2].endswith("125.50"))
+        self.assertTrue(lines[-1].endswith("175.50"))
+        self.assertTrue(all(receipt_core.display_width(line) <= 32 for line in lines))
+    
+    def test_batch_totals(self):
+        """Test batch totals round VAT per receipt"""
+        quantities = [2, 1, 1, 3]
+        prices = [100.0, 50.0, 0.01, 12.35]
+        receipt_ids = [0, 0, 1, 2]
+        result = receipt_core.batch_totals(quantities, prices, receipt_ids, 0.24)
+        self.assertEqual(list(result["subtotal_cents"]), [25000, 1, 3705])
+        self.assertEqual(list(result["vat_cents"]), [6000, 0, 889])
+        self.assertEqual(result["sum_total_cents"], 25000 + 6000 + 1 + 3705 + 889)
+        
+        single = receipt_core.batch_totals(quantities, prices)
+        self.assertEqual(single["sum_subtotal_cents"], 28706)
+        self.assertEqual(single["by_rate"], {0.24: (28706, 6889)})
+        
+        mixed = receipt_core.batch_totals(quantities, prices, receipt_ids, 0.24, [0.255, 0.14, 0.0, 0.255])
+        self.assertEqual(list(mixed["vat_cents"]), [5100 + 700, 0, 945])
+        self.assertEqual(mixed["by_rate"], {0.255: (23705, 6045), 0.14: (5000, 700), 0.0: (1, 0)})
+    
+    @unittest.skipUnless(receipt_core.NUMPY_AVAILABLE, "NumPy not installed")
+    def test_batch_totals_numpy_matches_python(self):
+        """Test the NumPy path gives the same cents as the pure Python path"""
+        import random
+        rng = random.Random(7)
+        count = 5000
+        quantities = [rng.randint(1, 5) for _ in range(count)]
+        prices = [round(rng.uniform(0, 500), rng.choice([1, 2, 3])) for _ in range(count)]
+        receipt_ids = [rng.randrange(400) for _ in range(count)]
+        
+        vat_rates = [rng.choice([0.255, 0.14, 0.1, 0.0]) for _ in range(count)]
+        
+        for rates in (None, vat_rates):
+            fast = receipt_core.batch_totals(quantities, prices, receipt_ids, 0.24, rates)
+            with unittest.mock.patch.object(receipt_core, "NUMPY_AVAILABLE", False):
+                slow = receipt_core.batch_totals(quantities, prices, receipt_ids, 0.24, rates)
+            for key in ("subtotal_cents", "vat_cents", "total_cents"):
+                self.assertEqual(list(fast[key]), slow[key])
+            self.assertEqual(fast["by_rate"], slow["by_rate"])
+            self.assertEqual(fast["sum_total_cents"], slow["sum_total_cents"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,10 +2,13 @@
 """Test suite for receipt_tool.py"""
 
 import os
+import shutil
 import sys
 import tempfile
 import unittest
 import json
+from datetime import datetime
+from unittest import mock
 from pathlib import Path
 
 # Add the current directory to path
@@ -119,6 +122,48 @@ class TestReceipt(unittest.TestCase):
         total = self.receipt.get_total()
         self.assertEqual(total, 310.0)
     
+    def test_running_totals(self):
+        """Test totals follow add, remove and clear in whole cents"""
+        self.receipt.add_product("Item 1", 3, 0.1)
+        self.receipt.add_product("Item 2", 1, 12.35)
+        self.receipt.add_product("Item 3", 2, 1.0)
+        self.receipt.remove_product(2)
+        self.assertEqual(self.receipt.totals.subtotal_cents, 1265)
+        self.assertEqual(self.receipt.get_subtotal(), 12.65)
+        self.assertEqual(self.receipt.get_vat_cents(), 304)
+        self.assertEqual(self.receipt.get_total(), 15.69)
+        
+        # Printed amounts add up
+        text = self.receipt.generate_text()
+        self.assertIn("12.65 €", text)
+        self.assertIn("3.04 €", text)
+        self.assertIn("15.69 €", text)
+        
+        self.receipt.clear_products()
+        self.assertEqual(self.receipt.get_total_cents(), 0)
+    
+    def test_totals_follow_product_edits(self):
+        """Test editing a listed product in place updates the totals"""
+        self.receipt.add_product("Item 1", 1, 10.0)
+        self.receipt.add_product("Item 2", 2, 5.0, 0.14)
+        item = self.receipt.products[0]
+        item.quantity = 3
+        self.assertEqual(self.receipt.get_subtotal_cents(), 4000)
+        item.price = 0.5
+        self.assertEqual(self.receipt.get_subtotal_cents(), 1150)
+        item.vat_rate = 0.14
+        self.assertEqual(self.receipt.get_vat_breakdown(), [(0.14, 1150, 161)])
+        self.assertRegex(self.receipt.generate_text(), r"YHTEENSÄ: +13\.11 €")
+        
+        # The list itself cannot be changed behind the totals' back
+        with self.assertRaises(TypeError):
+            self.receipt.products[0] = receipt_tool.Product("Item 3", 1, 99.0)
+        
+        # A removed product no longer moves the receipt's totals
+        self.receipt.remove_product(0)
+        item.quantity = 10
+        self.assertEqual(self.receipt.get_subtotal_cents(), 1000)
+    
     def test_generate_text(self):
         """Test text receipt generation"""
         self.receipt.add_product("Kaivinkone 15t", 1, 850.0)
@@ -131,6 +176,59 @@ class TestReceipt(unittest.TestCase):
         self.assertIn("ALV", text)
         self.assertIn("YHTEENSÄ", text)
     
+    def test_iter_text_chunks(self):
+        """Test chunked rendering matches full text"""
+        for i in range(3):
+            self.receipt.add_product(f"Item {i}", 1, 10.0)
+        chunks = list(self.receipt.iter_text_chunks())
+        
+        self.assertEqual("\n".join(chunks), self.receipt.generate_text())
+        # One chunk per product plus fixed sections
+        self.assertEqual(sum("kpl x" in chunk for chunk in chunks), 3)
+    
+    def test_fixed_timestamp(self):
+        """Test receipts with the same timestamp are identical"""
+        self.receipt.add_product("Item", 1, 10.0)
+        timestamp = receipt_tool.datetime(2025, 1, 2, 3, 4)
+        text = self.receipt.generate_text(timestamp)
+        self.assertIn("Päivämäärä: 02.01.2025 03:04", text)
+        self.assertEqual(text, self.receipt.generate_text(timestamp))
+    
+    def test_receipt_number(self):
+        """Test a sale keeps its receipt number until it is cleared"""
+        directory = tempfile.mkdtemp()
+        sequencer = receipt_tool.ReceiptSequencer(directory)
+        try:
+            receipt = receipt_tool.Receipt(config=self.test_config, sequencer=sequencer)
+            receipt.add_product("Item", 1, 10.0)
+            self.assertNotIn("Kuitti nro", receipt.generate_text())
+            self.assertEqual(receipt.assign_number(), 1)
+            self.assertEqual(receipt.assign_number(), 1)
+            self.assertIn("Kuitti nro: 1", receipt.generate_text())
+            receipt.clear_products()
+            self.assertIsNone(receipt.receipt_number)
+            self.assertEqual(receipt.assign_number(), 2)
+            self.assertIsNone(self.receipt.assign_number())
+        finally:
+            sequencer.close()
+            shutil.rmtree(directory)
+    
+    def test_stage_timer(self):
+        """Test a timer records generate_text by block type"""
+        timer = receipt_tool.StageTimer("receipt_tool")
+        receipt = receipt_tool.Receipt(config=self.test_config, timer=timer)
+        receipt.add_product("Item", 2, 10.0)
+        receipt.add_product("Other", 1, 5.0)
+        self.receipt.add_product("Item", 2, 10.0)
+        self.receipt.add_product("Other", 1, 5.0)
+        timestamp = receipt_tool.datetime(2025, 1, 2, 3, 4)
+        self.assertEqual(receipt.generate_text(timestamp), self.receipt.generate_text(timestamp))
+        histograms = timer.histograms()
+        self.assertEqual(histograms["receipt"]["count"], 1)
+        self.assertEqual(histograms["item"]["count"], 1)
+        for stage in ("header", "date", "totals", "footer"):
+            self.assertIn(stage, histograms)
+    
     def test_get_logo(self):
         """Test getting logo"""
         logo = self.receipt.get_logo()
@@ -203,6 +301,85 @@ class TestReceipt(unittest.TestCase):
         text = self.receipt.generate_text()
         self.assertIsInstance(text, str)
 
+    
+    def test_template_inheritance(self):
+        """Test templates extend their parent and are compiled once"""
+        self.test_config["templates"] = dict(self.test_config.get("templates", {}))
+        self.test_config["templates"]["base"] = {
+            "logo": "{name}",
+            "header_format": "{name} / {business_id}",
+            "footer": "Base footer"
+        }
+        self.test_config["templates"]["child"] = {"extends": "base", "footer": "Child footer"}
+        self.receipt.current_template = "child"
+        
+        text = self.receipt.generate_text()
+        name = self.receipt.company_info["name"]
+        self.assertIn(f"{name} / {self.receipt.company_info['business_id']}", text)
+        self.assertIn("Child footer", text)
+        self.assertNotIn("Base footer", text)
+        self.assertEqual(self.receipt.get_logo(), name)
+        
+        # Same template and company info reuse the compiled template
+        self.assertIs(self.receipt.get_template(), self.receipt.get_template())
+        self.receipt.company_info = dict(self.receipt.company_info, name="Other Oy")
+        self.assertEqual(self.receipt.get_logo(), "Other Oy")
+    
+    def test_render_cache_follows_parent_template(self):
+        """Test editing a parent template misses the cached document of its child"""
+        from datetime import datetime
+        templates = dict(self.test_config.get("templates", {}))
+        templates["base"] = {"logo": "{name}", "footer": "Base footer"}
+        templates["child"] = {"extends": "base"}
+        self.test_config["templates"] = templates
+        receipt = receipt_tool.Receipt(config=self.test_config, render_cache=receipt_tool.ReceiptRenderCache())
+        receipt.add_product("Test Product", 1, 10.0)
+        receipt.current_template = "child"
+        timestamp = datetime(2025, 6, 1, 12, 0)
+        
+        first = receipt.build_document(timestamp)
+        self.assertIs(receipt.build_document(timestamp), first)
+        templates["base"] = {"logo": "{name}", "footer": "Edited footer"}
+        edited = receipt.build_document(timestamp)
+        self.assertIsNot(edited, first)
+        self.assertIn("Edited footer", edited.text())
+        self.assertNotIn("Base footer", edited.text())
+    
+    def test_column_layout(self):
+        """Test product rows are wrapped and right-aligned to the width"""
+        self.receipt.width = 32
+        self.receipt.add_product("Hydraulivasara HM-200 erikoispitkällä nimellä", 1, 1250.0)
+        self.receipt.add_product("Ämpäri", 3, 2.5)
+        lines = self.receipt.generate_text().split("\n")
+        price_rows = [line for line in lines if " kpl x " in line]
+        self.assertEqual(len(price_rows), 2)
+        self.assertTrue(all(receipt_tool.display_width(line) == 32 for line in price_rows))
+        self.assertTrue(all(line.endswith(" €") for line in price_rows))
+    
+    def test_mixed_vat_rates(self):
+        """Test per-product VAT rates and the VAT breakdown template"""
+        self.receipt.add_product("Vuokra", 1, 100.0, vat_rate=0.255)
+        self.receipt.add_product("Kahvi", 3, 2.5, vat_rate=0.14)
+        self.receipt.add_product("Huolto", 1, 50.0)
+        self.assertFalse(self.receipt.add_product("Virhe", 1, 1.0, vat_rate=-0.1))
+        self.assertEqual(self.receipt.get_vat_breakdown(), [
+            (0.255, 10000, 2550), (0.24, 5000, 1200), (0.14, 750, 105)
+        ])
+        self.assertEqual(self.receipt.get_total_cents(), 15750 + 3855)
+        
+        text = self.receipt.generate_text()
+        self.assertRegex(text, r"ALV 25\.5%: +25\.50 €")
+        self.assertNotIn("ALV-ERITTELY", text)
+        
+        self.receipt.current_template = "vat_breakdown"
+        text = self.receipt.generate_text()
+        self.assertIn("ALV-ERITTELY", text)
+        self.assertRegex(text, r"\n14 +7\.50 +1\.05 +8\.55\n")
+        
+        self.receipt.remove_product(1)
+        self.assertEqual(self.receipt.get_vat_cents(), 3750)
+        self.assertEqual(self.receipt.products[0].to_dict()["vat_rate"], 0.255)
+        self.assertNotIn("vat_rate", self.receipt.products[1].to_dict())
 
 class TestReceiptExporter(unittest.TestCase):
     """Test ReceiptExporter class"""
@@ -231,6 +408,28 @@ class TestReceiptExporter(unittest.TestCase):
             if os.path.exists(temp_path):
                 os.unlink(temp_path)
     
+    def test_export_document(self):
+        """Test exporting a document rendered once"""
+        document = self.receipt.build_document()
+        
+        with tempfile.NamedTemporaryFile(suffix=".txt", delete=False) as f:
+            temp_path = f.name
+        
+        try:
+            with mock.patch.object(self.receipt, "iter_blocks", side_effect=AssertionError("re-rendered")):
+                result = receipt_tool.ReceiptExporter.export_txt(document, temp_path)
+            self.assertTrue(result)
+            
+            with open(temp_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            self.assertEqual(content, document.text())
+            kinds = [block.kind for block in document.blocks]
+            self.assertIn(receipt_tool.BlockType.ITEM, kinds)
+            self.assertIn(receipt_tool.BlockType.TOTALS, kinds)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+    
     def test_export_pdf(self):
         """Test PDF export"""
         if not receipt_tool.REPORTLAB_AVAILABLE:
@@ -260,6 +459,46 @@ class TestReceiptToolCLI(unittest.TestCase):
         cli = receipt_tool.ReceiptToolCLI()
         self.assertIsNotNone(cli.receipt)
     
+    def test_numbered_saves(self):
+        """Test each saved receipt takes a new number and a failed save gives its number back"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config_file = os.path.join(directory, "receipt_tool.json")
+        sequencer = receipt_tool.ReceiptSequencer(os.path.join(directory, "numbers"))
+        self.addCleanup(sequencer.close)
+        with mock.patch.object(receipt_tool, "CONFIG_FILE", config_file), mock.patch("builtins.print"):
+            cli = receipt_tool.ReceiptToolCLI(sequencer)
+            cli.receipt.add_product("Pora", 1, 10.0)
+            cli.save_txt(os.path.join(directory, "first.txt"))
+            cli.save_txt(os.path.join(directory, "missing", "failed.txt"))
+            cli.save_txt(os.path.join(directory, "second.txt"))
+        
+        for name, number in (("first.txt", 1), ("second.txt", 2)):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                self.assertIn(f"Kuitti nro: {number}\n", f.read())
+        self.assertEqual([item["receipt_number"] for item in cli.receipt.config["history"]], [2, 1])
+        self.assertIsNone(cli.receipt.receipt_number)
+        self.assertEqual(sequencer.info("receipt_tool")["voided"], 0)
+    
+    def test_save_records_exported_receipt(self):
+        """Test history gets the saved receipt, rendered once with one timestamp"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        ticks = iter(datetime(2024, 1, 15, 10, minute) for minute in range(30, 60))
+        with mock.patch.object(receipt_tool, "CONFIG_FILE", os.path.join(directory, "receipt_tool.json")), \
+                mock.patch("builtins.print"):
+            cli = receipt_tool.ReceiptToolCLI()
+            cli.receipt.clock = lambda: next(ticks)
+            cli.receipt.add_product("Pora", 1, 10.0)
+            with mock.patch.object(cli.receipt, "_render_blocks", wraps=cli.receipt._render_blocks) as render:
+                cli.save_txt(os.path.join(directory, "receipt.txt"))
+        
+        render.assert_called_once()
+        item = cli.receipt.config["history"][0]
+        self.assertEqual(item["timestamp"], "2024-01-15T10:30:00")
+        with open(os.path.join(directory, "receipt.txt"), encoding="utf-8") as f:
+            self.assertEqual(item["text_preview"], f.read()[:200])
+    
     def test_smoke_test(self):
         """Test smoke test functionality"""
         # This should run without errors